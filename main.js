@@ -17,52 +17,218 @@ let AUDIO = null;
 
 let WIDGET_I = 0;
 
+// the maximum number of fetched pages and images kept in the page cache
+const PAGE_CACHE_SIZE = 64;
+
+// the service worker which caches the navigation data, served from the same
+// directory as the page
+const SERVICE_WORKER_URL = 'service-worker.js';
+
+// the number of chapter index entries added each time the end of the index
+// scrolls into view
+const INDICE_BATCH_SIZE = 50;
+
 var ESTORIA = (function () {
     return {
         get_version: function () {
             return "0.1";
         },
 
+        // the state of the chapter index, which is added to the page a batch
+        // of entries at a time as the end of the list scrolls into view
+        indice: null,
+
         load_indice: function () {
-            var windowheight;
-            var filename = DATA_PATH + "indice.json";
             $.ajax({
-                url: filename,
-                success: function (data) {ESTORIA.do_load_indice(data);},
+                url: DATA_PATH + 'indice/manifest.json',
                 dataType: 'json'
-            });
-            windowheight = $('#page-wrapper').height();
-        },
-
-        do_load_indice: function (data) {
-            var list, html, ms;
-            html = [];
-            list = document.getElementById('side-menu');
-            for (let key in data) {
-                if (data.hasOwnProperty(key)) {
-                    html.push('<li><div class="indice-entry"><span class="divnum">Chapter ' + data[key].div + '</span><span class="PCGchap">[' + data[key].PCG + ']</span><br/><span title="' + data[key].title + '">' + data[key].title.substring(0, 35) + '...</span>');
-                    html.push('<br/><select class="form-select form-select-sm ms-select" id="ms-select-' + key + '">');
-                    html.push('<option value="none">select</option>');
-                    for (let i = 0; i < data[key].manuscripts.length; i+=1) {
-                        ms = data[key].manuscripts[i];
-                        if (data[key].pages.hasOwnProperty(ms)) {
-                            html.push('<option value="' + ms + '|' + data[key].pages[ms] + '">' + ms + '</option>');
-                        }
+            }).done(function (manifest) {
+                ESTORIA.start_indice(function (chunk) {
+                    if (chunk >= manifest.chunks) {
+                        return $.Deferred().resolve(null).promise();
                     }
-                    html.push('</select><br/></div></li>');
+                    return $.ajax({
+                        url: DATA_PATH + 'indice/' + chunk + '.json',
+                        dataType: 'json'
+                    });
+                });
+            }).fail(function () {
+                // builds from before the index was split into chunks only
+                // have indice.json
+                ESTORIA.start_indice(function (chunk) {
+                    if (chunk > 0) {
+                        return $.Deferred().resolve(null).promise();
+                    }
+                    return $.ajax({
+                        url: DATA_PATH + 'indice.json',
+                        dataType: 'json'
+                    });
+                });
+            });
+        },
+
+        start_indice: function (load_chunk) {
+            // load_chunk returns a promise of the nth chunk of the index or
+            // of null when there are no more
+            var list = document.getElementById('side-menu');
+            var sentinel = document.createElement('li');
+            list.innerHTML = '';
+            list.appendChild(sentinel);
+            // the index scrolls inside its sidebar rather than the page so
+            // the sentinel is watched in the sidebar
+            var observer = new IntersectionObserver(function (observed) {
+                if (observed[0].isIntersecting) {
+                    ESTORIA.extend_indice();
                 }
-            }
-            list.innerHTML = html.join('');
-            $('.ms-select').change(function (event) {
+            }, {root: document.getElementById('index_sidebar'), rootMargin: '500px'});
+            ESTORIA.indice = {
+                load_chunk: load_chunk,
+                chunk: 0,
+                entries: [],
+                loading: false,
+                finished: false,
+                sentinel: sentinel,
+                observer: observer
+            };
+            ESTORIA.indice.observer.observe(sentinel);
+            $(list).on('change', '.ms-select', function (event) {
                 var temp;
                 if (event.target.value != 'none') {
                     temp = event.target.value.split('|');
                     new Transcription(temp[0], temp[1]);
-                    document.getElementById(event.target.id).value = 'none';
+                    event.target.value = 'none';
                 }
             });
         },
 
+        extend_indice: function () {
+            var indice = ESTORIA.indice;
+            var html = [];
+            if (indice.loading) {
+                return;
+            }
+            if (indice.entries.length < INDICE_BATCH_SIZE && !indice.finished) {
+                indice.loading = true;
+                indice.load_chunk(indice.chunk).done(function (data) {
+                    indice.loading = false;
+                    indice.chunk += 1;
+                    if (data === null) {
+                        indice.finished = true;
+                    } else {
+                        for (let key in data) {
+                            if (data.hasOwnProperty(key)) {
+                                indice.entries.push(data[key]);
+                            }
+                        }
+                    }
+                    ESTORIA.extend_indice();
+                }).fail(function () {
+                    // try again the next time the end of the list comes into view
+                    indice.loading = false;
+                });
+                return;
+            }
+            var batch = indice.entries.splice(0, INDICE_BATCH_SIZE);
+            for (let i = 0; i < batch.length; i++) {
+                ESTORIA.add_indice_entry(html, batch[i]);
+            }
+            indice.sentinel.insertAdjacentHTML('beforebegin', html.join(''));
+            indice.observer.unobserve(indice.sentinel);
+            if (indice.finished && indice.entries.length === 0) {
+                indice.sentinel.remove();
+            } else {
+                // observing again reports whether the end of the list is
+                // still in view after adding this batch
+                indice.observer.observe(indice.sentinel);
+            }
+        },
+
+        add_indice_entry: function (html, entry) {
+            var ms;
+            html.push('<li><div class="indice-entry"><span class="divnum">Chapter ' + entry.div + '</span><span class="PCGchap">[' + entry.PCG + ']</span><br/><span title="' + entry.title + '">' + entry.title.substring(0, 35) + '...</span>');
+            html.push('<br/><select class="form-select form-select-sm ms-select">');
+            html.push('<option value="none">select</option>');
+            for (let i = 0; i < entry.manuscripts.length; i+=1) {
+                ms = entry.manuscripts[i];
+                if (entry.pages.hasOwnProperty(ms)) {
+                    html.push('<option value="' + ms + '|' + entry.pages[ms] + '">' + ms + '</option>');
+                }
+            }
+            html.push('</select><br/></div></li>');
+        },
+
+        // the promise of the search shard manifest, loaded on the first search
+        search_manifest: null,
+
+        normalise_search_term: function (text) {
+            // this must match normalise in make_search_index.py
+            return text.toLowerCase().replace(/ſ/g, 's').replace(/⁊/g, 'et')
+                .normalize('NFD').replace(/\p{M}/gu, '').normalize('NFC');
+        },
+
+        search: function (query) {
+            // returns a promise of the postings ([siglum, page, verse]) which
+            // contain all of the words in the query. Words are split as in
+            // tokenise in make_search_index.py
+            var terms = ESTORIA.normalise_search_term(query).match(/[\p{L}\p{N}_]+/gu) || [];
+            if (terms.length === 0) {
+                return Promise.resolve([]);
+            }
+            if (ESTORIA.search_manifest === null) {
+                var request = $.ajax({
+                    url: DATA_PATH + 'search/manifest.json',
+                    dataType: 'json'
+                }).fail(function () {
+                    // don't keep failures so the next search tries again
+                    if (ESTORIA.search_manifest === request) {
+                        ESTORIA.search_manifest = null;
+                    }
+                });
+                ESTORIA.search_manifest = request;
+            }
+            return Promise.resolve(ESTORIA.search_manifest).then(function (manifest) {
+                return Promise.all(terms.map(function (term) {
+                    var prefix = Array.from(term).slice(0, manifest.prefix_length).join('');
+                    if (!manifest.shards.hasOwnProperty(prefix)) {
+                        return {};
+                    }
+                    return PAGE_CACHE.fetch(DATA_PATH + 'search/' + manifest.shards[prefix] + '.json', 'json');
+                })).then(function (shards) {
+                    var results = shards[0][terms[0]] || [];
+                    for (let i = 1; i < terms.length; i++) {
+                        var found = new Set((shards[i][terms[i]] || []).map(function (posting) {
+                            return posting.join('|');
+                        }));
+                        results = results.filter(function (posting) {
+                            return found.has(posting.join('|'));
+                        });
+                    }
+                    return results;
+                });
+            });
+        },
+
+        setup_search: function () {
+            $('#search-form').submit(function (event) {
+                event.preventDefault();
+                ESTORIA.search($('#search-input').val()).then(ESTORIA.show_search_results);
+            });
+        },
+
+        show_search_results: function (postings) {
+            var html = [];
+            for (let i = 0; i < postings.length; i++) {
+                html.push('<li><a href="#" class="search-result" data-ms="' + postings[i][0] + '" data-page="' + postings[i][1] + '">'
+                          + postings[i][0] + ' ' + postings[i][1]
+                          + (postings[i][2] ? ' (' + postings[i][2] + ')' : '') + '</a></li>');
+            }
+            $('#search-results').html(html.join(''));
+            $('#search-results .search-result').click(function (event) {
+                event.preventDefault();
+                new Transcription($(this).attr('data-ms'), $(this).attr('data-page'));
+            });
+        },
+
         add_index_toggle: function () {
             $('#index_toggle').click(function () {
                 if (document.getElementById('index_sidebar').style.display === 'none') {
@@ -156,12 +322,159 @@ var ESTORIA = (function () {
                          + page + '</option>');
         },
 
+        // page list requests for each manuscript, keyed by siglum
+        menu_chunks: {},
+
+        load_menu: function (key) {
+            var request;
+            if (!ESTORIA.menu_chunks.hasOwnProperty(key)) {
+                request = $.ajax({
+                    url: DATA_PATH + 'menu/' + key + '.json',
+                    dataType: 'json'
+                }).done(function (pages) {
+                    ESTORIA.add_menu_item(key, pages);
+                }).fail(function () {
+                    // don't keep failures so the list can be requested again
+                    if (ESTORIA.menu_chunks[key] === request) {
+                        delete ESTORIA.menu_chunks[key];
+                    }
+                });
+                ESTORIA.menu_chunks[key] = request;
+            }
+            return ESTORIA.menu_chunks[key];
+        },
+
+        // the abbreviation hover over dictionary request and the keys it has
+        // been requested again for
+        abbreviations: null,
+        abbreviations_rechecked: {},
+
+        request_abbreviations: function () {
+            var request = $.ajax({
+                url: DATA_PATH + 'abbreviations.json',
+                dataType: 'json'
+            }).fail(function () {
+                // don't keep failures so the dictionary can be requested again
+                if (ESTORIA.abbreviations === request) {
+                    ESTORIA.abbreviations = null;
+                }
+            });
+            ESTORIA.abbreviations = request;
+            return request;
+        },
+
+        load_abbreviations: function (key) {
+            // returns a promise of the dictionary. The preview server's
+            // dictionary only has the pages it has made so far so if the key
+            // is missing the dictionary is requested again, once for each key
+            var request = ESTORIA.abbreviations;
+            if (request === null) {
+                request = ESTORIA.request_abbreviations();
+            }
+            return request.then(function (abbreviations) {
+                if (abbreviations.hasOwnProperty(key)
+                        || ESTORIA.abbreviations_rechecked.hasOwnProperty(key)) {
+                    return abbreviations;
+                }
+                ESTORIA.abbreviations_rechecked[key] = true;
+                if (ESTORIA.abbreviations === request) {
+                    ESTORIA.request_abbreviations();
+                }
+                return ESTORIA.abbreviations || abbreviations;
+            });
+        },
+
+        setup_tooltips: function () {
+            // a single delegated handler binds each hover over the first time
+            // the mouse reaches it, so inserting a page into a widget does no
+            // tooltip work however many widgets are open. Pages made before
+            // the abbreviation dictionary have their hover overs in title and
+            // data-tooltip-content, which tooltipster reads itself. If the
+            // dictionary can't be loaded the hover over is left unbound so the
+            // next mouseenter tries again.
+            $(document).on('mouseenter', '.hoverover:not(.tooltipstered)', function () {
+                var origin = $(this);
+                var key = origin.attr('data-abbreviation');
+                var ready;
+                if (origin.data('tooltip-pending')) {
+                    return;
+                }
+                origin.data('tooltip-pending', true);
+                if (key === undefined) {
+                    ready = $.Deferred().resolve().promise();
+                } else {
+                    ready = ESTORIA.load_abbreviations(key);
+                }
+                ready.fail(function () {
+                    origin.removeData('tooltip-pending');
+                });
+                ready.done(function (abbreviations) {
+                    origin.tooltipster({
+                        theme: 'tooltipster-light'
+                    });
+                    if (key !== undefined && abbreviations && abbreviations.hasOwnProperty(key)) {
+                        origin.tooltipster('content', $('<span class="expansion_details"></span>').html(abbreviations[key]));
+                    }
+                    // the dictionary may still have been loading when the
+                    // mouse arrived so only open if it is still there
+                    if (origin.is(':hover')) {
+                        origin.tooltipster('open');
+                    }
+                });
+            });
+        },
+
+        register_service_worker: function () {
+            // the service worker only precaches the files listed in
+            // precache.json so builds without it only cache the page shell.
+            // It is told where the data is as it can't see DATA_PATH
+            if ('serviceWorker' in navigator) {
+                navigator.serviceWorker.register(SERVICE_WORKER_URL + '?data='
+                                                 + encodeURIComponent(DATA_PATH)).catch(function () {});
+            }
+        },
+
+        get_verse_readings: function (key) {
+            // resolves to an object mapping each siglum to its reading of the
+            // verse (see make_verse_bundles.py), one fetch for the whole chapter.
+            // Chapter names can contain an S but the verses never do
+            var match = /^D(.+)S([^S]+)$/.exec(key);
+            if (match === null) {
+                return Promise.resolve({});
+            }
+            return PAGE_CACHE.fetch(DATA_PATH + 'verses/' + match[1] + '.json', 'json')
+                .then(function (bundle) {
+                    return bundle.verses[key] || {};
+                });
+        },
+
+        get_page_list: function (key) {
+            // builds from before the menu was split up still provide MENU_DATA
+            if (typeof(MENU_DATA) !== 'undefined') {
+                return $.Deferred().resolve(MENU_DATA[key]).promise();
+            }
+            return ESTORIA.load_menu(key);
+        },
+
+        setup_lazy_menu: function (key) {
+            // load_menu only requests the list once it has arrived so this
+            // keeps trying until a request succeeds
+            $( "#pageselect-" + key ).on('focus mousedown', function () {
+                ESTORIA.load_menu(key);
+            });
+        },
+
         fill_menu: function () {
             if (typeof(MENU_DATA) !== 'undefined') {
               $.each( MENU_DATA, function( key, value ) {
                   ESTORIA.add_menu_item(key,value);
                   ESTORIA.setup_page_selection(key);
               });
+            } else if (typeof(MENU_MANIFEST) !== 'undefined') {
+              $.each( MENU_MANIFEST, function( key ) {
+                  ESTORIA.setup_lazy_menu(key);
+                  ESTORIA.setup_page_selection(key);
+              });
             }
             if (typeof(READER_PAGES) !== 'undefined') {
               $.each( READER_PAGES, function( page ) {
@@ -192,6 +505,8 @@ var ESTORIA = (function () {
 
             ESTORIA.load_indice();
             ESTORIA.add_index_toggle();
+            ESTORIA.setup_search();
+            ESTORIA.setup_tooltips();
             return "0.1";
         },
 
@@ -340,6 +655,56 @@ var ESTORIA = (function () {
     };
 }());
 
+class PageCache {
+    // a size bounded cache of page requests shared by all of the widgets.
+    // Entries are the jQuery promises themselves so two widgets asking for
+    // the same page while it is still loading share a single request. The
+    // Map keeps insertion order so the first key is always the least recently
+    // used one.
+    constructor(size) {
+        this.size = size;
+        this.entries = new Map();
+    }
+
+    touch(url, entry) {
+        this.entries.delete(url);
+        this.entries.set(url, entry);
+        while (this.entries.size > this.size) {
+            this.entries.delete(this.entries.keys().next().value);
+        }
+    }
+
+    fetch(url, datatype) {
+        var self = this;
+        var request = this.entries.get(url);
+        if (request === undefined) {
+            request = $.ajax({
+                url: url,
+                dataType: datatype
+            });
+            // don't keep failures so the page can be requested again
+            request.fail(function () {
+                if (self.entries.get(url) === request) {
+                    self.entries.delete(url);
+                }
+            });
+        }
+        this.touch(url, request);
+        return request;
+    }
+
+    prefetch_image(url) {
+        var image = this.entries.get(url);
+        if (image === undefined) {
+            image = new Image();
+            image.src = url;
+        }
+        this.touch(url, image);
+    }
+}
+
+const PAGE_CACHE = new PageCache(PAGE_CACHE_SIZE);
+
 class BaseWidget {
     constructor(manuscript, page, page_list, filetype) {
         this.manuscript = manuscript;
@@ -370,13 +735,17 @@ class BaseWidget {
         this.set_next_previous()
     }
 
-    update_filename() {
+    get_filename(page) {
         var filename = DATA_PATH + this.get_feature_name().toLowerCase() + "/";
         if (this.manuscript) {
             filename += this.manuscript + '/';
         }
-        filename += this.page() + '.' + this.filetype;
-        this.filename(filename);
+        filename += page + '.' + this.filetype;
+        return filename;
+    }
+
+    update_filename() {
+        this.filename(this.get_filename(this.page()));
     }
 
     get_feature_name() {
@@ -408,12 +777,41 @@ class BaseWidget {
     }
 
     request(success_function) {
-        $.ajax({
-            url: this.filename(),
-            success: success_function,
-            dataType: this.filetype
+        var self = this;
+        PAGE_CACHE.fetch(this.filename(), this.filetype)
+            .done(success_function)
+            .done(function () {
+                self.prefetch_neighbours();
+            });
+    }
+
+    load_page_list() {
+        // the manuscript page lists are loaded on demand so the next and
+        // previous pages are only known once the list has arrived
+        var self = this;
+        ESTORIA.get_page_list(this.manuscript).done(function (page_list) {
+            self.page_list = page_list;
+            self.set_next_previous();
+            self.prefetch_neighbours();
         });
     }
+
+    prefetch_neighbours() {
+        // speculatively load the pages either side of this one so that
+        // turning the page does not have to wait for the server
+        var pages = [this.previous(), this.next()];
+        for (let i = 0; i < pages.length; i++) {
+            if (pages[i] === undefined || pages[i] === null || pages[i] === "") {
+                continue;
+            }
+            if (this.is_image) {
+                PAGE_CACHE.prefetch_image(this.get_filename(pages[i]));
+            } else {
+                PAGE_CACHE.fetch(this.get_filename(pages[i]), this.filetype);
+            }
+        }
+    }
+
     push() {
         ESTORIA.controller.widgets.push(this)
     }
@@ -438,9 +836,6 @@ class CPSFCritical extends BaseWidget {
         if (first_time) {
             self.push();
         }
-        $('.hoverover').tooltipster({
-            theme: 'tooltipster-light'
-        });
     }
     this.request(success_function);
   }
@@ -468,9 +863,6 @@ class Translation extends BaseWidget {
         if (first_time) {
             self.push();
         }
-        $('.hoverover').tooltipster({
-            theme: 'tooltipster-light'
-        });
     }
     this.request(success_function);
   }
@@ -538,11 +930,17 @@ class Reader extends BaseWidget {
 
 class ManuscriptImage extends BaseWidget {
     constructor(manuscript, page) {
-        super(manuscript, page, MENU_DATA[manuscript], "jpg");
+        super(manuscript, page, undefined, "jpg");
         this.is_image = true;
         this.width = 5;
         this.height = 9;
         this.push();
+        this.load_page_list();
+    }
+
+    update_body(first_time) {
+        // the image itself is loaded by the template so only prefetch here
+        this.prefetch_neighbours();
     }
 
     get_feature_name() {
@@ -553,7 +951,7 @@ class ManuscriptImage extends BaseWidget {
 class Transcription extends BaseWidget {
     constructor(manuscript, page, abbrev) {
         page = page.replace(/^0+/, ''); // Remove any leading zeros
-        super(manuscript, page, MENU_DATA[manuscript], "json");
+        super(manuscript, page, undefined, "json");
         this.has_eye = true;
         this.width = 6;
         this.height = 7;
@@ -561,6 +959,7 @@ class Transcription extends BaseWidget {
         if (SETTINGS.manuscriptsWithImages.indexOf(this.manuscript) != -1) {
             this.has_image = true;
         }
+        this.load_page_list();
         this.update_body(true);
     }
     update_body(first_time) {
@@ -574,9 +973,6 @@ class Transcription extends BaseWidget {
             if (first_time) {
                 self.push();
             }
-            $('.hoverover').tooltipster({
-                theme: 'tooltipster-light'
-            });
         };
         this.request(success_function);
     }
@@ -637,4 +1033,5 @@ $(document).ready(function(){
     ESTORIA.fill_menu();
     ESTORIA.setup_knockout();
     ESTORIA.preload_page();
+    ESTORIA.register_service_worker();
 });
@@ -40,6 +40,14 @@ keep track of the context that matters.
 Each tag that needs special handling has a process_start_[tagname] and
 process_end_[tagname] function.
 
+The hover overs which explain the abbreviations (for both <choice> and <am><ex>)
+are not written into the pages. Each different text is stored once in
+data/abbreviations.json under a short id made from the hash of the text, and
+the abbreviation spans in the html refer to it with a data-abbreviation
+attribute. The viewer loads the dictionary once and adds the tooltips from it.
+Because the ids only depend on the text a page's html does not change when
+abbreviations are added to other pages.
+
 No arguments added unless being run by the admin app in which case
 the path to the data directory must be supplied.
 If the transcriptions have changed you must run make_paginated_json.py first
@@ -51,13 +59,29 @@ import re
 import os
 import io
 import json
+import time
+import hashlib
+import contextlib
 from xml.etree.ElementTree import iterparse, ParseError
 from lxml import etree
+import build_output
+import profiling
+import page_cache
 from cgitb import text
 
 DATA_DIR = '../data'
 NO_TAIL = -666
 FORCE = True
+ABBREVIATIONS_FILE = 'abbreviations.json'
+ABBREVIATION_ID_LENGTH = 10
+# stands in for the id of an am/ex hover over until the end of the ex is reached
+AMEX_PLACEHOLDER = '\x00amex%d\x00'
+AMEX_PLACEHOLDER_PATTERN = re.compile('\x00amex([0-9]+)\x00')
+
+def load_abbreviations(data_path):
+    """Return the abbreviation dictionary in the data directory (empty if there isn't one)."""
+    return build_output.load_json(os.path.join(data_path, ABBREVIATIONS_FILE), {})
+
 
 class DisplayTextGenerator(object):
     """Generate pages for display."""
@@ -69,32 +93,56 @@ class DisplayTextGenerator(object):
         self.page_path = os.path.join(data_path, 'transcription')
         self.expanded = expanded
         self.debug = debug
-        self.abbreviations = []
+        # the abbreviation dictionary, hover over id -> text
+        self.abbreviations = {}
         self.app_tag_open = False
+        # a profiling.HandlerProfiler to time the handlers and pages
+        self.profiler = None
+        # a profiling.MemoryTracker to record the peak memory of each manuscript
+        self.memory = None
+        # a page_cache.ParsedPageCache of the parsed pages
+        self.parsed_pages = None
+        # the sigla of the manuscripts and the names of the pages to generate
+        # (None for all of them)
+        self.manuscripts = None
+        self.pages = None
+        # siglum -> the directory of its pages if not in page_path
+        self.document_paths = {}
 
 
     def generate_all_pages(self):
         """Go through file system to find the pages and call generate_page on each"""
-        if self.expanded:
-            print('adding expanded html')
+        mode = 'expanded' if self.expanded else 'abbreviated'
+        print('adding %s html' % mode)
+        if self.manuscripts is None:
+            directories = sorted(build_output.list_directory(self.page_path))
         else:
-            print('adding abbreviated html')
-        for directory in os.listdir(self.page_path):
-            dir_path = os.path.join(self.page_path, directory)
-            print(directory)
-            for filename in os.listdir(dir_path):
-                if filename.endswith('.json'):
-
-                    if self.debug:
-                        print(directory, filename)
-
-                    try:
-                        self.generate_page(directory, filename)
-                    except ParseError:
+            directories = sorted(self.manuscripts)
+        for directory in directories:
+            with profiling.track(self.memory, '%s (%s)' % (directory, mode)):
+                dir_path = self.get_document_path(directory)
+                print(directory)
+                for filename in sorted(build_output.list_directory(dir_path)):
+                    if filename.endswith('.json'):
+                        if self.pages is not None and filename[:-len('.json')] not in self.pages:
+                            continue
+
                         if self.debug:
+                            print(directory, filename)
+
+                        try:
+                            self.generate_page(directory, filename)
+                        except ParseError:
+                            if self.debug:
 
-                            print("Skipping:", directory, filename)
+                                print("Skipping:", directory, filename)
+        if self.parsed_pages is not None:
+            self.parsed_pages.close()
+        # the other version of the html is added to the pages written here
+        build_output.flush()
 
+    def get_document_path(self, document):
+        return self.document_paths.get(document, os.path.join(self.page_path, document))
 
     def remove_segs(self, rdg):
         for seg in rdg.findall('.//seg[@type="2"]'):
@@ -135,11 +183,12 @@ class DisplayTextGenerator(object):
         choices = root_element.findall('.//choice')
         for choice in choices:
             abbr = choice.find('./abbr')
-            abbr_string = str(etree.tostring(abbr), 'utf-8').replace('\n', '')
+            abbr_string = ''.join(abbr.itertext()).replace('\n', '').replace('⁊', 'τ')
             expan = choice.find('./expan')
-            expan_string = str(etree.tostring(expan), 'utf-8').replace('\n', '')
-            self.choice_hovers.append('%s expands to %s' % (re.sub('<.*?>', '', abbr_string),\
-                                                       re.sub('<.*?>', '', expan_string)))
+            expan_string = ''.join(expan.itertext()).replace('\n', '')
+            # the raw text, as the am and ex hovers are, so the same hover
+            # always gets the same abbreviation id
+            self.choice_hovers.append('%s expands to %s' % (abbr_string, expan_string))
 
             if self.expanded:
                 choice.remove(abbr)
@@ -151,10 +200,8 @@ class DisplayTextGenerator(object):
 
 
     def count_columns(self, data, document, page):
-        try:
-            root_element = etree.fromstring(data['text'])
-        except etree.XMLSyntaxError:
-            print("Not parsing xml of %s, %s" % (document, page))
+        # a page which can't be parsed is reported by the page cache
+        root_element = etree.fromstring(data['text'])
         cbs = root_element.findall('.//cb')
         column_structure = {}
         for cb in cbs:
@@ -180,6 +227,24 @@ class DisplayTextGenerator(object):
                       document="Q",
                       page="2r.json"):
         """Generate a single display page."""
+        filename = os.path.join(self.get_document_path(document), page)
+        data = json.loads(build_output.read_text(filename))
+
+        start = time.perf_counter()
+        html = self.render_page(data, document, page)
+        if self.profiler is not None:
+            self.profiler.add_page('%s/%s (%s)' % (document, page.replace('.json', ''),
+                                                   'expanded' if self.expanded else 'abbreviated'),
+                                   time.perf_counter() - start, len(html))
+        if self.expanded:
+            data['html'] = html
+        else:
+            data['html_abbrev'] = html
+
+        build_output.write_json(filename, data)
+
+    def render_page(self, data, document, page):
+        """Return the html for the XML in the json data of a page."""
         self.sigla = document
         self.page = page.replace('.json', '')
         self.past_first_chapter_div = False
@@ -206,36 +271,27 @@ class DisplayTextGenerator(object):
         self.am_open = False
         self.am_text = []
         self.amex_pos = 0
+        self.amex_ids = {}
         self.note_pos = 0
 
         self.abbr_open = False
         self.expan_open = False
 
-
-
-        filename = os.path.join(self.page_path, document, page)
-        with open(filename, encoding="utf-8") as file_p:
-            data = json.load(file_p)
-        self.column_structure = self.count_columns(data, document, page)
-
-        if data['text']:
-            cleaned = self.process_app(data['text'].replace('\n', ''), document, page)
-            cleaned = self.process_choice(cleaned, document, page)
-        else:
-            cleaned = data['text']
-        datastream = io.StringIO(cleaned)
-
-        # iterparse is not deprecated
-        # https://github.com/PyCQA/pylint/issues/947
-        # pylint: disable=deprecated-method
-        parser = iterparse(datastream, events=("start", "end"))
+        prepared = page_cache.get(self.parsed_pages, data['text'], document, page,
+                                  lambda text: self.prepare_page(text, document, page))
+        if prepared is None:
+            raise ParseError('%s %s cannot be parsed' % (document, page))
+        self.column_structure, choice_hovers, events = prepared
+        self.choice_hovers = list(choice_hovers)
         output_text = []
 
-        for event, element in parser:
+        for event, element in page_cache.replay_events(events):
             try:
-                new_text = getattr(self,
-                                   "process_%s_%s" % (event,
-                                                      element.tag))(element)
+                handler = getattr(self, "process_%s_%s" % (event, element.tag))
+                if self.profiler is None:
+                    new_text = handler(element)
+                else:
+                    new_text = self.profiler.call(handler, element)
             except AttributeError:
                 if self.debug:
                     print("Skipping %s." % element.tag)
@@ -251,14 +307,39 @@ class DisplayTextGenerator(object):
                 if new_text != NO_TAIL:
                     self.update_text(output_text, element.tail)
 
-
-        if self.expanded:
-            data['html'] = ''.join(output_text)
+        html = ''.join(output_text)
+        if '\x00' in html:
+            html = AMEX_PLACEHOLDER_PATTERN.sub(lambda match: self.amex_ids.get(int(match.group(1)), ''),
+                                                html)
+        return html
+
+    def add_abbreviation(self, text):
+        """Add a hover over text to the abbreviation dictionary and return its id."""
+        key = hashlib.sha256(text.encode('utf-8')).hexdigest()[:ABBREVIATION_ID_LENGTH]
+        known = self.abbreviations.setdefault(key, text)
+        if known != text:
+            raise ValueError('abbreviation id %s is used for both "%s" and "%s", '
+                             'increase ABBREVIATION_ID_LENGTH' % (key, known, text))
+        return key
+
+    def prepare_page(self, text, document, page):
+        """Return the column structure, choice hovers and XML events for rendering a page.
+
+        This is all of the parsing of the page and is what the page cache keeps."""
+        self.choice_hovers = []
+        column_structure = self.count_columns({'text': text}, document, page)
+        if text:
+            cleaned = self.process_app(text.replace('\n', ''), document, page)
+            cleaned = self.process_choice(cleaned, document, page)
         else:
-            data['html_abbrev'] = ''.join(output_text)
+            cleaned = text
+        datastream = io.StringIO(cleaned)
 
-        with open(filename, 'w', encoding="utf-8") as file_p:
-            json.dump(data, file_p, ensure_ascii=False, indent=4)
+        # iterparse is not deprecated
+        # https://github.com/PyCQA/pylint/issues/947
+        # pylint: disable=deprecated-method
+        parser = iterparse(datastream, events=("start", "end"))
+        return column_structure, self.choice_hovers, page_cache.record_events(parser)
 
     #this function adds text to the output stream and also to the hover over
     #details for am and ex tags
@@ -526,9 +607,9 @@ class DisplayTextGenerator(object):
         self.am_open = True
 
         if element.text:
-            return '<span class="abbreviation_marker hoverover" data-tooltip-content="#amex-%s-%s-%d">%s' % (self.sigla, self.page, self.amex_pos, element.text.replace('⁊', 'τ'))
+            return '<span class="abbreviation_marker hoverover" data-abbreviation="%s">%s' % (AMEX_PLACEHOLDER % self.amex_pos, element.text.replace('⁊', 'τ'))
         else:
-            return '<span class="abbreviation_marker hoverover" data-tooltip-content="#amex-%s-%s-%d">' % (self.sigla, self.page, self.amex_pos)
+            return '<span class="abbreviation_marker hoverover" data-abbreviation="%s">' % (AMEX_PLACEHOLDER % self.amex_pos)
 
     def process_end_am(self, element):
         if self.expanded:
@@ -568,19 +649,21 @@ class DisplayTextGenerator(object):
         if self.expanded:
             return '</span>'
         else:
-            tooltip = '<div class="tooltip_templates"><span class="expansion_details" id="amex-%s-%s-%d">%s expands to %s</span></div>' % (self.sigla, self.page, self.amex_pos, ''.join(self.am_text), ''.join(self.ex_text))
+            self.amex_ids[self.amex_pos] = self.add_abbreviation('%s expands to %s' % (''.join(self.am_text),
+                                                                                      ''.join(self.ex_text)))
             self.am_text = []
             self.ex_text = []
             self.amex_pos += 1
-            return tooltip
+            return ''
 
     def process_start_abbr(self, element):
         """abbr tag."""
         self.abbr_open = True
+        key = self.add_abbreviation(self.choice_hovers[self.choice_pos])
         if element.text:
-            return '<span class="abbreviation hoverover" title="%s">%s' % (self.choice_hovers[self.choice_pos], element.text.replace('⁊', 'τ'))
+            return '<span class="abbreviation hoverover" data-abbreviation="%s">%s' % (key, element.text.replace('⁊', 'τ'))
         else:
-            return '<span class="abbreviation hoverover" title="%s">' % self.choice_hovers[self.choice_pos]
+            return '<span class="abbreviation hoverover" data-abbreviation="%s">' % key
         return ''
 
     def process_end_abbr(self, element):
@@ -890,6 +973,21 @@ class DisplayTextGenerator(object):
 
 
 
+@contextlib.contextmanager
+def staged_pages(page_path, manuscripts=None):
+    """Stage a copy of the transcription directory or of the directories of the selected manuscripts.
+
+    Yields the directory to find the pages in and the staging directory of
+    each selected manuscript."""
+    if manuscripts is None:
+        with build_output.staged_directory(page_path, copy=True) as staged_path:
+            yield staged_path, {}
+    else:
+        with build_output.staged_subdirectories(page_path, manuscripts,
+                                                copy=True) as document_paths:
+            yield page_path, document_paths
+
+
 def main(argv):
     """Run when module called."""
 
@@ -898,26 +996,66 @@ def main(argv):
                         help='the path to the data directory'
                              '(only used by the django app, use default for '
                              'webpack build)')
-
-    args = parser.parse_args()
-
-    # run once for abbreviated
+    build_output.add_selection_argument(parser, pages=True)
+    build_output.add_argument(parser)
+    profiling.add_argument(parser)
+    profiling.add_memory_argument(parser)
+    page_cache.add_argument(parser)
+
+    args = parser.parse_args(argv)
+    manuscripts, pages = build_output.get_selection(parser, args)
+    build_output.set_pretty(args.pretty)
+    build_output.set_writer_threads(args.writer_threads)
+    build_output.set_output(args.output)
+    page_cache.set_cache_dir(args.page_cache_dir)
+    profiler = None
+    if args.profile is not None:
+        profiler = profiling.HandlerProfiler()
+    memory = profiling.start_memory_tracking(args.memory)
     if args.data_path:
-        gen = DisplayTextGenerator(debug=False,
-                                   expanded=False,
-                                   data_path=args.data_path)
+        data_path = args.data_path
     else:
-        gen = DisplayTextGenerator(debug=False, expanded=False)
-    gen.generate_all_pages()
-
-    #and again for expanded
-    if args.data_path:
-        gen = DisplayTextGenerator(debug=False,
-                                   expanded=True,
-                                   data_path=args.data_path)
+        data_path = DATA_DIR
+
+    # the pages are updated in a copy of the transcription directory (or of
+    # the directories of the selected manuscripts) which replaces the live one
+    # once both versions of the html have been added
+    page_path = os.path.join(data_path, 'transcription')
+    if manuscripts is None:
+        outputs = ['transcription', ABBREVIATIONS_FILE]
+        abbreviations = {}
     else:
-        gen = DisplayTextGenerator(debug=False, expanded=True)
-    gen.generate_all_pages()
+        outputs = ['transcription/%s' % siglum for siglum in manuscripts] + [ABBREVIATIONS_FILE]
+        for siglum in manuscripts:
+            if not build_output.is_directory(os.path.join(page_path, siglum)):
+                parser.error('there are no pages for %s, run make_paginated_json.py first' % siglum)
+        # the pages of the other manuscripts still use their hover overs
+        abbreviations = load_abbreviations(data_path)
+    with build_output.build_stage(data_path, 'add_html_to_paginated_json', outputs), \
+         profiling.track(memory, 'add_html_to_paginated_json'), \
+         staged_pages(page_path, manuscripts) as (staged_path, document_paths):
+        for expanded in [False, True]:
+            # run once for abbreviated and again for expanded
+            gen = DisplayTextGenerator(debug=False,
+                                       expanded=expanded,
+                                       data_path=data_path)
+            gen.page_path = staged_path
+            gen.document_paths = document_paths
+            gen.manuscripts = manuscripts
+            gen.pages = pages
+            gen.parsed_pages = page_cache.open_cache(data_path,
+                                                     'render-expanded' if expanded else 'render-abbreviated',
+                                                     [__file__], not args.no_page_cache,
+                                                     prune=pages is None)
+            gen.profiler = profiler
+            gen.memory = memory
+            gen.abbreviations = abbreviations
+            gen.generate_all_pages()
+        build_output.write_json(os.path.join(data_path, ABBREVIATIONS_FILE),
+                                dict(sorted(abbreviations.items())))
+    if profiler is not None:
+        profiler.report(args.profile)
+    profiling.stop_memory_tracking(memory, args.memory)
 
 if __name__ == '__main__':
     main(sys.argv[1:])
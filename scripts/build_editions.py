@@ -0,0 +1,251 @@
+#!/usr/bin/python3
+
+"""
+This script builds the data of one or more editions in a single command using
+a configuration file which says where the inputs and the data directory of
+each edition are and which stages to run for it.
+
+The configuration file is json, for example
+
+{
+    "editions": {
+        "estoria": {
+            "data_path": "Estoria-de-Espanna-Digital/edition/static/data",
+            "xml_dir": "Estoria-de-Espanna-Digital/transcriptions/manuscripts",
+            "index_file": "Estoria-de-Espanna-Digital/chapter_index.csv",
+            "collations_dir": "Estoria-de-Espanna-Digital/collation/approved",
+            "reader_dir": "Estoria-de-Espanna-Digital/transcriptions/readerXML"
+        },
+        "cpsf": {
+            "data_path": "cpsf-digital/edition/static/data",
+            "xml_dir": "cpsf-digital/transcriptions/manuscripts",
+            "index_file": "cpsf-digital/chapter_index.csv",
+            "collations_dir": "cpsf-digital/collation/approved",
+            "reader_dir": "cpsf-digital/transcriptions/readerXML",
+            "translation_dir": "cpsf-digital/transcriptions/translationXML",
+            "critical_dir": "cpsf-digital/transcriptions/criticalXML",
+            "stages": ["make_paginated_json", "add_html_to_paginated_json",
+                       "make_translation", "make_cpsf_critical"]
+        }
+    }
+}
+
+Relative paths are relative to the directory of the configuration file. Each
+edition can list the stages to run, otherwise every stage in STAGES for which
+the edition has the inputs is run (so make_translation and make_cpsf_critical
+only run for editions with a translation_dir and critical_dir). The stages of
+an edition always run in the order of STAGES as the later ones use the output
+of the earlier ones.
+
+The editions are built at the same time on a pool of worker processes (--workers,
+by default one for each edition). Each stage runs in a worker by calling the
+main function of its script with the arguments it would be given on the command
+line, so the interpreter and lxml are only started once for each worker rather
+than once for each stage. The output of each stage is printed when the stage
+finishes. If a stage fails the rest of that edition is skipped, the other
+editions carry on and the script exits with status 1 at the end.
+
+With --archive DIR each edition is written to DIR/[edition].zip (or another
+archive type with --archive_type) instead of to its data directory, which is
+left as it is (see output_sink.py). All of the stages of an edition then run
+in the same worker so that each stage can read the output of the earlier ones,
+and the archive is only written if every stage succeeds.
+
+"""
+import sys
+import os
+import io
+import json
+import argparse
+import importlib
+import traceback
+import contextlib
+import concurrent.futures
+import build_output
+import output_sink
+
+# the stages in the order they run and the configuration keys of their inputs
+# with the argument each is passed to the script as
+STAGES = [('make_paginated_json', [('xml_dir', '--xml_path')]),
+          ('add_html_to_paginated_json', []),
+          ('make_chapter_index_json', [('xml_dir', '--xml_path'),
+                                       ('index_file', '--index_file')]),
+          ('make_reader', [('reader_dir', '--xml_path')]),
+          ('make_translation', [('translation_dir', '--xml_path')]),
+          ('make_cpsf_critical', [('critical_dir', '--xml_path')]),
+          ('make_critical_chapter_verse_json', [('collations_dir', '--collations_path')]),
+          ('make_verse_page_index_json', []),
+          ('make_search_index', []),
+          ('make_chapter_transcriptions', []),
+          ('make_verse_bundles', []),
+          ('make_precache_manifest', [])]
+PATH_KEYS = ['data_path', 'xml_dir', 'index_file', 'collations_dir', 'reader_dir',
+             'translation_dir', 'critical_dir']
+
+
+def load_config(filename):
+    """Load the configuration file and make its paths absolute."""
+    with open(filename, encoding='utf-8') as config_file:
+        config = json.load(config_file)
+    base = os.path.dirname(os.path.abspath(filename))
+    for name, edition in config['editions'].items():
+        if 'data_path' not in edition:
+            raise ValueError('edition %s has no data_path' % name)
+        for key in PATH_KEYS:
+            if key in edition:
+                edition[key] = os.path.join(base, edition[key])
+    return config
+
+
+def get_stages(name, edition, options):
+    """Return the list of (stage, arguments) to run for an edition."""
+    wanted = edition.get('stages')
+    known = [stage for stage, inputs in STAGES]
+    for stage in wanted or []:
+        if stage not in known:
+            raise ValueError('edition %s has an unknown stage %s' % (name, stage))
+    stages = []
+    for stage, inputs in STAGES:
+        missing = [key for key, argument in inputs if key not in edition]
+        if wanted is None and missing:
+            continue
+        if wanted is not None and stage not in wanted:
+            continue
+        if missing:
+            raise ValueError('edition %s needs %s for %s' % (name, ', '.join(missing), stage))
+        arguments = ['--data_path', edition['data_path']]
+        for key, argument in inputs:
+            arguments.extend([argument, edition[key]])
+        stages.append((stage, arguments + options))
+    return stages
+
+
+def run_stage(stage, arguments):
+    """Run a stage in a worker and return whether it succeeded and what it printed."""
+    output = io.StringIO()
+    succeeded = True
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        try:
+            importlib.import_module(stage).main(arguments)
+        except BaseException:
+            traceback.print_exc()
+            succeeded = False
+    return succeeded, output.getvalue()
+
+
+def run_edition(stages, data_path, archive):
+    """Run all of the stages of an edition in a worker writing to an archive.
+
+    Returns the (stage, succeeded, output) of each stage run, stopping at the
+    first which fails, followed by writing the archive if they all succeed."""
+    results = []
+    sink = output_sink.open_sink(archive, data_path)
+    with build_output.use_sink(sink):
+        for stage, arguments in stages:
+            succeeded, output = run_stage(stage, arguments)
+            results.append((stage, succeeded, output))
+            if not succeeded:
+                return results
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        sink.close()
+    results.append(('archive', True, output.getvalue()))
+    return results
+
+
+def build_editions(config, names, workers=None, options=(), archive=None, archive_type='zip'):
+    """Build the named editions on a shared pool of workers, returning the names of any which failed.
+
+    With archive (a directory) each edition is written to an archive in it
+    rather than to its data directory."""
+    queues = {}
+    for name in names:
+        queues[name] = get_stages(name, config['editions'][name], list(options))
+    failed = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers or len(names)) as pool:
+        running = {}
+
+        def submit_next(name):
+            if archive is not None:
+                if queues[name]:
+                    filename = os.path.join(archive, '%s.%s' % (name, archive_type))
+                    running[pool.submit(run_edition, queues[name],
+                                        config['editions'][name]['data_path'],
+                                        os.path.abspath(filename))] = (name, None)
+                    queues[name] = []
+                return
+            if queues[name]:
+                stage, arguments = queues[name].pop(0)
+                running[pool.submit(run_stage, stage, arguments)] = (name, stage)
+
+        for name in names:
+            submit_next(name)
+        while running:
+            done, pending = concurrent.futures.wait(running,
+                                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name, stage = running.pop(future)
+                if stage is None:
+                    results = future.result()
+                else:
+                    results = [(stage,) + future.result()]
+                for stage, succeeded, output in results:
+                    print('==== %s: %s' % (name, stage))
+                    print(output, end='')
+                if succeeded:
+                    submit_next(name)
+                else:
+                    print('==== %s: %s failed, skipping the rest of the edition' % (name, stage))
+                    failed.append(name)
+    return failed
+
+
+def main(argv):
+    """Run when module called."""
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('config',
+                        help='the json configuration file describing the editions')
+    parser.add_argument('-e', '--editions',
+                        help='comma separated list of the editions to build '
+                             '(default all of them)')
+    parser.add_argument('-w', '--workers', type=int,
+                        help='the number of worker processes (default one for '
+                             'each edition)')
+    parser.add_argument('--pretty', action='store_true',
+                        help='indent the json output (passed to every stage)')
+    parser.add_argument('--writer_threads', type=int,
+                        help='the number of writer threads of each stage')
+    parser.add_argument('-a', '--archive',
+                        help='write each edition to an archive in this directory '
+                             'instead of to its data directory')
+    parser.add_argument('--archive_type', default='zip',
+                        choices=['zip', 'tar', 'tar.gz', 'tar.bz2', 'tar.xz'],
+                        help='the type of archive to write with --archive (default zip)')
+
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    if args.editions:
+        names = args.editions.split(',')
+        for name in names:
+            if name not in config['editions']:
+                parser.error('there is no edition %s in %s' % (name, args.config))
+    else:
+        names = list(config['editions'])
+    options = []
+    if args.pretty:
+        options.append('--pretty')
+    if args.writer_threads is not None:
+        options.extend(['--writer_threads', str(args.writer_threads)])
+    if args.archive:
+        os.makedirs(args.archive, exist_ok=True)
+    failed = build_editions(config, names, workers=args.workers, options=options,
+                            archive=args.archive, archive_type=args.archive_type)
+    if failed:
+        print('failed to build %s' % ', '.join(failed))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
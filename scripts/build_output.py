@@ -0,0 +1,541 @@
+"""
+This module contains the functions used by all of the scripts to write their
+output files so that the json and javascript data is serialised in the same
+way everywhere.
+
+By default the output is compact: there is no indentation, no spaces after the
+separators and non ascii characters are written as UTF-8 rather than as \\u
+escapes. This is the mode that should be used for anything that is served to the
+edition website.
+
+Pretty printing (indented json) is still available for debugging. Each script
+accepts a --pretty argument which calls set_pretty.
+
+The module also provides what the scripts need to rebuild the data without the
+website ever serving missing or half written files.
+
+* build_lock stops two builds using the same data directory at the same time.
+A second build waits until the first has finished.
+* staged_directory gives a stage an empty (or copied) directory to write its
+output into which is swapped with the live directory only when the stage has
+succeeded.
+* files written outside of a staging directory (the menu and index files) are
+written to a temporary file first and then moved into place.
+
+The scripts which can rebuild the data of only some manuscripts (see
+add_selection_argument) stage just the directories of those manuscripts with
+staged_subdirectories and update the aggregate files (the menu manifest and the
+indexes) by loading them with load_json or load_js and replacing the entries of
+those manuscripts.
+
+While a stage runs (inside build_stage) the files are encoded and written by a
+pool of background threads so that the disk writes overlap with the parsing
+and rendering. The queue of files waiting to be written is bounded so a stage
+which produces files faster than they can be written waits for the writers to
+catch up. An error in a writer is raised in the stage at its next write or
+when the files are flushed. The files are all flushed before a staging
+directory is swapped in and at the end of the stage. Use --writer_threads 0 to
+write synchronously. As the json is encoded later the data passed to
+write_json and write_js must not be changed after it has been written.
+
+The files are not written to the file system directly but to the current
+output sink (see output_sink.py), which is the data directory unless --output
+(set_output) or use_sink chooses memory or an archive. The stages also read
+back, list and remove their output with read_text, load_json, load_js,
+list_directory, is_directory, path_exists and remove so that they see what the
+sink holds.
+
+Finally it keeps track of which files each build actually changes so that only
+those need to be copied to the web servers. Each script runs inside build_stage
+which takes the build lock and records the sha256 hash of every file the stage
+writes. When the stage finishes the hashes are compared with those stored from
+the previous build in data/.file_hashes.json and the files the stage created,
+modified and deleted are added to data/build_changes.json. That file contains
+a report for every stage plus the combined changes since it was last cleared
+(by sync_changes.py after a successful deploy). A file which one stage changes
+and a later one changes back does not appear in the combined changes.
+
+"""
+import os
+import json
+import hashlib
+import fcntl
+import contextlib
+import queue
+import threading
+import output_sink
+
+PRETTY = False
+# where the stages write to (see set_output), None for the data directory
+OUTPUT = None
+LOCK_FILE = '.build.lock'
+HASH_FILE = '.file_hashes.json'
+CHANGES_FILE = 'build_changes.json'
+WRITER_THREADS = 4
+WRITER_QUEUE_SIZE = 64
+
+_staging_directories = {}
+_lock_depth = {}
+_recorder = None
+_writer = None
+_sink = output_sink.DirectorySink()
+
+
+def set_pretty(pretty):
+    """Switch indented output on or off for all of the writers."""
+    global PRETTY
+    PRETTY = pretty
+
+
+def dumps(data):
+    """Serialise data to a json string in the current output mode."""
+    if PRETTY:
+        return json.dumps(data, ensure_ascii=False, indent=4)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def set_writer_threads(threads):
+    """Set the number of background writer threads used in build stages (0 to write synchronously)."""
+    global WRITER_THREADS
+    WRITER_THREADS = threads
+
+
+def write_text(filename, text):
+    """Write a string to a UTF-8 encoded file.
+
+    Files in a staging directory are written directly, anything else is
+    replaced atomically so that it is never seen half written."""
+    _write(filename, lambda: text.encode('utf-8'))
+
+
+def _write(filename, encode):
+    """Write the bytes returned by encode to filename, in the background if there is a writer."""
+    staged = _is_staged(filename)
+    recorder = _recorder
+    live_path = _live_path(filename)
+
+    def job():
+        content = encode()
+        if recorder is not None:
+            recorder.record(live_path, content)
+        _write_bytes(filename, content, staged)
+
+    if _writer is None:
+        job()
+    else:
+        _writer.submit(job)
+
+
+def _write_bytes(filename, content, staged=None):
+    if staged is None:
+        staged = _is_staged(filename)
+    _sink.write(filename, content, staged)
+
+
+def write_json(filename, data):
+    """Write data to a json file."""
+    _write(filename, lambda: dumps(data).encode('utf-8'))
+
+
+def write_js(filename, variable, data):
+    """Write data to a javascript file which assigns it to a global variable."""
+    _write(filename, lambda: ('%s = %s' % (variable, dumps(data))).encode('utf-8'))
+
+
+class BackgroundWriter(object):
+    """A pool of threads which run write jobs from a bounded queue."""
+
+    def __init__(self, threads=WRITER_THREADS, queue_size=WRITER_QUEUE_SIZE):
+        self.jobs = queue.Queue(queue_size)
+        self.error = None
+        self.threads = []
+        for i in range(threads):
+            thread = threading.Thread(target=self.work, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def work(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                if job is None:
+                    return
+                # once a write has failed the stage will fail so skip the rest
+                if self.error is None:
+                    job()
+            except BaseException as error:
+                if self.error is None:
+                    self.error = error
+            finally:
+                self.jobs.task_done()
+
+    def submit(self, job):
+        """Queue a job, waiting if the queue is full, and raise any error from an earlier job."""
+        self.check()
+        self.jobs.put(job)
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    def wait(self):
+        """Wait until all of the queued jobs have run."""
+        self.jobs.join()
+
+    def flush(self):
+        """Wait until all of the queued jobs have run and raise the error if one failed."""
+        self.wait()
+        self.check()
+
+    def close(self):
+        self.wait()
+        for thread in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+def flush():
+    """Wait until every file written so far is on disk (needed before reading them back)."""
+    if _writer is not None:
+        _writer.flush()
+
+
+@contextlib.contextmanager
+def background_writer(threads=None):
+    """Write the files in the background for the duration of the block."""
+    global _writer
+    if threads is None:
+        threads = WRITER_THREADS
+    if _writer is not None or threads < 1:
+        yield
+        return
+    _writer = BackgroundWriter(threads)
+    try:
+        yield
+        _writer.flush()
+    finally:
+        _writer.close()
+        _writer = None
+
+
+def add_argument(parser):
+    """Add the --pretty, --writer_threads and --output arguments to a script's argument parser."""
+    parser.add_argument('--pretty', action='store_true',
+                        help='indent the json output so that it is readable '
+                             '(for debugging, use the compact default for '
+                             'anything served to the website)')
+    parser.add_argument('--writer_threads', type=int, default=WRITER_THREADS,
+                        help='the number of threads writing the output files '
+                             '(0 to write them synchronously)')
+    parser.add_argument('--output',
+                        help='write the output to memory (it is discarded, for '
+                             'checking a build) or to a .zip, .tar, .tar.gz, '
+                             '.tgz, .tar.bz2 or .tar.xz archive of the whole data '
+                             'directory instead of to the data directory')
+
+
+def add_selection_argument(parser, pages=False):
+    """Add the --manuscript (and if pages is True --pages) arguments for rebuilding part of the data."""
+    parser.add_argument('-m', '--manuscript',
+                        help='comma separated list of the sigla of the manuscripts '
+                             'to rebuild, the data of the others is left as it is')
+    if pages:
+        parser.add_argument('--pages',
+                            help='comma separated list of the pages to rebuild '
+                                 '(needs a single --manuscript)')
+
+
+def get_selection(parser, args):
+    """Return the list of manuscripts and the set of pages selected by the arguments (None for all)."""
+    manuscripts = None
+    pages = None
+    if args.manuscript:
+        manuscripts = args.manuscript.split(',')
+    if getattr(args, 'pages', None):
+        if manuscripts is None or len(manuscripts) != 1:
+            parser.error('--pages needs a single --manuscript')
+        pages = set(args.pages.split(','))
+    return manuscripts, pages
+
+
+def _is_staged(filename):
+    return _staging_directory_of(os.path.abspath(filename)) is not None
+
+
+def _staging_directory_of(path):
+    for staging in _staging_directories:
+        if path.startswith(staging + os.sep):
+            return staging
+    return None
+
+
+def _live_path(filename):
+    """Return the path a file will have once its staging directory is swapped in."""
+    path = os.path.abspath(filename)
+    staging = _staging_directory_of(path)
+    if staging is None:
+        return path
+    return _staging_directories[staging] + path[len(staging):]
+
+
+@contextlib.contextmanager
+def build_lock(data_path):
+    """Hold an exclusive lock on the data directory for the duration of a build.
+
+    The lock can be taken again by the same process (for example when one
+    script runs the stages of another) without blocking."""
+    key = os.path.abspath(data_path)
+    if _lock_depth.get(key, 0) > 0:
+        _lock_depth[key] += 1
+        try:
+            yield
+        finally:
+            _lock_depth[key] -= 1
+        return
+    if not isinstance(_sink, output_sink.DirectorySink) and not os.path.isdir(data_path):
+        # a build into memory or an archive doesn't need a data directory
+        yield
+        return
+    # the data directory isn't tracked so the first build makes it
+    os.makedirs(data_path, exist_ok=True)
+    with open(os.path.join(data_path, LOCK_FILE), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        _lock_depth[key] = 1
+        try:
+            yield
+        finally:
+            _lock_depth[key] = 0
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def staged_directory(path, copy=False):
+    """Provide a staging directory which replaces path if the block succeeds.
+
+    If copy is True the staging directory starts as a copy of path (for stages
+    which update existing files) otherwise it starts empty. If the block raises
+    an exception the staging directory is removed and path is left untouched.
+    This should be used inside build_lock as the staging directory name is
+    fixed."""
+    staging = os.path.abspath('%s.staging' % path)
+    _sink.stage(staging, path, copy)
+    _staging_directories[staging] = os.path.abspath(path)
+    try:
+        yield staging
+        flush()
+    except BaseException:
+        if _writer is not None:
+            _writer.wait()
+        _sink.discard(staging)
+        raise
+    finally:
+        del _staging_directories[staging]
+    swap_directory(staging, path)
+
+
+@contextlib.contextmanager
+def staged_subdirectories(path, names, copy=False):
+    """Stage the named subdirectories of path, yielding a dict of their staging directories.
+
+    Each is staged as with staged_directory and they are all swapped in when
+    the block succeeds."""
+    with contextlib.ExitStack() as stack:
+        yield dict([(name, stack.enter_context(staged_directory(os.path.join(path, name),
+                                                                copy=copy)))
+                    for name in names])
+
+
+def swap_directory(staging, path):
+    """Replace path with the staging directory (see output_sink.DirectorySink.swap)."""
+    _sink.swap(staging, path)
+
+
+class ChangeRecorder(object):
+    """Record the files written by a build stage and work out what changed."""
+
+    def __init__(self, data_path, stage, outputs):
+        self.data_path = os.path.abspath(data_path)
+        self.stage = stage
+        # the files and directories (relative to data_path) the stage produces
+        self.outputs = outputs
+        self.written = {}
+
+    def record(self, live_path, content):
+        """Store the hash of the content written to a file (given by its live path)."""
+        path = os.path.relpath(live_path, self.data_path)
+        if path.startswith(os.pardir):
+            return
+        self.written[path.replace(os.sep, '/')] = hashlib.sha256(content).hexdigest()
+
+    def owns(self, path):
+        for output in self.outputs:
+            if path == output or path.startswith(output + '/'):
+                return True
+        return False
+
+    def finish(self):
+        """Compare the written files with the previous build and save the results."""
+        hashes = load_json(os.path.join(self.data_path, HASH_FILE), {})
+        report = {'stage': self.stage, 'created': {}, 'modified': {}, 'deleted': []}
+        before = {}
+        for path in sorted(self.written):
+            digest = self.written[path]
+            if path not in hashes:
+                report['created'][path] = digest
+            elif hashes[path] != digest:
+                report['modified'][path] = digest
+            else:
+                continue
+            before[path] = hashes.get(path)
+            hashes[path] = digest
+        for path in sorted(hashes):
+            if path in self.written or not self.owns(path):
+                continue
+            if not _sink.exists(os.path.join(self.data_path, path)):
+                report['deleted'].append(path)
+                before[path] = hashes[path]
+                del hashes[path]
+        _write_bytes(os.path.join(self.data_path, HASH_FILE),
+                     json.dumps(hashes, sort_keys=True).encode('utf-8'))
+        self.update_changes(report, before, hashes)
+        print('%s: %d created, %d modified, %d deleted' % (self.stage,
+                                                         len(report['created']),
+                                                         len(report['modified']),
+                                                         len(report['deleted'])))
+        return report
+
+    def update_changes(self, report, before, hashes):
+        """Add the stage report to the changes file and recombine the changes."""
+        filename = os.path.join(self.data_path, CHANGES_FILE)
+        changes = load_json(filename, {'stages': [], 'previous': {}})
+        changes['stages'].append(report)
+        # previous holds the hash each changed file had before the first
+        # change since the file was last cleared (None if it did not exist)
+        previous = changes['previous']
+        for path in before:
+            if path not in previous:
+                previous[path] = before[path]
+        changes['created'] = {}
+        changes['modified'] = {}
+        changes['deleted'] = []
+        for path in sorted(previous):
+            if previous[path] == hashes.get(path):
+                continue
+            if path not in hashes:
+                changes['deleted'].append(path)
+            elif previous[path] is None:
+                changes['created'][path] = hashes[path]
+            else:
+                changes['modified'][path] = hashes[path]
+        _write_bytes(filename, json.dumps(changes, indent=4, sort_keys=True).encode('utf-8'))
+
+
+def read_bytes(filename):
+    """Return the content of a file, raising FileNotFoundError if it does not exist."""
+    return _sink.read(filename)
+
+
+def read_text(filename):
+    """Return the content of a UTF-8 encoded file, raising FileNotFoundError if it does not exist."""
+    return read_bytes(filename).decode('utf-8')
+
+
+def load_json(filename, default):
+    """Load a json file, returning default if it does not exist."""
+    try:
+        return json.loads(read_text(filename))
+    except FileNotFoundError:
+        return default
+
+
+def load_js(filename, variable, default):
+    """Load the data from a javascript file made by write_js, returning default if it does not exist."""
+    try:
+        content = read_text(filename)
+    except FileNotFoundError:
+        return default
+    prefix = '%s = ' % variable
+    if not content.startswith(prefix):
+        raise ValueError('%s does not set %s' % (filename, variable))
+    return json.loads(content[len(prefix):])
+
+
+def list_directory(path):
+    """Return the names in a directory, raising FileNotFoundError if it does not exist."""
+    return _sink.listdir(path)
+
+
+def path_exists(path):
+    return _sink.exists(path)
+
+
+def is_directory(path):
+    return _sink.isdir(path)
+
+
+def make_directories(path):
+    """Make a directory and its parents if they don't exist."""
+    _sink.makedirs(path)
+
+
+def remove(path):
+    """Remove a file or a directory and everything in it if it exists."""
+    _sink.remove(path)
+
+
+def write_state(filename, data):
+    """Write a json file the build keeps for itself (not recorded as an output)."""
+    flush()
+    _write_bytes(filename, json.dumps(data).encode('utf-8'), False)
+
+
+def set_output(output):
+    """Set where the build stages write to (see output_sink.open_sink), None for the data directory."""
+    global OUTPUT
+    OUTPUT = output
+
+
+@contextlib.contextmanager
+def use_sink(sink):
+    """Send all of the reads and writes to a sink for the duration of the block.
+
+    Use this around several stages to collect their output in the same
+    MemorySink or ArchiveSink, closing the sink (which writes an archive)
+    afterwards."""
+    global _sink
+    parent = _sink
+    _sink = sink
+    try:
+        yield sink
+    finally:
+        _sink = parent
+
+
+@contextlib.contextmanager
+def build_stage(data_path, stage, outputs):
+    """Run a build stage: hold the build lock and record the files it changes.
+
+    outputs is the list of files and directories (relative to data_path) that
+    the stage is responsible for, anything in them which no longer exists at
+    the end of the stage is reported as deleted."""
+    global _recorder
+    if OUTPUT is not None and isinstance(_sink, output_sink.DirectorySink):
+        # the stage runs on its own so the sink is just for this stage
+        with use_sink(output_sink.open_sink(OUTPUT, data_path)) as sink:
+            with build_stage(data_path, stage, outputs) as recorder:
+                yield recorder
+        sink.close()
+        if OUTPUT == 'memory':
+            print('%s: %d files kept in memory' % (stage, len(sink.files)))
+        return
+    with build_lock(data_path):
+        parent = _recorder
+        _recorder = ChangeRecorder(data_path, stage, outputs)
+        try:
+            with background_writer():
+                yield _recorder
+                flush()
+            _recorder.finish()
+        finally:
+            _recorder = parent
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+
+"""
+This script checks the build stages for performance regressions by comparing
+their current time and peak memory on a synthetic corpus with a stored
+baseline. It uses the same benchmarks as run_benchmarks.py.
+
+The stages checked by default are
+
+* pagination - PageSplitter.separate_pages
+* html - DisplayTextGenerator.generate_all_pages
+* chapter_index - IndiceCreator.make_indice
+* verse_page_index - make_verse_page_index
+* critical_lists - make_critical_text_files
+
+To reduce noise each stage is run several times (--repeat, default 5) and the
+median is compared. A stage fails if its median time is more than
+--time_tolerance (default 0.25, i.e. 25%) slower than the baseline or its peak
+memory is more than --memory_tolerance (default 0.2) larger. Differences
+smaller than --min_seconds are ignored so that very fast stages do not fail on
+timer noise.
+
+Make or refresh the baseline on the machine that will run the checks with
+--update. The baseline records the corpus sizes and options it was made with
+and the check uses the same ones. The script exits with status 1 if any stage
+has regressed so it can be used as a gate in a build.
+
+"""
+import sys
+import os
+import argparse
+import json
+import run_benchmarks
+import make_synthetic_corpus
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'performance_baseline.json')
+CHECKED_STAGES = ['pagination', 'html', 'chapter_index', 'verse_page_index',
+                  'critical_lists']
+SIZES = '200'
+REPEAT = 5
+TIME_TOLERANCE = 0.25
+MEMORY_TOLERANCE = 0.2
+MIN_SECONDS = 0.05
+
+
+def compare(baseline, current, time_tolerance, memory_tolerance, min_seconds):
+    """Print a comparison of the results and return the list of regressions."""
+    regressions = []
+    print('%-18s %6s %10s %10s %8s %10s %10s %8s' % ('stage', 'pages', 'base s', 'now s',
+                                                     'ratio', 'base MB', 'now MB', 'ratio'))
+    for size in baseline:
+        for stage in baseline[size]:
+            if stage not in current.get(size, {}):
+                continue
+            old = baseline[size][stage]
+            new = current[size][stage]
+            time_ratio = new['seconds'] / max(old['seconds'], 1e-9)
+            memory_ratio = new['peak_mb'] / max(old['peak_mb'], 1e-9)
+            status = []
+            if time_ratio > 1 + time_tolerance and new['seconds'] - old['seconds'] > min_seconds:
+                status.append('SLOWER')
+            if memory_ratio > 1 + memory_tolerance:
+                status.append('LARGER')
+            print('%-18s %6s %10.3f %10.3f %8.2f %10.1f %10.1f %8.2f %s' % (stage, size,
+                                                                          old['seconds'], new['seconds'],
+                                                                          time_ratio,
+                                                                          old['peak_mb'], new['peak_mb'],
+                                                                          memory_ratio,
+                                                                          ' '.join(status)))
+            if status:
+                regressions.append((size, stage, status))
+    return regressions
+
+
+def main(argv):
+    """Run when module called."""
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-b', '--baseline', default=BASELINE_FILE,
+                        help='the baseline file (default %s)' % BASELINE_FILE)
+    parser.add_argument('--update', action='store_true',
+                        help='run the benchmarks and save them as the new baseline')
+    parser.add_argument('--sizes', default=SIZES,
+                        help='comma separated list of the number of pages per '
+                             'manuscript (only used with --update, the check uses '
+                             'the sizes in the baseline)')
+    parser.add_argument('--stages', default=','.join(CHECKED_STAGES),
+                        help='comma separated list of the stages to check')
+    parser.add_argument('--repeat', type=int, default=REPEAT,
+                        help='the number of runs of each stage to take the median of')
+    parser.add_argument('--time_tolerance', type=float, default=TIME_TOLERANCE,
+                        help='the allowed fractional increase in time')
+    parser.add_argument('--memory_tolerance', type=float, default=MEMORY_TOLERANCE,
+                        help='the allowed fractional increase in peak memory')
+    parser.add_argument('--min_seconds', type=float, default=MIN_SECONDS,
+                        help='time differences smaller than this are ignored')
+    make_synthetic_corpus.add_arguments(parser)
+
+    args = parser.parse_args(argv)
+
+    stages = args.stages.split(',')
+    if args.update:
+        corpus_options = make_synthetic_corpus.corpus_options(args)
+        sizes = [int(size) for size in args.sizes.split(',')]
+        results = run_benchmarks.run_benchmarks(sizes, stages=stages, repeat=args.repeat,
+                                                corpus_options=corpus_options)
+        run_benchmarks.print_results(results)
+        with open(args.baseline, 'w', encoding='utf-8') as output:
+            json.dump({'sizes': sizes, 'corpus_options': corpus_options,
+                       'results': results}, output, indent=4)
+        print('baseline saved to %s' % args.baseline)
+        return
+
+    try:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+    except FileNotFoundError:
+        print('No baseline at %s, make one with --update' % args.baseline)
+        sys.exit(2)
+
+    results = run_benchmarks.run_benchmarks(baseline['sizes'], stages=stages,
+                                            repeat=args.repeat,
+                                            corpus_options=baseline['corpus_options'])
+    regressions = compare(baseline['results'], results, args.time_tolerance,
+                          args.memory_tolerance, args.min_seconds)
+    if regressions:
+        print('%d performance regressions' % len(regressions))
+        sys.exit(1)
+    print('no performance regressions')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -22,7 +22,19 @@ running this script.
 
 The list of manuscript sigla in the variable 'manuscripts' is used to ensure the
 manuscripts appear in a fixed order in the dropdown menus in the index. It
-should contain all manuscript in the order they need to appear.
+is made from the manuscript directories of the paginated data sorted by siglum
+so that the same data always produces the same indice.json.
+
+After rebuilding the pages of some manuscripts use --manuscript with the same
+sigla to update only their pages in the existing index. The chapter list and
+the other manuscripts are not read again (unless Ss is one of them as the
+chapter list is taken from it).
+
+The home page loads the index progressively so as well as indice.json the
+entries are written in order in chunks of --chunk_size entries (100 by default)
+to data/indice/[n].json, numbered from 0, along with data/indice/manifest.json
+which gives the number of entries, the chunk size and the number of chunks.
+--chunk_size 0 only writes indice.json.
 
 No arguments required unless being run by the admin app in which case
 the path to the data directory must be supplied.
@@ -32,29 +44,56 @@ import sys
 import argparse
 import os
 import json
+import bisect
 from lxml import etree
+import build_output
+import profiling
+import page_cache
 
 XML_DIR = '../../../../transcriptions/manuscripts'
 INDEX_FILE = '../../../../chapter_index.csv'
 DATA_DIR = '../data'
+CHUNK_SIZE = 100
 
 
 
 class IndiceCreator(object):
 
-    def __init__(self, data_path=DATA_DIR):
+    def __init__(self, data_path=DATA_DIR, directory=XML_DIR, index_file=INDEX_FILE):
         self.data_path = data_path
+        self.directory = directory
+        self.index_file = index_file
         self.page_path = os.path.join(data_path, 'transcription')
-        self.manuscripts = os.listdir(os.path.join(data_path, 'transcription'))
+        self.manuscripts = sorted(build_output.list_directory(os.path.join(data_path, 'transcription')))
         print(self.page_path)
         print(self.manuscripts)
+        # a profiling.MemoryTracker to record the peak memory of each manuscript
+        self.memory = None
+        # a page_cache.ParsedPageCache of the chapter divs on each page
+        self.parsed_pages = None
+        # the sigla of the manuscripts to update in the existing index (None
+        # to make the whole index)
+        self.update_manuscripts = None
+        # the number of entries in each chunk of the index (0 for no chunks)
+        self.chunk_size = CHUNK_SIZE
 
     def make_indice(self):
 
+        if self.update_manuscripts is not None:
+            indice = build_output.load_json(os.path.join(self.data_path, 'indice.json'), None)
+            if indice is None:
+                print('there is no chapter index to update, making the whole index')
+            elif 'Ss' in self.update_manuscripts:
+                # the list of chapters comes from Ss
+                print('Ss has changed, making the whole index')
+            else:
+                self.update_indice(indice)
+                return
+
         #This section makes the initial json of the index from the csv file with
         #placeholders for manuscripts extant and pages
         print('reading chapter index data')
-        lines = open(INDEX_FILE, 'r', encoding='utf-8').readlines()
+        lines = open(self.index_file, 'r', encoding='utf-8').readlines()
         indice = {}
         position = 1
 
@@ -74,9 +113,10 @@ class IndiceCreator(object):
                 position += 1
 
         # read Ss and grab all VC_ chapters (add cxxxix (missing in Ss before cxl)
-        filename = os.path.join(XML_DIR, 'Ss.xml')
+        filename = os.path.join(self.directory, 'Ss.xml')
         parser = etree.XMLParser(resolve_entities=False, encoding='utf-8')
-        tree = etree.parse(filename, parser)
+        with profiling.track(self.memory, 'load Ss.xml'):
+            tree = etree.parse(filename, parser)
 
         for chapter in tree.xpath('//tei:div[@n]', namespaces={'tei':
                                                               'http://www.tei-c.org/ns/1.0'}):
@@ -102,27 +142,10 @@ class IndiceCreator(object):
         #This section works out which divs start on which page of each manuscript
         manuscript_pages = {}
         for ms in self.manuscripts:
-            print(ms)
-            manuscript_pages[ms] = {}
-            for pagefile in os.listdir(os.path.join(self.data_path,
-                                                    'transcription',
-                                                    ms)):
-                if pagefile.endswith('.json'):
-                    with open(os.path.join(self.data_path,
-                                           'transcription',
-                                           ms,
-                                           pagefile),
-                              encoding="utf-8") as file_p:
-                        page = json.load(file_p)
-                    try:
-                        root_element = etree.fromstring(page['text'])
-                    except etree.XMLSyntaxError:
-                        print("Not parsing xml of %s, %s" % (ms, pagefile))
-                    else:
-                        divs = root_element.findall('.//div[@n]')
-                        for div in divs:
-                            if 'continued' not in div.attrib:
-                                manuscript_pages[ms][div.attrib['n'].replace('VC_', '')] = pagefile.replace('.json', '')
+            manuscript_pages[ms] = self.get_manuscript_pages(ms)
+
+        if self.parsed_pages is not None:
+            self.parsed_pages.close()
 
         # now we add manuscript page details to the index
         for pos in indice:
@@ -132,9 +155,83 @@ class IndiceCreator(object):
                     indice[pos]['manuscripts'].append(ms)
                     indice[pos]['pages'][ms] = manuscript_pages[ms][div_id]
 
-        with open(os.path.join(self.data_path,
-                               'indice.json'), 'w', encoding="utf-8") as output:
-            output.write(json.dumps(indice))
+        self.write_indice(indice)
+
+    def get_manuscript_pages(self, ms):
+        """Return the page each chapter div of a manuscript starts on."""
+        pages = {}
+        with profiling.track(self.memory, ms):
+            print(ms)
+            for pagefile in sorted(build_output.list_directory(os.path.join(self.data_path,
+                                                                            'transcription',
+                                                                            ms))):
+                if pagefile.endswith('.json'):
+                    page = json.loads(build_output.read_text(os.path.join(self.data_path,
+                                                                          'transcription',
+                                                                          ms,
+                                                                          pagefile)))
+                    divs = page_cache.get(self.parsed_pages, page['text'], ms,
+                                          pagefile.replace('.json', ''), get_chapter_divs)
+                    if divs is not None:
+                        for n, continued in divs:
+                            if not continued:
+                                pages[n.replace('VC_', '')] = pagefile.replace('.json', '')
+        return pages
+
+    def update_indice(self, indice):
+        """Replace the pages of the selected manuscripts in an existing index.
+
+        The chapter list and the other manuscripts' pages are left as they are."""
+        print('updating manuscript page data')
+        for ms in self.update_manuscripts:
+            if ms in self.manuscripts:
+                pages = self.get_manuscript_pages(ms)
+            else:
+                pages = {}
+            for entry in indice.values():
+                if ms in entry['manuscripts']:
+                    entry['manuscripts'].remove(ms)
+                    del entry['pages'][ms]
+                if entry['div'] in pages:
+                    # keep the manuscripts in the order of a full build
+                    bisect.insort(entry['manuscripts'], ms)
+                    entry['pages'][ms] = pages[entry['div']]
+                    entry['pages'] = dict([(manuscript, entry['pages'][manuscript])
+                                           for manuscript in entry['manuscripts']])
+
+        if self.parsed_pages is not None:
+            self.parsed_pages.close()
+
+        self.write_indice(indice)
+
+    def write_indice(self, indice):
+        """Write indice.json and the chunks of the index."""
+        build_output.write_json(os.path.join(self.data_path, 'indice.json'),
+                                indice)
+        chunk_path = os.path.join(self.data_path, 'indice')
+        if not self.chunk_size:
+            build_output.remove(chunk_path)
+            return
+        positions = list(indice)
+        chunks = 0
+        with build_output.staged_directory(chunk_path) as staged_path:
+            for start in range(0, len(positions), self.chunk_size):
+                chunk = dict([(pos, indice[pos])
+                              for pos in positions[start:start + self.chunk_size]])
+                build_output.write_json(os.path.join(staged_path, '%d.json' % chunks),
+                                        chunk)
+                chunks += 1
+            build_output.write_json(os.path.join(staged_path, 'manifest.json'),
+                                    {'count': len(positions),
+                                     'chunk_size': self.chunk_size,
+                                     'chunks': chunks})
+
+
+def get_chapter_divs(text):
+    """Return the n and whether it is continued of each div with an n on a page."""
+    root_element = etree.fromstring(text)
+    return [(div.attrib['n'], 'continued' in div.attrib)
+            for div in root_element.findall('.//div[@n]')]
 
 
 def main(argv):
@@ -145,14 +242,42 @@ def main(argv):
                         help='the path to the data diretory for output'
                              '(only used by the django app, use default for '
                              'webpack build)')
+    parser.add_argument('-x', '--xml_path',
+                        help='the directory containing the transcription XML files '
+                             '(default %s)' % XML_DIR)
+    parser.add_argument('--index_file',
+                        help='the chapter index csv file (default %s)' % INDEX_FILE)
+    parser.add_argument('--chunk_size', type=int, default=CHUNK_SIZE,
+                        help='the number of entries in each chunk of the index '
+                             '(default %d, 0 for no chunks)' % CHUNK_SIZE)
+    build_output.add_selection_argument(parser)
+    build_output.add_argument(parser)
+    profiling.add_memory_argument(parser)
+    page_cache.add_argument(parser)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    build_output.set_pretty(args.pretty)
+    build_output.set_writer_threads(args.writer_threads)
+    build_output.set_output(args.output)
+    page_cache.set_cache_dir(args.page_cache_dir)
+    memory = profiling.start_memory_tracking(args.memory)
 
     if args.data_path:
-        ic = IndiceCreator(data_path=args.data_path)
+        data_path = args.data_path
     else:
-        ic = IndiceCreator()
-    ic.make_indice()
+        data_path = DATA_DIR
+    with build_output.build_stage(data_path, 'make_chapter_index_json',
+                                  ['indice.json', 'indice']), \
+         profiling.track(memory, 'make_chapter_index_json'):
+        ic = IndiceCreator(data_path=data_path, directory=args.xml_path or XML_DIR,
+                           index_file=args.index_file or INDEX_FILE)
+        ic.memory = memory
+        ic.update_manuscripts = build_output.get_selection(parser, args)[0]
+        ic.chunk_size = args.chunk_size
+        ic.parsed_pages = page_cache.open_cache(data_path, 'chapter-divs', [__file__],
+                                                not args.no_page_cache)
+        ic.make_indice()
+    profiling.stop_memory_tracking(memory, args.memory)
 
 if __name__ == '__main__':
     main(sys.argv[1:])
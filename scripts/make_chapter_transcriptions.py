@@ -0,0 +1,183 @@
+#!/usr/bin/python3
+
+"""
+This script makes a transcription of each chapter of each manuscript as a single
+document so that a whole chapter can be opened with one request rather than by
+following the next links page by page.
+
+The pagination in make_paginated_json.py splits chapters across pages, closing
+the open elements at each page break and reopening them on the next page with
+continued="true". This script puts the chapter back together by going through
+the pages of each manuscript in order, taking the fragment of each chapter div
+found on the page, rendering it with the DisplayTextGenerator from
+add_html_to_paginated_json.py and joining the fragments. The generator only
+opens the column divs (and writes any rubric held back until then) at a column
+break so a fragment which starts part way through a column is given a copy of
+the cb of that column. A page boundary marker is added
+before each fragment:
+
+<span class="page-boundary" data-page="[page]">[page]</span>
+
+The result is stored as a json object in data/chapters/[siglum]/[chapter].json
+with the following keys
+
+* document - the manuscript siglum
+* chapter - the @n value of the chapter div
+* pages - the list of pages the chapter is found on
+* html - the html which expands the abbreviations
+* html_abbrev - the html which displays the abbreviated forms
+
+The hover overs of the abbreviations are added to data/abbreviations.json (see
+add_html_to_paginated_json.py).
+
+The page order is taken from the menu data (data/menu/[siglum].json) so
+make_paginated_json.py must be run first.
+
+No arguments needed unless being run by the admin app in which case
+the path to the data directory must be supplied.
+
+"""
+import sys
+import argparse
+import os
+import json
+from xml.etree.ElementTree import ParseError
+from lxml import etree
+import build_output
+import page_cache
+from add_html_to_paginated_json import DisplayTextGenerator, load_abbreviations, ABBREVIATIONS_FILE
+
+DATA_DIR = '../data'
+PAGE_BOUNDARY_TEMPLATE = '<span class="page-boundary" data-page="%s">%s</span>'
+
+
+class ChapterStitcher(object):
+    """Make single document transcriptions of each chapter."""
+    def __init__(self, data_path=DATA_DIR):
+        self.data_path = data_path
+        self.page_path = os.path.join(data_path, 'transcription')
+        self.menu_path = os.path.join(data_path, 'menu')
+        self.chapter_path = os.path.join(data_path, 'chapters')
+        self.generators = {False: DisplayTextGenerator(data_path=data_path, expanded=False),
+                           True: DisplayTextGenerator(data_path=data_path, expanded=True)}
+        # the chapters share the abbreviation dictionary of the pages
+        self.abbreviations = load_abbreviations(data_path)
+        for generator in self.generators.values():
+            generator.abbreviations = self.abbreviations
+        # a page_cache.ParsedPageCache of the chapter fragments on each page
+        self.parsed_pages = None
+
+    def process(self):
+        """Make the chapters for every manuscript."""
+        print('creating chapter transcriptions')
+        for ms in sorted(build_output.list_directory(self.page_path)):
+            print(ms)
+            self.process_manuscript(ms)
+        if self.parsed_pages is not None:
+            self.parsed_pages.close()
+
+    def get_fragments(self, text):
+        """Return each chapter div on a page as (chapter, column, xml) tuples in order.
+
+        column is the XML of the cb of the column the div starts part way
+        through or '' if the div starts before the first cb on the page or
+        with its own cb."""
+        root_element = etree.fromstring(text)
+        fragments = []
+        column = ''
+        for element in root_element.iter():
+            if element.tag == 'cb':
+                column = '<cb n="%s"/>' % element.get('n') if element.get('n') else '<cb/>'
+            if element.tag != 'div' or not element.get('n') or element.find('.//div[@n]') is not None:
+                continue
+            starts_with_column = (len(element) and element[0].tag == 'cb'
+                                  and not (element.text or '').strip())
+            fragments.append((element.get('n'), '' if starts_with_column else column,
+                              etree.tounicode(element, with_tail=False)))
+        return fragments
+
+    def process_manuscript(self, ms):
+        """Stitch together the chapters of a single manuscript and save them."""
+        try:
+            pages = json.loads(build_output.read_text(os.path.join(self.menu_path,
+                                                                   '%s.json' % ms)))
+        except FileNotFoundError:
+            print('No page list for %s, run make_paginated_json.py first' % ms)
+            return
+        chapters = {}
+        for page in pages:
+            text = json.loads(build_output.read_text(os.path.join(self.page_path, ms,
+                                                                  '%s.json' % page)))['text']
+            fragments = page_cache.get(self.parsed_pages, text, ms, page, self.get_fragments)
+            if fragments is None:
+                continue
+            for chapter, column, fragment in fragments:
+                if chapter not in chapters:
+                    chapters[chapter] = {'document': ms,
+                                         'chapter': chapter,
+                                         'pages': [],
+                                         'html': [],
+                                         'html_abbrev': []}
+                self.add_fragment(chapters[chapter], page, column + fragment)
+
+        build_output.make_directories(os.path.join(self.chapter_path, ms))
+        for chapter in chapters:
+            chapters[chapter]['html'] = ''.join(chapters[chapter]['html'])
+            chapters[chapter]['html_abbrev'] = ''.join(chapters[chapter]['html_abbrev'])
+            build_output.write_json(os.path.join(self.chapter_path, ms,
+                                                 '%s.json' % chapter),
+                                    chapters[chapter])
+
+    def add_fragment(self, chapter_data, page, fragment):
+        """Render a fragment of a chapter and add it to the chapter."""
+        data = {'text': '<root><pb n="%s"/>%s</root>' % (page, fragment)}
+        # the page name is used in the ids of the tooltips so include the
+        # chapter to keep them distinct from those in the page view
+        identifier = '%s-%s' % (page, chapter_data['chapter'])
+        try:
+            html = self.generators[True].render_page(data, chapter_data['document'], identifier)
+            html_abbrev = self.generators[False].render_page(data, chapter_data['document'], identifier)
+        except ParseError:
+            print("Skipping:", chapter_data['document'], page, chapter_data['chapter'])
+            return
+        boundary = PAGE_BOUNDARY_TEMPLATE % (page, page)
+        chapter_data['pages'].append(page)
+        chapter_data['html'].append(boundary + html)
+        chapter_data['html_abbrev'].append(boundary + html_abbrev)
+
+
+def main(argv):
+    """Run when module called."""
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--data_path',
+                        help='the path to the data directory'
+                             '(only used by the django app, use default for '
+                             'webpack build)')
+    build_output.add_argument(parser)
+    page_cache.add_argument(parser)
+
+    args = parser.parse_args(argv)
+    build_output.set_pretty(args.pretty)
+    build_output.set_writer_threads(args.writer_threads)
+    build_output.set_output(args.output)
+    page_cache.set_cache_dir(args.page_cache_dir)
+
+    if args.data_path:
+        data_path = args.data_path
+    else:
+        data_path = DATA_DIR
+    with build_output.build_stage(data_path, 'make_chapter_transcriptions',
+                                  ['chapters', ABBREVIATIONS_FILE]):
+        stitcher = ChapterStitcher(data_path=data_path)
+        stitcher.parsed_pages = page_cache.open_cache(data_path, 'chapter-fragments', [__file__],
+                                                      not args.no_page_cache)
+        with build_output.staged_directory(stitcher.chapter_path) as chapter_path:
+            stitcher.chapter_path = chapter_path
+            stitcher.process()
+        build_output.write_json(os.path.join(data_path, ABBREVIATIONS_FILE),
+                                dict(sorted(stitcher.abbreviations.items())))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
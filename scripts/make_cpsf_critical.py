@@ -15,9 +15,9 @@ The critical.xml file should be put in transcriptions/criticalXML
 import sys
 import argparse
 import os
-import shutil
-import json
 from lxml import etree
+import build_output
+import profiling
 
 DATA_DIR = '../data'
 CRITICAL_DIR = '../../../../transcriptions/criticalXML'
@@ -25,15 +25,17 @@ RUBRIC_TEMPLATE = '<span class="rubric">%s</span><br />\n'
 
 class Critical(object):
     """Make critical pages."""
-    def __init__(self, data_path=DATA_DIR):
+    def __init__(self, data_path=DATA_DIR, directory=CRITICAL_DIR):
         self.data_path = data_path
         parser = etree.XMLParser(resolve_entities=False)
-        self.tree = etree.parse(os.path.join(CRITICAL_DIR, 'critical.xml'),
+        self.tree = etree.parse(os.path.join(directory, 'critical.xml'),
                                 parser)
 
         self.page_path = os.path.join(data_path, 'cpsfcritical')
         self.info_count = 0
         self.page_list = []
+        # a profiling.MemoryTracker to record the peak memory of each chapter
+        self.memory = None
 
     def process(self):
         """Process all the pages."""
@@ -42,14 +44,12 @@ class Critical(object):
                                    namespaces={'tei':
                                                'http://www.tei-c.org/ns/1.0'}):
 
-            self.process_page(div)
+            with profiling.track(self.memory, 'chapter %s' % div.get('n')):
+                self.process_page(div)
 
 
-        with open(os.path.join(self.data_path,
-                               'cpsf_critical_pages.js'),
-                  'w', encoding="utf-8") as list_fo:
-            list_fo.write('CPSF_CRITICAL_PAGES = ')
-            json.dump(self.page_list, list_fo, indent=4)
+        build_output.write_js(os.path.join(self.data_path, 'cpsf_critical_pages.js'),
+                              'CPSF_CRITICAL_PAGES', self.page_list)
 
     def get_text(self, block):
         """ """
@@ -126,19 +126,12 @@ class Critical(object):
 
         self.page_list.append(name)
 
-        with open(os.path.join(self.page_path, '%s.html' % name),
-                  'w', encoding="utf-8") as output_fo:
-            output_fo.write(output)
+        build_output.write_text(os.path.join(self.page_path, '%s.html' % name),
+                                output)
 
     def clear_cpsfcritical_directory(self):
-        try:
-            shutil.rmtree(self.page_path)
-        except:
-            pass
-        try:
-            os.mkdir(self.page_path)
-        except FileExistsError:
-            pass
+        build_output.remove(self.page_path)
+        build_output.make_directories(self.page_path)
         print('old critical pages deleted')
 
 def main(argv):
@@ -147,15 +140,33 @@ def main(argv):
                         help='the path to the data directory'
                              '(only used by the django app, use default for '
                              'webpack build)')
-
-    args = parser.parse_args()
+    parser.add_argument('-x', '--xml_path',
+                        help='the directory containing critical.xml '
+                             '(default %s)' % CRITICAL_DIR)
+    build_output.add_argument(parser)
+    profiling.add_memory_argument(parser)
+
+    args = parser.parse_args(argv)
+    build_output.set_pretty(args.pretty)
+    build_output.set_writer_threads(args.writer_threads)
+    build_output.set_output(args.output)
+    memory = profiling.start_memory_tracking(args.memory)
 
     if args.data_path:
-        CRITICAL = Critical(data_path=args.data_path)
+        data_path = args.data_path
     else:
-        CRITICAL = Critical()
-    CRITICAL.clear_cpsfcritical_directory()
-    CRITICAL.process()
+        data_path = DATA_DIR
+    with build_output.build_stage(data_path, 'make_cpsf_critical',
+                                  ['cpsfcritical', 'cpsf_critical_pages.js']), \
+         profiling.track(memory, 'make_cpsf_critical'):
+        with profiling.track(memory, 'load critical.xml'):
+            CRITICAL = Critical(data_path=data_path,
+                                directory=args.xml_path or CRITICAL_DIR)
+        CRITICAL.memory = memory
+        with build_output.staged_directory(CRITICAL.page_path) as page_path:
+            CRITICAL.page_path = page_path
+            CRITICAL.process()
+    profiling.stop_memory_tracking(memory, args.memory)
 
 if __name__ == "__main__":
     main(sys.argv[1:])
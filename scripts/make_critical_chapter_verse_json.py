@@ -15,88 +15,154 @@ This file is saved to data/collations.js
 The final file is a list of all of the critical text pages avilable which is used for the
 VPE dropdown and is stored in data/critical_pages.js
 
+The collation files are named D[chapter]S[verse].json and the names are parsed
+into VerseKeys (see verse_key.py) so that the verses of each chapter are sorted
+once, with the rubric first.
+
+The admin app reruns this script after every approval. To avoid reading and
+sorting the whole directory each time the list is saved in
+data/.collation_list.json and with --incremental the script only applies the
+differences between it and the directory, inserting and removing verses at
+their sorted places. If the app knows which files were approved or removed it
+can pass them with --add and --remove and the directory is not read at all.
+The three files are only rewritten when the list changes.
+
 """
 import sys
 import argparse
 import os
-import json
+import bisect
+import build_output
+from verse_key import VerseKey
 
 DATA_DIR = '../data'
 COLLATIONS_DIR = '../../../../collation/approved'
-
-def make_critical_text_files(data_path=DATA_DIR):
-    blobs = [filename.strip('.json') for filename in os.listdir(COLLATIONS_DIR)]
-    blobs.sort()
-    data = {}
-
-    for blob in blobs:
-        if blob == 'DS_Store':
-            continue
-        if 'S' in blob:
-            something = blob.split('S')
-
-            verse = something[1]
-            chapter = something[0].upper().lstrip('D')
-            if verse == "400>":
-                print(something)
-                verse = 400.1
-            elif verse == "659.1":
-                print(something)
-                verse = 659.1
-
-            try:
-                chapter = int(chapter)
-            except ValueError:
-                print("Choked on", chapter)
-                pass
-            if not chapter in data:
-                data[chapter] = []
-            try:
-                verse = int(verse)
-            except ValueError:
-                pass
-
-            if verse == 'RUBRIC':
-                verse = 'Rubric'
-            if verse == 'rubric':
-                verse = 'Rubric'
-
-            if verse == 'Rubric':
-                data[chapter].insert(0, verse)
-            else:
-                data[chapter].append(verse)
-                rubric = False
-                if 'Rubric' in data[chapter]:
-                    data[chapter].remove('Rubric')
-                    rubric = True
-
-                try:
-                    data[chapter].sort()
-                except TypeError:
-                    print(chapter, verse, data[chapter])
-
-                if rubric:
-                    data[chapter].insert(0, 'Rubric')
-
-        else:
-            continue
-
-    chapters = list(data.keys())
-    chapters.sort(key = lambda x: int(x))
-    with open(os.path.join(data_path, 'critical_pages.js'), 'w') as js_file:
-        int_chapters = [int(x) for x in chapters]
-        js_file.write('CRITICAL_PAGES = ')
-        json.dump(int_chapters, js_file, indent=4)
-
-    #if we add to a new dictionary in order the order will be preserved
-    new_data = {}
-    for chapter in chapters:
-        new_data[chapter] = data[chapter]
-    with open(os.path.join(data_path, 'collations.json'), 'w') as fp:
-        json.dump(new_data, fp, indent=4)
-    with open(os.path.join(data_path, 'collations.js'), 'w') as js_file:
-        js_file.write('COLLATION_LIST = ')
-        json.dump(new_data, js_file, indent=4)
+OUTPUTS = ['collations.json', 'collations.js', 'critical_pages.js']
+STATE_FILE = '.collation_list.json'
+STATE_VERSION = 1
+
+class CollationList(object):
+    """The approved collations of each chapter in verse order."""
+    def __init__(self, directory=COLLATIONS_DIR):
+        self.directory = os.path.abspath(directory)
+        # chapter -> the sorted (VerseKey, file name) of its approved collations
+        self.chapters = {}
+        # the collation file names in the list
+        self.filenames = set()
+        self.changed = False
+
+    @staticmethod
+    def parse(filename):
+        """Return the VerseKey of a collation file or None if it isn't one."""
+        if not filename.endswith('.json'):
+            return None
+        try:
+            key = VerseKey.parse(filename[:-len('.json')])
+        except ValueError:
+            return None
+        if not isinstance(key.chapter, int):
+            print("Choked on", key.chapter)
+            return None
+        return key
+
+    def add(self, filename):
+        """Insert a collation file at its place in its chapter."""
+        if filename in self.filenames:
+            return
+        key = self.parse(filename)
+        if key is None:
+            return
+        if key.chapter not in self.chapters:
+            self.chapters[key.chapter] = []
+        bisect.insort(self.chapters[key.chapter], (key, filename))
+        self.filenames.add(filename)
+        self.changed = True
+
+    def remove(self, filename):
+        """Remove a collation file from its chapter."""
+        if filename not in self.filenames:
+            return
+        key = self.parse(filename)
+        verses = self.chapters[key.chapter]
+        del verses[bisect.bisect_left(verses, (key, filename))]
+        if not verses:
+            del self.chapters[key.chapter]
+        self.filenames.remove(filename)
+        self.changed = True
+
+    def scan(self):
+        """Add the new files in the collations directory and remove the deleted ones."""
+        filenames = set(os.listdir(self.directory))
+        for filename in sorted(self.filenames - filenames):
+            self.remove(filename)
+        for filename in sorted(filenames - self.filenames):
+            self.add(filename)
+
+    def load(self, filename):
+        """Load the list saved by save, returning False if there isn't one for this directory."""
+        state = build_output.load_json(filename, {})
+        if state.get('version') != STATE_VERSION or state.get('directory') != self.directory:
+            return False
+        for filenames in state['chapters']:
+            verses = [(self.parse(name), name) for name in filenames]
+            self.chapters[verses[0][0].chapter] = verses
+            self.filenames.update(filenames)
+        return True
+
+    def save(self, filename):
+        """Save the list (as build state rather than an output)."""
+        chapters = []
+        for chapter in sorted(self.chapters):
+            chapters.append([name for key, name in self.chapters[chapter]])
+        build_output.write_state(filename, {'version': STATE_VERSION,
+                                            'directory': self.directory,
+                                            'chapters': chapters})
+
+    def write(self, data_path):
+        """Write collations.json, collations.js and critical_pages.js."""
+        chapters = sorted(self.chapters.keys())
+        build_output.write_js(os.path.join(data_path, 'critical_pages.js'),
+                              'CRITICAL_PAGES', chapters)
+
+        #if we add to a new dictionary in order the order will be preserved
+        new_data = {}
+        for chapter in chapters:
+            new_data[chapter] = [key.value() for key, name in self.chapters[chapter]]
+        build_output.write_json(os.path.join(data_path, 'collations.json'),
+                                new_data)
+        build_output.write_js(os.path.join(data_path, 'collations.js'),
+                              'COLLATION_LIST', new_data)
+
+
+def make_critical_text_files(data_path=DATA_DIR, incremental=False, added=(), removed=(),
+                             directory=COLLATIONS_DIR):
+    """Make the collation lists from the approved collations.
+
+    With incremental the list saved by the last run is updated with the
+    files given in added and removed or, if there are none, with the
+    differences between it and the collations directory. The lists are only
+    rewritten if they have changed. Without a saved list the whole directory
+    is read."""
+    state_file = os.path.join(data_path, STATE_FILE)
+    collations = CollationList(directory)
+    if incremental and collations.load(state_file):
+        for filename in removed:
+            collations.remove(os.path.basename(filename))
+        for filename in added:
+            collations.add(os.path.basename(filename))
+        if not added and not removed:
+            collations.scan()
+        for output in OUTPUTS:
+            if not build_output.path_exists(os.path.join(data_path, output)):
+                collations.changed = True
+    else:
+        collations.scan()
+        collations.changed = True
+    if not collations.changed:
+        print('collation lists unchanged')
+        return
+    collations.write(data_path)
+    collations.save(state_file)
 
 
 def main(argv):
@@ -106,13 +172,35 @@ def main(argv):
                         help='the path to the data directory'
                              '(only used by the django app, use default for '
                              'webpack build)')
-
-    args = parser.parse_args()
+    parser.add_argument('-c', '--collations_path',
+                        help='the directory of approved collations '
+                             '(default %s)' % COLLATIONS_DIR)
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='update the list saved by the last run rather '
+                             'than reading the whole collations directory')
+    parser.add_argument('--add', action='append', default=[], metavar='FILE',
+                        help='a newly approved collation file to add to the '
+                             'saved list (can be repeated, implies --incremental)')
+    parser.add_argument('--remove', action='append', default=[], metavar='FILE',
+                        help='a collation file to remove from the saved list '
+                             '(can be repeated, implies --incremental)')
+    build_output.add_argument(parser)
+
+    args = parser.parse_args(argv)
+    build_output.set_pretty(args.pretty)
+    build_output.set_writer_threads(args.writer_threads)
+    build_output.set_output(args.output)
 
     if args.data_path:
-        make_critical_text_files(data_path=args.data_path)
+        data_path = args.data_path
     else:
-        make_critical_text_files()
+        data_path = DATA_DIR
+    with build_output.build_stage(data_path, 'make_critical_chapter_verse_json',
+                                  OUTPUTS):
+        make_critical_text_files(data_path=data_path,
+                                 incremental=args.incremental or bool(args.add or args.remove),
+                                 added=args.add, removed=args.remove,
+                                 directory=args.collations_path or COLLATIONS_DIR)
 
 
 if __name__ == '__main__':
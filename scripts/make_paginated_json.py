@@ -3,9 +3,10 @@
 This script is the first stage for ingesting the XML transcriptions. It splits
 the XML into pages and stores a json object for each page in a file in the
 data/transcription directory (further subdivided by Manuscript)
-with the page number used as the name of the file. The script clears the
-transcription directory before starting to make sure that any no longer wanted
-pages are deleted.
+with the page number used as the name of the file. The pages are written to a
+staging directory which replaces the transcription directory when the script
+has finished, so any no longer wanted pages are deleted and the website never
+sees a partly built directory.
 
 The resulting JSON contains the following keys
 
@@ -15,6 +16,20 @@ The resulting JSON contains the following keys
 * document - the manuscript siglum
 * text - the XML for the page (wrapped in a 'root' element)
 
+The page lists used for the navigation drop downs are written one file per
+manuscript to data/menu/[siglum].json so the viewer only downloads the list for
+a manuscript when it is needed. data/menu_data.js only contains a small manifest
+(the variable MENU_MANIFEST) mapping each siglum to its number of pages.
+
+To rebuild only some manuscripts after editing them use --manuscript with a
+comma separated list of sigla. Only those transcriptions are paginated, only
+their directories are replaced and their entries in the manifest are updated
+(the other manuscripts are not read). Adding --pages with a list of page names
+(for a single manuscript) only rewrites those pages, unless the pages of the
+manuscript have changed, in which case they are all rewritten. Note that an edit
+which changes elements continued onto the following pages changes those pages
+too so they should be included.
+
 No arguments needed unless being run by the admin app in which case
 the path to the data directory must be supplied.
 Following this run add_html_to_paginated_json.py to add the html data to the json files
@@ -22,10 +37,11 @@ Following this run add_html_to_paginated_json.py to add the html data to the jso
 """
 import sys
 import os
-import shutil
 import argparse
-import json
+import time
 from lxml import etree
+import build_output
+import profiling
 
 XML_DIR = '../../../../transcriptions/manuscripts'
 DATA_DIR = '../data'
@@ -39,36 +55,109 @@ class PageSplitter(object):
         self.ns_map = {'tei': 'http://www.tei-c.org/ns/1.0'}
         self.data_path = data_path
         self.page_path = os.path.join(data_path, 'transcription')
+        self.menu_path = os.path.join(data_path, 'menu')
+        # a profiling.HandlerProfiler to time the handlers and files
+        self.profiler = None
+        # a profiling.MemoryTracker to record the peak memory of each file
+        self.memory = None
+        # the sigla of the manuscripts to paginate and the names of the pages
+        # to write (None for all of them)
+        self.manuscripts = None
+        self.pages = None
+        # siglum -> the directory its pages are written to if not in page_path
+        self.document_paths = {}
 
     def separate_pages(self):
         """Go through file system to find the transcriptions and call splitting functions """
         for root, dirs, files in os.walk(self.directory):
-            for file in files:
+            # walk in a fixed order so the output does not depend on the file system
+            dirs.sort()
+            for file in sorted(files):
                 self.filename = file
                 filename = os.path.join(root, file)
                 if filename.endswith('.xml'):
-                    self.open_elems = []
-                    self.page_count = 1
-                    self.node_stack = []
-                    self.waiting_for_page = []
-                    self.header_done = False
-                    self.original_filename = filename
                     self.siglum = file.replace('.xml', '').split('-')[0]
+                    if self.manuscripts is not None and self.siglum not in self.manuscripts:
+                        continue
+                    document_path = self.get_document_path(self.siglum)
                     # create the subdirectory in ../transcription
-                    if not os.path.exists(os.path.join(self.page_path, self.siglum)):
-                        os.mkdir(os.path.join(self.page_path, self.siglum))
+                    build_output.make_directories(document_path)
                     self.page_lists[self.siglum] = []
 
                     print(self.siglum)
-                    parser = etree.iterparse(filename, events=("start", "end"), encoding="utf-8")
-                    pages = self.flatten_pages(parser)
-                    with open('temp_%s.xml' % self.siglum, 'w', encoding="utf-8") as output_file:
-                        output_file.write('<?xml version="1.0" encoding="UTF-8"?>\n%s' % ''.join(pages).replace('{http://www.w3.org/XML/1998/namespace}', '').replace('&', '&amp;'))
-                    self.split_pages()
-        # print out the index for the drop down menus
-        with open(os.path.join(self.data_path, 'menu_data.js'), 'w', encoding="utf-8") as list_fo:
-            list_fo.write('MENU_DATA = ')
-            json.dump(self.page_lists, list_fo, indent=4)
+                    with profiling.track(self.memory, file):
+                        start = time.perf_counter()
+                        pages = self.paginate(filename)
+                        if self.profiler is not None:
+                            self.profiler.add_page(file, time.perf_counter() - start,
+                                                   sum([len(page_json['text']) for page_json in pages]))
+                        self.write_pages(document_path, pages)
+                        self.page_lists[self.siglum] = [page_json['name'] for page_json in pages]
+        self.write_menu_data()
+
+    def get_sigla(self):
+        """Return the sigla of the transcription files."""
+        sigla = set()
+        for root, dirs, files in os.walk(self.directory):
+            for file in files:
+                if file.endswith('.xml'):
+                    sigla.add(file.replace('.xml', '').split('-')[0])
+        return sigla
+
+    def get_document_path(self, siglum):
+        return self.document_paths.get(siglum, os.path.join(self.page_path, siglum))
+
+    def write_pages(self, document_path, pages):
+        """Write the pages of the current manuscript.
+
+        If only some pages were asked for and the manuscript still has the
+        same pages only those are written, otherwise all of them are and any
+        pages which no longer exist are removed."""
+        page_names = [page_json['name'] for page_json in pages]
+        if self.pages is not None:
+            missing = self.pages - set(page_names)
+            if missing:
+                print('%s has no pages %s' % (self.siglum, ', '.join(sorted(missing))))
+            old_page_names = build_output.load_json(os.path.join(self.menu_path,
+                                                                 '%s.json' % self.siglum), None)
+            if page_names == old_page_names:
+                for page_json in pages:
+                    if page_json['name'] in self.pages:
+                        build_output.write_json(os.path.join(document_path, '%s.json' % page_json['name']), page_json)
+                return
+            print('the pages of %s have changed, writing all of them' % self.siglum)
+        for page_json in pages:
+            build_output.write_json(os.path.join(document_path, '%s.json' % page_json['name']), page_json)
+        for filename in build_output.list_directory(document_path):
+            if filename.endswith('.json') and filename[:-len('.json')] not in page_names:
+                build_output.remove(os.path.join(document_path, filename))
+
+    def paginate(self, filename):
+        """Split a single transcription file into pages and return the json data for each page."""
+        self.open_elems = []
+        self.page_count = 1
+        self.node_stack = []
+        self.waiting_for_page = []
+        self.header_done = False
+        self.original_filename = filename
+        self.siglum = os.path.basename(filename).replace('.xml', '').split('-')[0]
+        parser = etree.iterparse(filename, events=("start", "end"), encoding="utf-8")
+        pages = self.flatten_pages(parser)
+        return self.split_pages('<?xml version="1.0" encoding="UTF-8"?>\n%s' % pages.replace('{http://www.w3.org/XML/1998/namespace}', '').replace('&', '&amp;'))
+
+    def write_menu_data(self):
+        """Write the page list of each manuscript for the drop down menus and the manifest listing them."""
+        build_output.make_directories(self.menu_path)
+        manifest = {}
+        if self.manuscripts is not None:
+            # keep the entries of the other manuscripts
+            manifest = build_output.load_js(os.path.join(self.data_path, 'menu_data.js'),
+                                            'MENU_MANIFEST', {})
+        for siglum in sorted(self.page_lists):
+            manifest[siglum] = len(self.page_lists[siglum])
+            build_output.write_json(os.path.join(self.menu_path, '%s.json' % siglum), self.page_lists[siglum])
+        build_output.write_js(os.path.join(self.data_path, 'menu_data.js'), 'MENU_MANIFEST',
+                              dict(sorted(manifest.items())))
 
     def process_start_TEI(self, elem):
         return '<div type="root">'
@@ -104,23 +193,30 @@ class PageSplitter(object):
         output_text = []
         for event, elem in parser:
             try:
-                new_text = getattr(self, "process_%s_%s" % (event, elem.tag.replace('{http://www.tei-c.org/ns/1.0}', '')))(elem)
+                handler = getattr(self, "process_%s_%s" % (event, elem.tag.replace('{http://www.tei-c.org/ns/1.0}', '')))
+                if self.profiler is None:
+                    new_text = handler(elem)
+                else:
+                    new_text = self.profiler.call(handler, elem)
             except AttributeError:
-                new_text = getattr(self, "process_%s_tag" % event)(elem)
-            finally:
-                if new_text is not None:
-                    output_text.append(new_text)
-                if event == 'start' and elem.text != None:
-                    if self.page_count == 1 and self.header_done == True:
-                        self.waiting_for_page.append(elem.text)
-                    else:
-                        output_text.append(elem.text)
-
-                if event == 'end' and elem.tail != None:
-                    if self.page_count == 1 and self.header_done == True:
-                        self.waiting_for_page.append(elem.tail)
-                    else:
-                        output_text.append(elem.tail)
+                handler = getattr(self, "process_%s_tag" % event)
+                if self.profiler is None:
+                    new_text = handler(elem)
+                else:
+                    new_text = self.profiler.call(handler, elem)
+            if new_text is not None:
+                output_text.append(new_text)
+            if event == 'start' and elem.text != None:
+                if self.page_count == 1 and self.header_done == True:
+                    self.waiting_for_page.append(elem.text)
+                else:
+                    output_text.append(elem.text)
+
+            if event == 'end' and elem.tail != None:
+                if self.page_count == 1 and self.header_done == True:
+                    self.waiting_for_page.append(elem.tail)
+                else:
+                    output_text.append(elem.tail)
 
         return ''.join(output_text)
 
@@ -134,9 +230,10 @@ class PageSplitter(object):
         number = int(folio.replace('v', '')) + 1
         return '%dr' % number
 
-    def split_pages(self):
+    def split_pages(self, flattened):
+        """Split the flattened XML into pages."""
         parser = etree.XMLParser(resolve_entities=False, encoding='utf-8')
-        tree = etree.parse('temp_%s.xml' % self.siglum, parser)
+        tree = etree.fromstring(flattened.encode('utf-8'), parser)
         pages = tree.xpath('.//root')
         page_numbers = []
 
@@ -151,8 +248,9 @@ class PageSplitter(object):
                 page_number = folio
             page_numbers.append(page_number)
 
-        # now split the pages into separate files
+        # now split the pages into separate json objects
         pages = tree.xpath('.//root')
+        page_data = []
         for i, page in enumerate(pages):
             page_json = {'document': self.siglum}
             try:
@@ -169,12 +267,8 @@ class PageSplitter(object):
             except IndexError:
                 page_json['next'] = None
             page_json['text'] = etree.tounicode(page)
-            with open(os.path.join(self.page_path, self.siglum, '%s.json' % page_json['name']), 'w', encoding="utf-8") as output_file:
-                json.dump(page_json, output_file, ensure_ascii=False, indent=4)
-        # clean up
-        self.page_lists[self.siglum] = page_numbers
-
-        os.remove('temp_%s.xml' % self.siglum)
+            page_data.append(page_json)
+        return page_data
 
 
     def process_start_div(self, elem):
@@ -238,14 +332,9 @@ class PageSplitter(object):
         pass
 
     def clear_transcription_directory(self):
-        try:
-            shutil.rmtree(self.page_path)
-        except:
-            pass
-        try:
-            os.makedirs(self.page_path)
-        except FileExistsError:
-            pass
+        for path in [self.page_path, self.menu_path]:
+            build_output.remove(path)
+            build_output.make_directories(path)
         print('old pages deleted')
 
 
@@ -257,16 +346,55 @@ def main(argv):
                         help='the path to the data directory for output'
                              '(only used by the estoria-admin app, use default for '
                              'webpack build)')
-
-    args = parser.parse_args()
-
-    if args.data_path:
-        ps = PageSplitter(debug=True, data_path=args.data_path)
+    parser.add_argument('-x', '--xml_path',
+                        help='the directory containing the transcription XML files '
+                             '(default %s)' % XML_DIR)
+    build_output.add_selection_argument(parser, pages=True)
+    build_output.add_argument(parser)
+    profiling.add_argument(parser)
+    profiling.add_memory_argument(parser)
+
+    args = parser.parse_args(argv)
+    build_output.set_pretty(args.pretty)
+    build_output.set_writer_threads(args.writer_threads)
+    build_output.set_output(args.output)
+
+    ps = PageSplitter(directory=args.xml_path or XML_DIR, debug=True,
+                      data_path=args.data_path or DATA_DIR)
+    ps.manuscripts, ps.pages = build_output.get_selection(parser, args)
+    if ps.manuscripts is not None:
+        missing = set(ps.manuscripts) - ps.get_sigla()
+        if missing:
+            parser.error('there is no transcription for %s' % ', '.join(sorted(missing)))
+    if args.profile is not None:
+        ps.profiler = profiling.HandlerProfiler()
+    ps.memory = profiling.start_memory_tracking(args.memory)
+
+    if ps.manuscripts is None:
+        outputs = ['transcription', 'menu', 'menu_data.js']
     else:
-        ps = PageSplitter(debug=True)
-
-    ps.clear_transcription_directory()
-    ps.separate_pages()
+        outputs = ['menu_data.js']
+        for siglum in ps.manuscripts:
+            outputs.extend(['transcription/%s' % siglum, 'menu/%s.json' % siglum])
+    with build_output.build_stage(ps.data_path, 'make_paginated_json', outputs), \
+         profiling.track(ps.memory, 'make_paginated_json'):
+        if ps.manuscripts is None:
+            with build_output.staged_directory(ps.page_path) as page_path, \
+                 build_output.staged_directory(ps.menu_path) as menu_path:
+                ps.page_path = page_path
+                ps.menu_path = menu_path
+                ps.separate_pages()
+        else:
+            # only the directories of the manuscripts are replaced, starting
+            # from a copy if only some of the pages are being written
+            with build_output.staged_subdirectories(ps.page_path, ps.manuscripts,
+                                                    copy=ps.pages is not None) as document_paths:
+                ps.document_paths = document_paths
+                ps.separate_pages()
+    print('transcription pages replaced')
+    if ps.profiler is not None:
+        ps.profiler.report(args.profile)
+    profiling.stop_memory_tracking(ps.memory, args.memory)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+
+"""
+This script makes data/precache.json, the list of files the service worker
+(service-worker.js, registered by main.js) keeps in the browser's cache so that
+repeat visits load the navigation data without going to the network.
+
+The manifest lists the navigation data (the menu, the page lists, the chapter
+index and the abbreviation hover overs) with the start of the sha256 hash of
+each file. The hashes are those recorded by the build stages in
+data/.file_hashes.json (see build_output.py) so the files are only read if a
+stage has not recorded them. The version of the manifest is made from all of
+the hashes so it only changes when one of the files does, and when it changes
+the service worker only fetches the files whose hashes are different.
+
+The pages of some manuscripts can also be cached by giving their sigla (comma
+separated) with --manuscript.
+
+{"version": "...", "files": {"menu_data.js": "...", "menu/Q.json": "...", ...}}
+
+The paths are relative to the data directory. Run this script after all of the
+others.
+
+No arguments needed unless being run by the admin app in which case
+the path to the data directory must be supplied.
+
+"""
+import sys
+import argparse
+import os
+import json
+import hashlib
+import build_output
+
+DATA_DIR = '../data'
+MANIFEST_FILE = 'precache.json'
+# the files and directories of navigation data, those which don't exist are skipped
+NAVIGATION = ['menu_data.js', 'menu', 'indice.json', 'indice', 'reader_pages.js',
+              'critical_pages.js', 'translation_pages.js', 'cpsf_critical_pages.js',
+              'abbreviations.json']
+HASH_LENGTH = 16
+
+
+class PrecacheManifest(object):
+    """The files to precache with their hashes."""
+    def __init__(self, data_path=DATA_DIR):
+        self.data_path = data_path
+        self.hashes = build_output.load_json(os.path.join(data_path, build_output.HASH_FILE), {})
+        self.files = {}
+
+    def add(self, path):
+        """Add a file or every file in a directory (given relative to the data directory)."""
+        full_path = os.path.join(self.data_path, path)
+        if build_output.is_directory(full_path):
+            for name in sorted(build_output.list_directory(full_path)):
+                if not name.startswith('.'):
+                    self.add('%s/%s' % (path, name))
+        elif build_output.path_exists(full_path):
+            self.files[path] = self.get_hash(path)[:HASH_LENGTH]
+
+    def get_hash(self, path):
+        """Return the hash recorded by the build or, if there isn't one, hash the file."""
+        if path in self.hashes:
+            return self.hashes[path]
+        content = build_output.read_bytes(os.path.join(self.data_path, path))
+        return hashlib.sha256(content).hexdigest()
+
+    def get_version(self):
+        """Return a version which changes whenever a file or the list of files does."""
+        content = json.dumps(self.files, sort_keys=True).encode('utf-8')
+        return hashlib.sha256(content).hexdigest()[:HASH_LENGTH]
+
+    def write(self):
+        """Write the manifest with its version."""
+        build_output.write_json(os.path.join(self.data_path, MANIFEST_FILE),
+                                {'version': self.get_version(),
+                                 'files': dict(sorted(self.files.items()))})
+
+
+def make_precache_manifest(data_path=DATA_DIR, manuscripts=()):
+    """Write the manifest of the navigation data and the pages of the given manuscripts."""
+    manifest = PrecacheManifest(data_path)
+    for path in NAVIGATION:
+        manifest.add(path)
+    if 'indice/manifest.json' in manifest.files:
+        # main.js only loads indice.json if the index has not been chunked
+        del manifest.files['indice.json']
+    for ms in manuscripts:
+        if not build_output.is_directory(os.path.join(data_path, 'transcription', ms)):
+            print('there are no pages for %s' % ms)
+            continue
+        manifest.add('transcription/%s' % ms)
+    manifest.write()
+    print('%d files in the precache manifest' % len(manifest.files))
+
+
+def main(argv):
+    """Run when module called."""
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--data_path',
+                        help='the path to the data directory'
+                             '(only used by the django app, use default for '
+                             'webpack build)')
+    parser.add_argument('-m', '--manuscript',
+                        help='comma separated list of the sigla of the manuscripts '
+                             'whose pages are also precached')
+    build_output.add_argument(parser)
+
+    args = parser.parse_args(argv)
+    build_output.set_pretty(args.pretty)
+    build_output.set_writer_threads(args.writer_threads)
+    build_output.set_output(args.output)
+
+    if args.data_path:
+        data_path = args.data_path
+    else:
+        data_path = DATA_DIR
+    with build_output.build_stage(data_path, 'make_precache_manifest', [MANIFEST_FILE]):
+        make_precache_manifest(data_path=data_path,
+                               manuscripts=args.manuscript.split(',') if args.manuscript else ())
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
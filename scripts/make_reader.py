@@ -12,9 +12,9 @@ which is saved at data/reader_pages.js
 import sys
 import argparse
 import os
-import shutil
-import json
 from lxml import etree
+import build_output
+import profiling
 
 DATA_DIR = '../data'
 TRANSCRIPTION_DIR = '../../../../transcriptions/readerXML'
@@ -22,13 +22,15 @@ RUBRIC_TEMPLATE = '<span class="rubric">%s</span><br />\n'
 
 class Reader(object):
     """Make Reader edition pages."""
-    def __init__(self, data_path=DATA_DIR):
+    def __init__(self, data_path=DATA_DIR, directory=TRANSCRIPTION_DIR):
         self.data_path = data_path
         parser = etree.XMLParser(resolve_entities=False)
-        self.tree = etree.parse(os.path.join(TRANSCRIPTION_DIR, 'reader.xml'),
+        self.tree = etree.parse(os.path.join(directory, 'reader.xml'),
                                 parser)
         self.page_path = os.path.join(data_path, 'reader')
         self.page_list = []
+        # a profiling.MemoryTracker to record the peak memory of each chapter
+        self.memory = None
 
     def process(self):
         """Process all the pages."""
@@ -36,13 +38,11 @@ class Reader(object):
         for div in self.tree.xpath('//tei:div[@type="book"]/tei:div',
                                    namespaces={'tei':
                                                'http://www.tei-c.org/ns/1.0'}):
-            self.process_page(div)
+            with profiling.track(self.memory, 'chapter %s' % div.get('n')):
+                self.process_page(div)
 
-        with open(os.path.join(self.data_path,
-                               'reader_pages.js'),
-                  'w', encoding="utf-8") as list_fo:
-            list_fo.write('READER_PAGES = ')
-            json.dump(self.page_list, list_fo, indent=4)
+        build_output.write_js(os.path.join(self.data_path, 'reader_pages.js'),
+                              'READER_PAGES', self.page_list)
 
     def get_text(self, block):
         """ """
@@ -108,19 +108,12 @@ class Reader(object):
 
 
         self.page_list.append(name)
-        with open(os.path.join(self.page_path, '%s.html' % name),
-                  'w', encoding="utf-8") as output_fo:
-            output_fo.write(output)
+        build_output.write_text(os.path.join(self.page_path, '%s.html' % name),
+                                output)
 
     def clear_reader_directory(self):
-        try:
-            shutil.rmtree(self.page_path)
-        except:
-            pass
-        try:
-            os.makedirs(self.page_path)
-        except FileExistsError:
-            pass
+        build_output.remove(self.page_path)
+        build_output.make_directories(self.page_path)
         print('old reader pages deleted')
 
 def main(argv):
@@ -130,15 +123,33 @@ def main(argv):
                         help='the path to the data directory'
                              '(only used by the django app, use default for '
                              'webpack build)')
-
-    args = parser.parse_args()
+    parser.add_argument('-x', '--xml_path',
+                        help='the directory containing reader.xml '
+                             '(default %s)' % TRANSCRIPTION_DIR)
+    build_output.add_argument(parser)
+    profiling.add_memory_argument(parser)
+
+    args = parser.parse_args(argv)
+    build_output.set_pretty(args.pretty)
+    build_output.set_writer_threads(args.writer_threads)
+    build_output.set_output(args.output)
+    memory = profiling.start_memory_tracking(args.memory)
 
     if args.data_path:
-        READER = Reader(data_path=args.data_path)
+        data_path = args.data_path
     else:
-        READER = Reader()
-    READER.clear_reader_directory()
-    READER.process()
+        data_path = DATA_DIR
+    with build_output.build_stage(data_path, 'make_reader',
+                                  ['reader', 'reader_pages.js']), \
+         profiling.track(memory, 'make_reader'):
+        with profiling.track(memory, 'load reader.xml'):
+            READER = Reader(data_path=data_path,
+                            directory=args.xml_path or TRANSCRIPTION_DIR)
+        READER.memory = memory
+        with build_output.staged_directory(READER.page_path) as page_path:
+            READER.page_path = page_path
+            READER.process()
+    profiling.stop_memory_tracking(memory, args.memory)
 
 
 if __name__ == "__main__":
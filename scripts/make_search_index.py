@@ -0,0 +1,231 @@
+#!/usr/bin/python3
+
+"""
+This script makes the full text search index for the transcriptions. It uses
+the paginated json created by make_paginated_json.py so that must be run first.
+
+The text of every page is read from the XML stored in the json and is indexed
+in both of the forms the edition displays:
+
+* the abbreviated reading (abbr and am)
+* the expanded reading (expan and ex)
+
+As in the html the orig reading of an app and the type 2 segs of the lit reading
+are left out. Notes, forme work and figure descriptions are not indexed.
+
+Each word is normalised by lowercasing it, removing accents and other combining
+marks (so the abbreviation marks in q̄ are ignored), replacing long s with s and
+⁊ with et and putting it in NFC form. A word is a run of letters, numbers and
+underscores (the Unicode L and N categories, [\p{L}\p{N}_] in javascript). The
+same normalisation and word splitting are done in main.js on the search terms
+so the two must be changed together.
+
+The result is an inverted index which maps each normalised term to a list of
+postings. Each posting is [manuscript siglum, page, verse] where verse is the
+D[chapter]S[verse] key used in page_chapter_index.js (or null for text outside
+of a verse such as a rubric). The index is split into shards by the first
+PREFIX_LENGTH characters of the term and saved in data/search/[name].json so
+the viewer only downloads the shards for the terms it is looking for. The name
+of a shard is its prefix with every character other than a-z and 0-9 replaced
+by _ and the six digit hex code point, so qu is qu.json and ꝑa is _00a751a.json,
+which is safe on every file system and web server. data/search/manifest.json
+maps the prefix of each shard to its name.
+
+No arguments needed unless being run by the admin app in which case
+the path to the data directory must be supplied.
+
+"""
+import sys
+import argparse
+import os
+import json
+import string
+import unicodedata
+from lxml import etree
+import build_output
+import page_cache
+from verse_key import format_key
+
+DATA_DIR = '../data'
+PREFIX_LENGTH = 2
+# elements whose content is never part of the searchable text
+SKIPPED_TAGS = ['note', 'fw', 'figDesc']
+# elements whose content is only part of one of the readings
+ABBREVIATED_ONLY = ['abbr', 'am']
+EXPANDED_ONLY = ['expan', 'ex']
+# the characters of shard names which are not escaped
+SHARD_NAME_CHARACTERS = string.ascii_lowercase + string.digits
+
+
+def normalise(text):
+    """Normalise text for indexing and searching (see normalise_search_term in main.js)."""
+    text = text.lower().replace('ſ', 's').replace('⁊', 'et')
+    text = ''.join([char for char in unicodedata.normalize('NFD', text)
+                    if not unicodedata.category(char).startswith('M')])
+    return unicodedata.normalize('NFC', text)
+
+
+def is_word_character(char):
+    """Return whether a character is part of a word, [\\p{L}\\p{N}_] in javascript."""
+    return char == '_' or unicodedata.category(char)[0] in 'LN'
+
+
+def tokenise(text):
+    """Return the normalised words in text."""
+    words = []
+    word = []
+    for char in normalise(text):
+        if is_word_character(char):
+            word.append(char)
+        elif word:
+            words.append(''.join(word))
+            word = []
+    if word:
+        words.append(''.join(word))
+    return words
+
+
+def get_shard_name(prefix):
+    """Return the file name (without .json) of the shard for a prefix."""
+    return ''.join([char if char in SHARD_NAME_CHARACTERS else '_%06x' % ord(char)
+                    for char in prefix])
+
+
+class SearchIndexer(object):
+    """Make the inverted index of the transcription text."""
+    def __init__(self, data_path=DATA_DIR):
+        self.data_path = data_path
+        self.page_path = os.path.join(data_path, 'transcription')
+        self.search_path = os.path.join(data_path, 'search')
+        self.index = {}
+        # a page_cache.ParsedPageCache of the terms in each verse of a page
+        self.parsed_pages = None
+
+    def index_all_pages(self):
+        """Go through the paginated data and index every page."""
+        print('indexing pages')
+        for ms in sorted(build_output.list_directory(self.page_path)):
+            print(ms)
+            for pagefile in sorted(build_output.list_directory(os.path.join(self.page_path, ms))):
+                if pagefile.endswith('.json'):
+                    page = json.loads(build_output.read_text(os.path.join(self.page_path, ms,
+                                                                          pagefile)))
+                    self.index_page(page['text'], ms, pagefile.replace('.json', ''))
+        if self.parsed_pages is not None:
+            self.parsed_pages.close()
+
+    def index_page(self, text, ms, page):
+        """Add the postings for a single page."""
+        terms = page_cache.get(self.parsed_pages, text, ms, page, self.get_terms)
+        if terms is None:
+            return
+        for verse, verse_terms in terms:
+            for term in verse_terms:
+                if term not in self.index:
+                    self.index[term] = set()
+                self.index[term].add((ms, page, verse))
+
+    def get_terms(self, text):
+        """Return the terms in each verse of the XML of a page as (verse, terms) pairs."""
+        root_element = etree.fromstring(text)
+        segments = {}
+        self.collect_text(root_element, None, None, segments, True, True)
+        terms = []
+        for verse in segments:
+            verse_terms = set()
+            for reading in segments[verse]:
+                verse_terms.update(tokenise(''.join(reading)))
+            terms.append((verse, sorted(verse_terms)))
+        return terms
+
+    def collect_text(self, element, chapter, verse, segments, abbreviated, expanded):
+        """Add the text of element and its descendants to the segment of the verse it is in.
+
+        abbreviated and expanded say whether the text is part of each reading."""
+        tag = element.tag
+        if not isinstance(tag, str) or tag in SKIPPED_TAGS:
+            return
+        if tag == 'rdg' and element.get('type') == 'orig':
+            return
+        if tag == 'seg' and element.get('type') == '2':
+            return
+        if tag in ABBREVIATED_ONLY:
+            expanded = False
+        if tag in EXPANDED_ONLY:
+            abbreviated = False
+        if tag == 'div' and element.get('n'):
+            chapter = element.get('n')
+            verse = None
+        if tag == 'ab' and element.get('n'):
+            verse = format_key(chapter, element.get('n'))
+        if verse not in segments:
+            segments[verse] = ([], [])
+        if element.text:
+            self.add_text(segments[verse], element.text, abbreviated, expanded)
+        for child in element:
+            self.collect_text(child, chapter, verse, segments, abbreviated, expanded)
+            if child.tail:
+                self.add_text(segments[verse], child.tail, abbreviated, expanded)
+
+    def add_text(self, segment, text, abbreviated, expanded):
+        if abbreviated:
+            segment[0].append(text)
+        if expanded:
+            segment[1].append(text)
+
+    def write_index(self):
+        """Save the index as shards by term prefix along with the shard manifest."""
+        shards = {}
+        for term in sorted(self.index):
+            prefix = term[:PREFIX_LENGTH]
+            if prefix not in shards:
+                shards[prefix] = {}
+            shards[prefix][term] = [list(posting) for posting in
+                                    sorted(self.index[term],
+                                           key=lambda posting: (posting[0],
+                                                                posting[1],
+                                                                posting[2] or ''))]
+        for prefix in shards:
+            build_output.write_json(os.path.join(self.search_path,
+                                                 '%s.json' % get_shard_name(prefix)),
+                                    shards[prefix])
+        build_output.write_json(os.path.join(self.search_path, 'manifest.json'),
+                                {'prefix_length': PREFIX_LENGTH,
+                                 'shards': {prefix: get_shard_name(prefix)
+                                            for prefix in sorted(shards)}})
+        print('%d terms in %d shards' % (len(self.index), len(shards)))
+
+
+def main(argv):
+    """Run when module called."""
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--data_path',
+                        help='the path to the data directory'
+                             '(only used by the django app, use default for '
+                             'webpack build)')
+    build_output.add_argument(parser)
+    page_cache.add_argument(parser)
+
+    args = parser.parse_args(argv)
+    build_output.set_pretty(args.pretty)
+    build_output.set_writer_threads(args.writer_threads)
+    build_output.set_output(args.output)
+    page_cache.set_cache_dir(args.page_cache_dir)
+
+    if args.data_path:
+        data_path = args.data_path
+    else:
+        data_path = DATA_DIR
+    with build_output.build_stage(data_path, 'make_search_index', ['search']):
+        indexer = SearchIndexer(data_path=data_path)
+        indexer.parsed_pages = page_cache.open_cache(data_path, 'search-terms', [__file__],
+                                                     not args.no_page_cache)
+        indexer.index_all_pages()
+        with build_output.staged_directory(indexer.search_path) as search_path:
+            indexer.search_path = search_path
+            indexer.write_index()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,235 @@
+#!/usr/bin/python3
+
+"""
+This script makes a synthetic corpus with the same structure as the edition
+data so that the scripts can be benchmarked (see run_benchmarks.py) without the
+real transcriptions.
+
+The output directory is laid out the way the scripts expect the main edition
+repositories to be:
+
+* transcriptions/manuscripts/[siglum].xml - the TEI transcriptions
+* transcriptions/readerXML/reader.xml
+* transcriptions/translationXML/translation.xml
+* transcriptions/criticalXML/critical.xml
+* collation/approved/D[chapter]S[verse].json - empty collation units
+* chapter_index.csv
+
+The first manuscript is always Ss because make_chapter_index_json.py reads
+the VC_ chapters from Ss.xml.
+
+The transcriptions have the requested number of pages with main columns and
+optionally subcolumns (cb with n="a-1" etc.). The densities of app/rdg,
+choice, am/ex and hi are the probability of each word being marked up that way
+and the fw density is the probability of each page having a header and catch
+word. The corpus only depends on the arguments (including --seed) so the same
+arguments always make the same corpus.
+
+"""
+import sys
+import os
+import argparse
+import random
+
+WORDS = ['et', 'el', 'rey', 'don', 'alfonso', 'espanna', 'que', 'por', 'con',
+         'los', 'moros', 'cibdad', 'fijo', 'muy', 'grand', 'tierra', 'dixo',
+         'fue', 'quando', 'ouo', 'sennor', 'castiella', 'leon', 'toledo']
+ABBREVIATIONS = [('q̄', 'que'), ('ꝑ', 'per'), ('⁊', 'et'), ('dõ', 'don'),
+                 ('ſeñor', 'sennor')]
+RENDS = ['red', 'blue', 'underline']
+TEI_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
+<TEI xmlns="http://www.tei-c.org/ns/1.0"><teiHeader><fileDesc><titleStmt><title>%s</title></titleStmt></fileDesc></teiHeader>
+<text><body><div n="%s">
+%s
+</div></body></text></TEI>
+'''
+EDITION_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
+<TEI xmlns="http://www.tei-c.org/ns/1.0"><text><body><div type="book">
+%s
+</div></body></text></TEI>
+'''
+
+
+class CorpusGenerator(object):
+    """Make a synthetic TEI corpus."""
+    def __init__(self, output_path, manuscripts=3, pages=100, columns=2,
+                 subcolumns=0, verses_per_column=4, words_per_verse=30,
+                 verses_per_chapter=20, app=0.02, choice=0.05, amex=0.05,
+                 hi=0.02, fw=0.5, seed=1):
+        self.output_path = output_path
+        self.manuscripts = manuscripts
+        self.pages = pages
+        self.columns = columns
+        self.subcolumns = subcolumns
+        self.verses_per_column = verses_per_column
+        self.words_per_verse = words_per_verse
+        self.verses_per_chapter = verses_per_chapter
+        self.densities = {'app': app, 'choice': choice, 'amex': amex, 'hi': hi}
+        self.fw = fw
+        self.random = random.Random(seed)
+        self.chapters = set()
+
+    def sigla(self):
+        sigla = ['Ss']
+        for i in range(1, self.manuscripts):
+            sigla.append('S%d' % i)
+        return sigla
+
+    def make_corpus(self):
+        """Write all of the files of the corpus."""
+        xml_path = os.path.join(self.output_path, 'transcriptions', 'manuscripts')
+        os.makedirs(xml_path)
+        for siglum in self.sigla():
+            with open(os.path.join(xml_path, '%s.xml' % siglum), 'w', encoding='utf-8') as output:
+                output.write(self.make_manuscript(siglum))
+        self.make_chapter_index()
+        self.make_collations()
+        for directory, filename in [('readerXML', 'reader.xml'),
+                                    ('translationXML', 'translation.xml'),
+                                    ('criticalXML', 'critical.xml')]:
+            os.makedirs(os.path.join(self.output_path, 'transcriptions', directory))
+            with open(os.path.join(self.output_path, 'transcriptions', directory, filename),
+                      'w', encoding='utf-8') as output:
+                output.write(self.make_edition())
+
+    def make_word(self):
+        """Return a word, possibly with some markup."""
+        word = self.random.choice(WORDS)
+        chance = self.random.random()
+        for markup in ['app', 'choice', 'amex', 'hi']:
+            if chance < self.densities[markup]:
+                break
+            chance -= self.densities[markup]
+        else:
+            return word
+        if markup == 'app':
+            other = self.random.choice(WORDS)
+            return ('<app><rdg type="orig">%s</rdg><rdg type="lit">%s<seg type="2">%s</seg></rdg>'
+                    '<rdg type="mod">%s</rdg></app>' % (word, word, other[0], other))
+        abbreviation, expansion = self.random.choice(ABBREVIATIONS)
+        if markup == 'choice':
+            return '<choice><abbr>%s</abbr><expan>%s</expan></choice>' % (abbreviation, expansion)
+        if markup == 'amex':
+            return '<am>%s</am><ex>%s</ex>' % (abbreviation, expansion)
+        return '<hi rend="%s">%s</hi>' % (self.random.choice(RENDS), word)
+
+    def make_verse_text(self):
+        words = []
+        for i in range(self.words_per_verse):
+            words.append(self.make_word())
+            if i % 8 == 7:
+                words.append('<lb/>')
+        return ' '.join(words)
+
+    def make_manuscript(self, siglum):
+        """Return the TEI for a manuscript."""
+        body = []
+        chapter = 0
+        verse = self.verses_per_chapter
+        chapter_prefix = 'VC_' if siglum == 'Ss' else ''
+        for page in range(self.pages):
+            body.append('<pb n="%d%s"/>' % (page // 2 + 1, 'rv'[page % 2]))
+            if self.random.random() < self.fw:
+                body.append('<fw type="header" place="tm">%s</fw>' % self.random.choice(WORDS))
+            for column in range(self.columns):
+                column_id = 'abcdefgh'[column]
+                subcolumns = max(1, self.subcolumns)
+                for subcolumn in range(subcolumns):
+                    if self.subcolumns:
+                        body.append('<cb n="%s-%d"/>' % (column_id, subcolumn + 1))
+                    else:
+                        body.append('<cb n="%s"/>' % column_id)
+                    for i in range(max(1, self.verses_per_column // subcolumns)):
+                        if verse >= self.verses_per_chapter:
+                            if chapter > 0:
+                                body.append('</div>')
+                            chapter += 1
+                            verse = 0
+                            self.chapters.add(chapter)
+                            body.append('<div n="%s%d"><head n="Rubric">capitulo %d</head>' %
+                                        (chapter_prefix, chapter, chapter))
+                        verse += 1
+                        body.append('<ab n="%d00">%s</ab>' % (verse, self.make_verse_text()))
+            if self.random.random() < self.fw:
+                body.append('<fw type="catch" place="bottom">%s</fw>' % self.random.choice(WORDS))
+        body.append('</div>')
+        return TEI_TEMPLATE % (siglum, siglum, '\n'.join(body))
+
+    def make_chapter_index(self):
+        with open(os.path.join(self.output_path, 'chapter_index.csv'), 'w', encoding='utf-8') as output:
+            for chapter in sorted(self.chapters):
+                output.write('x\t%d\t%d\tcapitulo %d\n' % (chapter, chapter, chapter))
+
+    def make_collations(self):
+        collation_path = os.path.join(self.output_path, 'collation', 'approved')
+        os.makedirs(collation_path)
+        for chapter in sorted(self.chapters):
+            names = ['D%dSRubric' % chapter]
+            names.extend(['D%dS%d' % (chapter, verse)
+                          for verse in range(1, self.verses_per_chapter + 1)])
+            for name in names:
+                with open(os.path.join(collation_path, '%s.json' % name), 'w') as output:
+                    output.write('{}')
+
+    def make_edition(self):
+        """Return the TEI for the reader, translation or critical text."""
+        chapters = []
+        for chapter in sorted(self.chapters):
+            blocks = ['<ab n="rubric">capitulo <hi rend="red">%d</hi></ab>' % chapter]
+            for verse in range(1, self.verses_per_chapter + 1):
+                blocks.append('<ab n="%d00">%s <hi rend="red">%s</hi><space/></ab>' %
+                              (verse, ' '.join([self.random.choice(WORDS) for i in range(self.words_per_verse)]),
+                               self.random.choice(WORDS)))
+            chapters.append('<div n="%d">%s</div>' % (chapter, '\n'.join(blocks)))
+        return EDITION_TEMPLATE % '\n'.join(chapters)
+
+
+def add_arguments(parser):
+    """Add the corpus arguments to a parser (shared with run_benchmarks.py)."""
+    parser.add_argument('--manuscripts', type=int, default=3,
+                        help='the number of manuscripts')
+    parser.add_argument('--columns', type=int, default=2,
+                        help='the number of main columns on each page')
+    parser.add_argument('--subcolumns', type=int, default=0,
+                        help='the number of subcolumns in each column (0 for none)')
+    parser.add_argument('--app', type=float, default=0.02,
+                        help='the proportion of words with app/rdg markup')
+    parser.add_argument('--choice', type=float, default=0.05,
+                        help='the proportion of words with choice markup')
+    parser.add_argument('--amex', type=float, default=0.05,
+                        help='the proportion of words with am/ex markup')
+    parser.add_argument('--hi', type=float, default=0.02,
+                        help='the proportion of words with hi markup')
+    parser.add_argument('--fw', type=float, default=0.5,
+                        help='the probability of a page having fw elements')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='the random seed')
+
+
+def corpus_options(args):
+    """Return the generator keyword arguments from parsed arguments."""
+    return {'manuscripts': args.manuscripts, 'columns': args.columns,
+            'subcolumns': args.subcolumns, 'app': args.app,
+            'choice': args.choice, 'amex': args.amex, 'hi': args.hi,
+            'fw': args.fw, 'seed': args.seed}
+
+
+def main(argv):
+    """Run when module called."""
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('output_path',
+                        help='the directory to make the corpus in (must not exist)')
+    parser.add_argument('--pages', type=int, default=100,
+                        help='the number of pages in each manuscript')
+    add_arguments(parser)
+
+    args = parser.parse_args(argv)
+
+    generator = CorpusGenerator(args.output_path, pages=args.pages,
+                                **corpus_options(args))
+    generator.make_corpus()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
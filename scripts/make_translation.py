@@ -14,9 +14,9 @@ There is currently only a single chapter.
 import sys
 import argparse
 import os
-import shutil
-import json
 from lxml import etree
+import build_output
+import profiling
 
 DATA_DIR = '../data'
 TRANSCRIPTION_DIR = '../../../../transcriptions/translationXML'
@@ -24,10 +24,10 @@ RUBRIC_TEMPLATE = '<span class="rubric">%s</span><br />\n'
 
 class Translation(object):
     """Make Translation pages."""
-    def __init__(self, data_path=DATA_DIR):
+    def __init__(self, data_path=DATA_DIR, directory=TRANSCRIPTION_DIR):
         self.data_path = data_path
         parser = etree.XMLParser(resolve_entities=False)
-        self.tree = etree.parse(os.path.join(TRANSCRIPTION_DIR, 'translation.xml'),
+        self.tree = etree.parse(os.path.join(directory, 'translation.xml'),
                                 parser)
         # self.tree = etree.fromstring(open(os.path.join(TRANSCRIPTION_DIR,
         #                                                'translation.xml'),
@@ -35,6 +35,8 @@ class Translation(object):
         self.page_path = os.path.join(data_path, 'translation')
         self.info_count = 0
         self.page_list = []
+        # a profiling.MemoryTracker to record the peak memory of each chapter
+        self.memory = None
 
     def process(self):
         """Process all the pages."""
@@ -42,13 +44,11 @@ class Translation(object):
         for div in self.tree.xpath('//tei:div[@type="book"]/tei:div',
                                    namespaces={'tei':
                                                'http://www.tei-c.org/ns/1.0'}):
-            self.process_page(div)
+            with profiling.track(self.memory, 'chapter %s' % div.get('n')):
+                self.process_page(div)
 
-        with open(os.path.join(self.data_path,
-                               'translation_pages.js'),
-                  'w', encoding="utf-8") as list_fo:
-            list_fo.write('TRANSLATION_PAGES = ')
-            json.dump(self.page_list, list_fo, indent=4)
+        build_output.write_js(os.path.join(self.data_path, 'translation_pages.js'),
+                              'TRANSLATION_PAGES', self.page_list)
 
     def get_text(self, block):
         """ """
@@ -122,19 +122,12 @@ class Translation(object):
 
 
         self.page_list.append(name)
-        with open(os.path.join(self.page_path, '%s.html' % name),
-                  'w', encoding="utf-8") as output_fo:
-            output_fo.write(output)
+        build_output.write_text(os.path.join(self.page_path, '%s.html' % name),
+                                output)
 
     def clear_translation_directory(self):
-        try:
-            shutil.rmtree(self.page_path)
-        except:
-            pass
-        try:
-            os.mkdir(self.page_path)
-        except FileExistsError:
-            pass
+        build_output.remove(self.page_path)
+        build_output.make_directories(self.page_path)
         print('old translation pages deleted')
 
 def main(argv):
@@ -143,15 +136,33 @@ def main(argv):
                         help='the path to the data directory'
                              '(only used by the django app, use default for '
                              'webpack build)')
-
-    args = parser.parse_args()
+    parser.add_argument('-x', '--xml_path',
+                        help='the directory containing translation.xml '
+                             '(default %s)' % TRANSCRIPTION_DIR)
+    build_output.add_argument(parser)
+    profiling.add_memory_argument(parser)
+
+    args = parser.parse_args(argv)
+    build_output.set_pretty(args.pretty)
+    build_output.set_writer_threads(args.writer_threads)
+    build_output.set_output(args.output)
+    memory = profiling.start_memory_tracking(args.memory)
 
     if args.data_path:
-        TRANSLATION = Translation(data_path=args.data_path)
+        data_path = args.data_path
     else:
-        TRANSLATION = Translation()
-    TRANSLATION.clear_translation_directory()
-    TRANSLATION.process()
+        data_path = DATA_DIR
+    with build_output.build_stage(data_path, 'make_translation',
+                                  ['translation', 'translation_pages.js']), \
+         profiling.track(memory, 'make_translation'):
+        with profiling.track(memory, 'load translation.xml'):
+            TRANSLATION = Translation(data_path=data_path,
+                                      directory=args.xml_path or TRANSCRIPTION_DIR)
+        TRANSLATION.memory = memory
+        with build_output.staged_directory(TRANSLATION.page_path) as page_path:
+            TRANSLATION.page_path = page_path
+            TRANSLATION.process()
+    profiling.stop_memory_tracking(memory, args.memory)
 
 if __name__ == "__main__":
     main(sys.argv[1:])
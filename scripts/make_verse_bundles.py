@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+
+"""
+This script makes a bundle for each chapter containing every manuscript's
+reading of each verse so that the viewer can compare a verse across the
+witnesses with one small request rather than loading the page of each
+manuscript (found with page_chapter_index.js) and finding the verse in it.
+
+The pages of each manuscript are gone through in order and the ab of each verse
+is taken from the chapter div it is in and rendered with the
+DisplayTextGenerator from add_html_to_paginated_json.py. A verse which carries
+on over a page break has an ab with continued="true" on the next page, which is
+rendered and added to the verse after a page boundary marker:
+
+<span class="page-boundary" data-page="[page]">[page]</span>
+
+The bundles are stored as json objects in data/verses/[chapter].json with the
+following keys
+
+* chapter - the @n value of the chapter div
+* verses - an object with the D[chapter]S[verse] key of each verse (the same
+keys as page_chapter_index.js) in verse order, each mapping the siglum of every
+manuscript containing the verse to an object with the keys
+  * pages - the list of pages the verse is found on
+  * html - the html which expands the abbreviations
+  * html_abbrev - the html which displays the abbreviated forms
+
+The hover overs of the abbreviations are added to data/abbreviations.json (see
+add_html_to_paginated_json.py).
+
+The page order is taken from the menu data (data/menu/[siglum].json) so
+make_paginated_json.py must be run first.
+
+No arguments needed unless being run by the admin app in which case
+the path to the data directory must be supplied.
+
+"""
+import sys
+import argparse
+import os
+import json
+from xml.etree.ElementTree import ParseError
+from lxml import etree
+import build_output
+import page_cache
+from verse_key import VerseKey, format_key
+from add_html_to_paginated_json import DisplayTextGenerator, load_abbreviations, ABBREVIATIONS_FILE
+from make_chapter_transcriptions import PAGE_BOUNDARY_TEMPLATE
+
+DATA_DIR = '../data'
+
+
+class VerseBundler(object):
+    """Make bundles of the readings of each verse of a chapter in every manuscript."""
+    def __init__(self, data_path=DATA_DIR):
+        self.data_path = data_path
+        self.page_path = os.path.join(data_path, 'transcription')
+        self.menu_path = os.path.join(data_path, 'menu')
+        self.verse_path = os.path.join(data_path, 'verses')
+        self.generators = {False: DisplayTextGenerator(data_path=data_path, expanded=False),
+                           True: DisplayTextGenerator(data_path=data_path, expanded=True)}
+        # the bundles share the abbreviation dictionary of the pages
+        self.abbreviations = load_abbreviations(data_path)
+        for generator in self.generators.values():
+            generator.abbreviations = self.abbreviations
+        # chapter -> verse key -> siglum -> reading
+        self.chapters = {}
+        # chapter -> verse key -> VerseKey used to put the verses in order
+        self.orders = {}
+        # a page_cache.ParsedPageCache of the verse fragments on each page
+        self.parsed_pages = None
+
+    def process(self):
+        """Collect the verses of every manuscript and write the bundles."""
+        print('creating verse bundles')
+        for ms in sorted(build_output.list_directory(self.page_path)):
+            print(ms)
+            self.process_manuscript(ms)
+        if self.parsed_pages is not None:
+            self.parsed_pages.close()
+        self.write_bundles()
+
+    def get_fragments(self, text):
+        """Return the XML of each ab on a page as (chapter, verse, continued, xml) tuples in order."""
+        root_element = etree.fromstring(text)
+        fragments = []
+        for div in root_element.iter('div'):
+            if not div.get('n') or div.find('.//div[@n]') is not None:
+                continue
+            for ab in div.iter('ab'):
+                if not ab.get('n'):
+                    continue
+                fragments.append((div.get('n'), ab.get('n'), ab.get('continued') == 'true',
+                                  etree.tounicode(ab, with_tail=False)))
+        return fragments
+
+    def process_manuscript(self, ms):
+        """Add the verses of a single manuscript to the chapters."""
+        try:
+            pages = json.loads(build_output.read_text(os.path.join(self.menu_path,
+                                                                   '%s.json' % ms)))
+        except FileNotFoundError:
+            print('No page list for %s, run make_paginated_json.py first' % ms)
+            return
+        for page in pages:
+            text = json.loads(build_output.read_text(os.path.join(self.page_path, ms,
+                                                                  '%s.json' % page)))['text']
+            fragments = page_cache.get(self.parsed_pages, text, ms, page, self.get_fragments)
+            if fragments is None:
+                continue
+            for chapter, verse, continued, fragment in fragments:
+                verses = self.chapters.setdefault(chapter, {})
+                key = format_key(chapter, verse)
+                if key not in verses:
+                    verses[key] = {}
+                    self.orders.setdefault(chapter, {})[key] = VerseKey.from_parts(chapter, verse)
+                if ms not in verses[key]:
+                    verses[key][ms] = {'pages': [], 'html': [], 'html_abbrev': []}
+                self.add_fragment(verses[key][ms], ms, page, key, continued, fragment)
+
+    def add_fragment(self, reading, ms, page, key, continued, fragment):
+        """Render a fragment of a verse and add it to the reading."""
+        data = {'text': '<root><pb n="%s"/>%s</root>' % (page, fragment)}
+        # the page name is used in the ids of the tooltips so include the
+        # verse to keep them distinct from those in the page view
+        identifier = '%s-%s' % (page, key)
+        try:
+            html = self.generators[True].render_page(data, ms, identifier)
+            html_abbrev = self.generators[False].render_page(data, ms, identifier)
+        except ParseError:
+            print("Skipping:", ms, page, key)
+            return
+        if continued and reading['pages']:
+            boundary = PAGE_BOUNDARY_TEMPLATE % (page, page)
+            html = boundary + html
+            html_abbrev = boundary + html_abbrev
+        if page not in reading['pages']:
+            reading['pages'].append(page)
+        reading['html'].append(html)
+        reading['html_abbrev'].append(html_abbrev)
+
+    def write_bundles(self):
+        """Write a bundle for each chapter with its verses in order."""
+        for chapter, verses in self.chapters.items():
+            ordered = sorted(verses, key=self.orders[chapter].get)
+            bundle = {'chapter': chapter, 'verses': {}}
+            for key in ordered:
+                for reading in verses[key].values():
+                    reading['html'] = ''.join(reading['html'])
+                    reading['html_abbrev'] = ''.join(reading['html_abbrev'])
+                bundle['verses'][key] = verses[key]
+            build_output.write_json(os.path.join(self.verse_path, '%s.json' % chapter),
+                                    bundle)
+
+
+def main(argv):
+    """Run when module called."""
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--data_path',
+                        help='the path to the data directory'
+                             '(only used by the django app, use default for '
+                             'webpack build)')
+    build_output.add_argument(parser)
+    page_cache.add_argument(parser)
+
+    args = parser.parse_args(argv)
+    build_output.set_pretty(args.pretty)
+    build_output.set_writer_threads(args.writer_threads)
+    build_output.set_output(args.output)
+    page_cache.set_cache_dir(args.page_cache_dir)
+
+    if args.data_path:
+        data_path = args.data_path
+    else:
+        data_path = DATA_DIR
+    with build_output.build_stage(data_path, 'make_verse_bundles',
+                                  ['verses', ABBREVIATIONS_FILE]):
+        bundler = VerseBundler(data_path=data_path)
+        bundler.parsed_pages = page_cache.open_cache(data_path, 'verse-fragments', [__file__],
+                                                     not args.no_page_cache)
+        with build_output.staged_directory(bundler.verse_path) as verse_path:
+            bundler.verse_path = verse_path
+            bundler.process()
+        build_output.write_json(os.path.join(data_path, ABBREVIATIONS_FILE),
+                                dict(sorted(bundler.abbreviations.items())))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
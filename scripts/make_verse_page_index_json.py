@@ -6,6 +6,11 @@ It establishes the page numbers used for the links from the critical apparatus
 to the trancriptions.These links become 'baked' into the critical edition html
 as the critical text is constructed.
 
+The index is written to data/page_chapter_index.js for the baking process, it
+is not loaded by the viewer.
+
+With --manuscript only the pages of the given manuscripts are read and only
+their entries in the index are replaced.
 
 """
 import sys
@@ -13,39 +18,68 @@ import argparse
 import os
 import json
 from lxml import etree
+import build_output
+import page_cache
+from verse_key import format_key
 
 DATA_DIR = '../data'
 
 index = {}
 
-def make_verse_page_index(data_path=DATA_DIR):
+def make_verse_page_index(data_path=DATA_DIR, parsed_pages=None, manuscripts=None):
+    index.clear()
     page_path = os.path.join(data_path, 'transcription')
-    for ms in os.listdir(page_path):
-        dir_path = os.path.join(page_path, ms)
-        print(ms)
-        index[ms] = {}
-        for page in os.listdir(dir_path):
-            if page.endswith('.json'):
-                filename = os.path.join(page_path, ms, page)
-                with open(filename) as file_p:
-                    data = json.load(file_p)
-                    get_verses(data['text'], ms, page.replace('.json', ''))
+    index_file = os.path.join(data_path, 'page_chapter_index.js')
+    previous = None
+    if manuscripts is not None:
+        previous = build_output.load_js(index_file, 'PAGE_CHAPTER_INDEX', None)
+        if previous is None:
+            print('there is no verse page index to update, making the whole index')
+    if previous is None:
+        for ms in sorted(build_output.list_directory(page_path)):
+            index_manuscript(page_path, ms, parsed_pages)
+    else:
+        # only the selected manuscripts are read, the others keep their entries
+        for ms in sorted(set(previous) | set(manuscripts)):
+            if ms not in manuscripts:
+                index[ms] = previous[ms]
+            elif build_output.is_directory(os.path.join(page_path, ms)):
+                index_manuscript(page_path, ms, parsed_pages)
+    if parsed_pages is not None:
+        parsed_pages.close()
     # write out the results
-    with open(os.path.join(data_path, 'page_chapter_index.js'), 'w') as output:
-        output.write('PAGE_CHAPTER_INDEX = ')
-        json.dump(index, output, indent=4)
+    build_output.write_js(index_file, 'PAGE_CHAPTER_INDEX', index)
+
+
+def index_manuscript(page_path, ms, parsed_pages=None):
+    """Add the verses of each page of a manuscript to the index."""
+    dir_path = os.path.join(page_path, ms)
+    print(ms)
+    index[ms] = {}
+    for page in sorted(build_output.list_directory(dir_path)):
+        if page.endswith('.json'):
+            filename = os.path.join(page_path, ms, page)
+            data = json.loads(build_output.read_text(filename))
+            get_verses(data['text'], ms, page.replace('.json', ''), parsed_pages)
+
+
+def get_verses(xml, ms, page_num, parsed_pages=None):
+    verses = page_cache.get(parsed_pages, xml, ms, page_num, find_verses)
+    if verses is None:
+        return
+    for chapter_num, verse_num in verses:
+        index[ms][format_key(chapter_num, verse_num)] = page_num
 
 
-def get_verses(xml, ms, page_num):
+def find_verses(xml):
+    """Return the chapter and verse numbers of the verses which start on a page."""
     tree = etree.fromstring(xml)
+    verses = []
     for chapter in tree.findall('.//div'):
-        chapter_num = chapter.get('n')
         for verse in chapter.findall('.//ab'):
-            if verse.get('continued'):
-                pass
-            else:
-                verse_num = verse.get('n')
-                index[ms]['D%sS%s' % (chapter_num, verse_num)] = page_num
+            if not verse.get('continued'):
+                verses.append((chapter.get('n'), verse.get('n')))
+    return verses
 
 
 def main(argv):
@@ -55,13 +89,27 @@ def main(argv):
                         help='the path to the data directory'
                              '(only used by the django app, use default for '
                              'webpack build)')
+    build_output.add_selection_argument(parser)
+    build_output.add_argument(parser)
+    page_cache.add_argument(parser)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    build_output.set_pretty(args.pretty)
+    build_output.set_writer_threads(args.writer_threads)
+    build_output.set_output(args.output)
+    page_cache.set_cache_dir(args.page_cache_dir)
 
     if args.data_path:
-        make_verse_page_index(data_path=args.data_path)
+        data_path = args.data_path
     else:
-        make_verse_page_index()
+        data_path = DATA_DIR
+    manuscripts = build_output.get_selection(parser, args)[0]
+    with build_output.build_stage(data_path, 'make_verse_page_index_json',
+                                  ['page_chapter_index.js']):
+        make_verse_page_index(data_path=data_path,
+                              parsed_pages=page_cache.open_cache(data_path, 'verses', [__file__],
+                                                                 not args.no_page_cache),
+                              manuscripts=manuscripts)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,331 @@
+"""
+This module contains the sinks which build_output.py writes the output files
+to. Every file the scripts write, read back, list or delete in the data
+directory goes through the current sink so that the same build can write to
+
+* DirectorySink - the data directory itself (the default)
+* MemorySink - a dictionary in memory, for tests and previews in the admin app
+where nothing should be written to the data volume
+* ArchiveSink - a single zip or tar archive, for shipping a build
+
+The memory and archive sinks sit on top of the data directory: files which
+have not been written or deleted in the sink are read from the directory if
+they are there, so a stage can run on the output of earlier stages already on
+disk. Nothing in the directory is changed. An ArchiveSink keeps the files in
+memory while the build runs and writes the archive, with every file in the
+data directory as the build left it, when it is closed. Hidden files (the
+bookkeeping of the build such as data/.file_hashes.json) are left out of the
+archive.
+
+The paths given to the sinks are file system paths as the scripts make them
+(relative to the working directory or absolute), those of the memory and archive
+sinks must be inside the data directory.
+
+"""
+import os
+import io
+import shutil
+import ctypes
+import threading
+import tarfile
+import zipfile
+
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2
+ARCHIVE_MODES = [('.tar.gz', 'w:gz'), ('.tgz', 'w:gz'), ('.tar.bz2', 'w:bz2'),
+                 ('.tar.xz', 'w:xz'), ('.tar', 'w')]
+
+
+class DirectorySink(object):
+    """Write the files to the file system."""
+
+    def write(self, filename, content, staged):
+        """Write the bytes in content to a file.
+
+        Files in a staging directory are written directly, anything else is
+        written to a temporary file which then replaces the file so it is
+        never seen half written."""
+        if staged:
+            with open(filename, 'wb') as output:
+                output.write(content)
+            return
+        temp_filename = '%s.tmp%d.%d' % (filename, os.getpid(), threading.get_ident())
+        try:
+            with open(temp_filename, 'wb') as output:
+                output.write(content)
+            os.replace(temp_filename, filename)
+        except BaseException:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            raise
+
+    def read(self, filename):
+        """Return the content of a file, raising FileNotFoundError if there isn't one."""
+        with open(filename, 'rb') as input_file:
+            return input_file.read()
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def isdir(self, path):
+        return os.path.isdir(path)
+
+    def listdir(self, path):
+        return os.listdir(path)
+
+    def makedirs(self, path):
+        os.makedirs(path, exist_ok=True)
+
+    def remove(self, path):
+        """Remove a file or a directory and everything in it if it exists."""
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def stage(self, staging, path, copy):
+        """Make a staging directory for path, empty or as a copy of path."""
+        if os.path.exists(staging):
+            shutil.rmtree(staging)
+        if copy and os.path.exists(path):
+            shutil.copytree(path, staging)
+        else:
+            os.makedirs(staging)
+
+    def swap(self, staging, path):
+        """Move the staging directory to path and remove the old version.
+
+        Where the platform supports it the two directories are exchanged in a
+        single atomic rename, otherwise there is a very short gap between moving
+        the old directory out of the way and moving the new one in."""
+        old = '%s.old' % path
+        if os.path.exists(old):
+            shutil.rmtree(old)
+        if os.path.exists(path):
+            if _exchange(staging, path):
+                shutil.rmtree(staging)
+                return
+            os.rename(path, old)
+        os.rename(staging, path)
+        if os.path.exists(old):
+            shutil.rmtree(old)
+
+    def discard(self, staging):
+        shutil.rmtree(staging, ignore_errors=True)
+
+    def close(self):
+        pass
+
+
+def _exchange(first, second):
+    """Atomically exchange two paths using renameat2 (Linux only)."""
+    try:
+        renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+    except (OSError, AttributeError):
+        return False
+    result = renameat2(AT_FDCWD, os.fsencode(first), AT_FDCWD,
+                       os.fsencode(second), RENAME_EXCHANGE)
+    return result == 0
+
+
+class MemorySink(object):
+    """Keep the files in memory on top of the data directory."""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        # path relative to root -> content of the files written
+        self.files = {}
+        # the directories made
+        self.directories = set([''])
+        # the paths removed, which hide anything on disk under them
+        self.removed = set()
+        self.lock = threading.RLock()
+
+    def key(self, path):
+        """Return the path relative to the root with / separators."""
+        relative = os.path.relpath(os.path.abspath(path), self.root)
+        if relative == os.curdir:
+            return ''
+        if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+            raise ValueError('%s is outside of %s' % (path, self.root))
+        return relative.replace(os.sep, '/')
+
+    def disk_path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def hidden(self, key):
+        """Return whether the version of a path on disk has been removed."""
+        parts = key.split('/')
+        for i in range(1, len(parts) + 1):
+            if '/'.join(parts[:i]) in self.removed:
+                return True
+        return False
+
+    def write(self, filename, content, staged):
+        key = self.key(filename)
+        with self.lock:
+            self.files[key] = content
+            parts = key.split('/')
+            for i in range(1, len(parts)):
+                self.directories.add('/'.join(parts[:i]))
+
+    def read(self, filename):
+        key = self.key(filename)
+        with self.lock:
+            if key in self.files:
+                return self.files[key]
+            if self.hidden(key):
+                raise FileNotFoundError(filename)
+        with open(self.disk_path(key), 'rb') as input_file:
+            return input_file.read()
+
+    def exists(self, path):
+        key = self.key(path)
+        with self.lock:
+            if key in self.files or key in self.directories:
+                return True
+            if self.hidden(key):
+                return False
+        return os.path.exists(self.disk_path(key))
+
+    def isdir(self, path):
+        key = self.key(path)
+        with self.lock:
+            if key in self.directories:
+                return True
+            if key in self.files or self.hidden(key):
+                return False
+        return os.path.isdir(self.disk_path(key))
+
+    def listdir(self, path):
+        key = self.key(path)
+        prefix = key + '/' if key else ''
+        with self.lock:
+            found = key in self.directories
+            names = set()
+            for name in list(self.files) + list(self.directories):
+                if name.startswith(prefix) and name != key:
+                    names.add(name[len(prefix):].split('/')[0])
+            if not self.hidden(key) and os.path.isdir(self.disk_path(key)):
+                found = True
+                for name in os.listdir(self.disk_path(key)):
+                    if prefix + name not in self.removed:
+                        names.add(name)
+        if not found:
+            raise FileNotFoundError(path)
+        return list(names)
+
+    def makedirs(self, path):
+        key = self.key(path)
+        with self.lock:
+            parts = key.split('/')
+            for i in range(1, len(parts) + 1):
+                self.directories.add('/'.join(parts[:i]))
+
+    def remove(self, path):
+        key = self.key(path)
+        prefix = key + '/'
+        with self.lock:
+            for name in list(self.files):
+                if name == key or name.startswith(prefix):
+                    del self.files[name]
+            for name in list(self.directories):
+                if name == key or name.startswith(prefix):
+                    self.directories.remove(name)
+            self.removed.add(key)
+
+    def walk(self, key):
+        """Return the keys of every file visible under a directory."""
+        keys = []
+        prefix = key + '/' if key else ''
+        for name in self.listdir(self.disk_path(key)):
+            if self.isdir(self.disk_path(prefix + name)):
+                keys.extend(self.walk(prefix + name))
+            else:
+                keys.append(prefix + name)
+        return keys
+
+    def stage(self, staging, path, copy):
+        with self.lock:
+            self.remove(staging)
+            self.makedirs(staging)
+            if copy and self.isdir(path):
+                source = self.key(path)
+                target = self.key(staging)
+                for key in self.walk(source):
+                    self.write(self.disk_path(target + key[len(source):]),
+                               self.read(self.disk_path(key)), True)
+
+    def swap(self, staging, path):
+        source = self.key(staging)
+        target = self.key(path)
+        with self.lock:
+            self.remove(path)
+            self.makedirs(path)
+            for name in list(self.files):
+                if name.startswith(source + '/'):
+                    self.files[target + name[len(source):]] = self.files.pop(name)
+            for name in list(self.directories):
+                if name.startswith(source + '/'):
+                    self.directories.add(target + name[len(source):])
+            self.remove(staging)
+
+    def discard(self, staging):
+        self.remove(staging)
+
+    def close(self):
+        pass
+
+
+class ArchiveSink(MemorySink):
+    """Keep the files in memory and write them to a zip or tar archive at the end."""
+
+    def __init__(self, root, filename):
+        super().__init__(root)
+        self.filename = filename
+
+    def close(self):
+        """Write every visible file which isn't hidden to the archive."""
+        keys = [key for key in sorted(self.walk(''))
+                if not any(part.startswith('.') for part in key.split('/'))]
+        temp_filename = '%s.tmp%d' % (self.filename, os.getpid())
+        try:
+            if self.filename.endswith('.zip'):
+                with zipfile.ZipFile(temp_filename, 'w', zipfile.ZIP_DEFLATED) as archive:
+                    for key in keys:
+                        archive.writestr(key, self.read(self.disk_path(key)))
+            else:
+                with tarfile.open(temp_filename, get_tar_mode(self.filename)) as archive:
+                    for key in keys:
+                        content = self.read(self.disk_path(key))
+                        info = tarfile.TarInfo(key)
+                        info.size = len(content)
+                        archive.addfile(info, io.BytesIO(content))
+            os.replace(temp_filename, self.filename)
+        except BaseException:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            raise
+        print('%d files written to %s' % (len(keys), self.filename))
+
+
+def get_tar_mode(filename):
+    """Return the tarfile mode for an archive name or None if it isn't a tar archive."""
+    for suffix, mode in ARCHIVE_MODES:
+        if filename.endswith(suffix):
+            return mode
+    return None
+
+
+def open_sink(output, root):
+    """Return the sink for an --output value and data directory.
+
+    output is 'memory', the name of a .zip, .tar, .tar.gz, .tgz, .tar.bz2 or
+    .tar.xz archive or None for the data directory itself."""
+    if output is None:
+        return DirectorySink()
+    if output == 'memory':
+        return MemorySink(root)
+    if output.endswith('.zip') or get_tar_mode(output) is not None:
+        return ArchiveSink(root, output)
+    raise ValueError('%s is not memory or a .zip or .tar archive' % output)
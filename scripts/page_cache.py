@@ -0,0 +1,226 @@
+"""
+This module keeps a persistent cache of what the stages after pagination get
+from parsing the XML of each page, so that a page is only parsed again when its
+text changes.
+
+Each stage asks for a named part, for example the event stream that
+add_html_to_paginated_json.py renders or the chapter divs that
+make_chapter_index_json.py looks for, with
+
+    cache = ParsedPageCache(data_path, 'chapter-divs', sources=[__file__])
+    value = cache.get(text, ms, page, build)
+
+If the cache has the part for a page with the same text (matched by the
+sha256 hash of the text) it is returned, otherwise build(text) is called to
+make it and it is stored. The parts must be made of json types (tuples are
+returned as lists). The parts are kept as json in
+[cache]/[data directory]/[part]/[siglum].json, one file per manuscript, where
+[cache] is the hidden .page_cache directory next to the scripts (or the
+directory given with --page_cache_dir) and [data directory] is the name of the
+data directory and the start of the hash of its absolute path, so that the
+editions built from one checkout of the scripts have their own caches. The
+cache is kept out of the data directory because the data directory is
+published. A manuscript's file is
+loaded the first time a page of the manuscript is asked for and saved when the
+stage moves on to another manuscript or calls save() or close(). Only the
+pages asked for in the run are kept, so the entries for old versions of the
+pages are dropped. When a stage only rebuilds some of the pages of a manuscript
+(with --pages) the cache is opened with prune=False so the entries of the other
+pages are kept.
+
+The version of each part is the hash of the source files given as sources (and
+of this file) so a change to the code that builds a part throws away the
+parts made by the old code.
+
+If build raises an XML parse error the page is recorded as failing in
+[cache]/[data directory]/failures.json and the message is printed. get returns None
+for the page from then on, in every stage, without parsing it or printing the
+message again until its text changes.
+
+The cache is not part of the output so it is not recorded as a change to the
+data directory or deployed.
+
+"""
+import os
+import json
+import hashlib
+import collections
+from xml.etree.ElementTree import ParseError
+from lxml import etree
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.page_cache')
+FAILURES_FILE = 'failures.json'
+CACHE_VERSION = 2
+
+# the directory the caches are kept in, set with set_cache_dir
+cache_dir = CACHE_DIR
+
+
+def set_cache_dir(directory):
+    """Set the directory the caches are kept in, None for the default."""
+    global cache_dir
+    cache_dir = CACHE_DIR if directory is None else directory
+
+
+def get_cache_path(data_path):
+    """Return the directory of the caches for a data directory."""
+    data_path = os.path.abspath(data_path)
+    digest = hashlib.sha256(data_path.encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, '%s-%s' % (os.path.basename(data_path), digest[:12]))
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def write_file(filename, content):
+    """Replace a cache file (not through build_output as it is not an output)."""
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    temp_filename = '%s.tmp%d' % (filename, os.getpid())
+    with open(temp_filename, 'wb') as output:
+        output.write(content)
+    os.replace(temp_filename, filename)
+
+
+class PageElement(collections.namedtuple('PageElement', ['tag', 'attrib', 'text', 'tail'])):
+    """The parts of an element used by the stream handlers, as it was when its event was read."""
+    __slots__ = ()
+
+    def get(self, key, default=None):
+        return self.attrib.get(key, default)
+
+
+def record_events(parser):
+    """Return the events of an ElementTree iterparse as (event, (tag, attrib, text, tail)) tuples.
+
+    Plain tuples are much quicker to store and load than objects, use
+    replay_events to turn them back into elements."""
+    return [(event, (element.tag, element.attrib, element.text, element.tail))
+            for event, element in parser]
+
+
+def replay_events(events):
+    """Yield the events from record_events as (event, PageElement) tuples."""
+    new = tuple.__new__
+    for event, fields in events:
+        yield event, new(PageElement, fields)
+
+
+class ParsedPageCache(object):
+    """The cached results of parsing pages for one part."""
+    def __init__(self, data_path, part, sources=(), prune=True):
+        self.prune = prune
+        self.cache_path = get_cache_path(data_path)
+        self.part_path = os.path.join(self.cache_path, part)
+        digest = hashlib.sha256(str(CACHE_VERSION).encode('utf-8'))
+        for source in list(sources) + [__file__]:
+            with open(source, 'rb') as source_file:
+                digest.update(source_file.read())
+        self.version = digest.hexdigest()
+        self.document = None
+        self.entries = {}
+        self.used = {}
+        self.changed = False
+        self.failures = self.load_failures()
+        self.new_failures = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load_failures(self):
+        try:
+            with open(os.path.join(self.cache_path, FAILURES_FILE), encoding='utf-8') as failures_file:
+                return json.load(failures_file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def open(self, document):
+        """Load the entries of a manuscript, saving those of the previous one."""
+        if document == self.document:
+            return
+        self.save()
+        self.document = document
+        self.entries = {}
+        self.used = {}
+        self.changed = False
+        try:
+            with open(os.path.join(self.part_path, '%s.json' % document), encoding='utf-8') as cache_file:
+                stored = json.load(cache_file)
+        except (FileNotFoundError, ValueError):
+            return
+        if isinstance(stored, dict) and stored.get('version') == self.version:
+            self.entries = stored['entries']
+            if not self.prune:
+                self.used = dict(self.entries)
+
+    def get(self, text, document, page, build):
+        """Return the part for the text of a page, building it if it is not cached.
+
+        Returns None if the page cannot be parsed."""
+        key = text_hash(text)
+        if key in self.failures:
+            return None
+        self.open(document)
+        if key in self.entries:
+            self.hits += 1
+            value = self.entries[key]
+        else:
+            self.misses += 1
+            try:
+                value = build(text)
+            except (ParseError, etree.XMLSyntaxError) as error:
+                print("Not parsing xml of %s, %s: %s" % (document, page, error))
+                self.failures[key] = self.new_failures[key] = '%s %s: %s' % (document, page, error)
+                return None
+            self.changed = True
+        self.used[key] = value
+        return value
+
+    def save(self):
+        """Write the entries used for the current manuscript and any new failures."""
+        if self.document is not None and (self.changed or len(self.used) != len(self.entries)):
+            write_file(os.path.join(self.part_path, '%s.json' % self.document),
+                       json.dumps({'version': self.version, 'entries': self.used},
+                                  ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+            self.entries = self.used
+            self.used = dict(self.used)
+            self.changed = False
+        if self.new_failures:
+            # other caches may have recorded failures since this one was loaded
+            failures = self.load_failures()
+            failures.update(self.new_failures)
+            write_file(os.path.join(self.cache_path, FAILURES_FILE),
+                       json.dumps(failures, indent=1, sort_keys=True).encode('utf-8'))
+            self.new_failures = {}
+
+    def close(self):
+        """Save the cache and say how much it was used."""
+        self.save()
+        print('parsed page cache (%s): %d pages cached, %d parsed' %
+              (os.path.basename(self.part_path), self.hits, self.misses))
+
+
+def open_cache(data_path, part, sources, enabled=True, prune=True):
+    """Return a ParsedPageCache for the part or None if the cache is switched off."""
+    if not enabled:
+        return None
+    return ParsedPageCache(data_path, part, sources=sources, prune=prune)
+
+
+def get(cache, text, document, page, build):
+    """Get a part from the cache if there is one, otherwise build it (returning None on a parse error)."""
+    if cache is not None:
+        return cache.get(text, document, page, build)
+    try:
+        return build(text)
+    except (ParseError, etree.XMLSyntaxError) as error:
+        print("Not parsing xml of %s, %s: %s" % (document, page, error))
+        return None
+
+
+def add_argument(parser):
+    """Add the --no_page_cache and --page_cache_dir arguments to a script's argument parser."""
+    parser.add_argument('--no_page_cache', action='store_true',
+                        help='parse every page rather than using the parsed page cache')
+    parser.add_argument('--page_cache_dir',
+                        help='the directory to keep the parsed page cache in '
+                             '(default scripts/.page_cache)')
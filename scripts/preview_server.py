@@ -0,0 +1,276 @@
+#!/usr/bin/python3
+
+"""
+This script runs a small local web server which lets editors preview changes to
+the transcriptions without rebuilding the data for the whole corpus.
+
+Pages are only made when they are requested. The server answers the same urls
+the viewer uses for the paginated data, under the data/ directory the viewer
+reads them from (DATA_PATH in main.js):
+
+* /data/transcription/[siglum]/[page].json - the page json including html and
+html_abbrev
+* /data/menu/[siglum].json - the list of pages of a manuscript
+* /data/abbreviations.json - the abbreviation hover overs of the pages made so
+far (main.js requests it again when it is missing the hover over of a new page)
+
+Any other url is served as a file from the site directory given with
+--site_path (the directory holding the viewer's pages and the built data
+directory) so opening the viewer from this server shows the previewed pages
+next to the rest of the built data. Without --site_path other urls are not
+found.
+
+When a page is requested the manuscript's XML file is split into pages with
+the PageSplitter from make_paginated_json.py and only the requested page is
+turned into html with the DisplayTextGenerator from
+add_html_to_paginated_json.py.
+
+The split manuscripts and the rendered pages are kept in least recently used
+caches keyed by the sha256 hash of the XML file. The file is checked on every
+request and as soon as it changes the entries made from the old version are
+dropped, so saving the XML and reloading the page shows the change. The XML
+files are found from an index of the transcription directory which is only
+made again when the modification time of one of its directories changes, that
+is when a file is added, removed or renamed.
+
+By default the server uses the same transcription directory as
+make_paginated_json.py and listens on localhost port 8000.
+
+"""
+import sys
+import os
+import argparse
+import hashlib
+import functools
+import threading
+import collections
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from xml.etree.ElementTree import ParseError
+from lxml import etree
+import build_output
+from make_paginated_json import PageSplitter, XML_DIR
+from add_html_to_paginated_json import DisplayTextGenerator
+
+PORT = 8000
+CACHE_SIZE = 200
+DATA_PREFIX = 'data'
+
+
+class LRUCache(object):
+    """A dictionary which keeps only the most recently used entries."""
+    def __init__(self, size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+
+    def get(self, key):
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def remove_if(self, test):
+        """Remove all of the entries whose key passes the test."""
+        for key in [key for key in self.entries if test(key)]:
+            del self.entries[key]
+
+
+class PreviewRenderer(object):
+    """Make single transcription pages on demand from the XML files."""
+    def __init__(self, directory=XML_DIR, cache_size=CACHE_SIZE):
+        self.directory = directory
+        self.splitter = PageSplitter(directory=directory)
+        self.generators = {False: DisplayTextGenerator(expanded=False),
+                           True: DisplayTextGenerator(expanded=True)}
+        self.abbreviations = {}
+        for generator in self.generators.values():
+            generator.abbreviations = self.abbreviations
+        # (path, sha256) -> {page name: page json} and list of page names
+        self.manuscripts = LRUCache(max(1, cache_size // 10))
+        # (sha256, page name) -> page json with html
+        self.pages = LRUCache(cache_size)
+        # path -> (modification time, size, sha256) to avoid rehashing
+        self.file_hashes = {}
+        # siglum -> XML file and directory -> modification time when indexed
+        self.files = None
+        self.directory_times = {}
+        self.lock = threading.Lock()
+
+    def index_changed(self):
+        """Return True if a directory has changed since the XML files were indexed."""
+        for directory, mtime in self.directory_times.items():
+            try:
+                if os.stat(directory).st_mtime_ns != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def index_files(self):
+        """Index the XML file of each manuscript (as make_paginated_json.py names them)."""
+        self.files = {}
+        self.directory_times = {}
+        for root, dirs, files in os.walk(self.directory):
+            dirs.sort()
+            self.directory_times[root] = os.stat(root).st_mtime_ns
+            for file in sorted(files):
+                if file.endswith('.xml'):
+                    self.files.setdefault(file.replace('.xml', '').split('-')[0],
+                                          os.path.join(root, file))
+
+    def find_file(self, siglum):
+        """Return the XML file for a manuscript or None if there isn't one."""
+        if self.files is None or self.index_changed():
+            self.index_files()
+        return self.files.get(siglum)
+
+    def get_hash(self, filename):
+        """Return the hash of the file, dropping cache entries for older versions."""
+        status = os.stat(filename)
+        known = self.file_hashes.get(filename)
+        if known is not None and known[:2] == (status.st_mtime_ns, status.st_size):
+            return known[2]
+        with open(filename, 'rb') as xml_file:
+            digest = hashlib.sha256(xml_file.read()).hexdigest()
+        if known is not None and known[2] != digest:
+            print('%s changed' % filename)
+            self.manuscripts.remove_if(lambda key: key[0] == filename)
+            self.pages.remove_if(lambda key: key[0] == known[2])
+        self.file_hashes[filename] = (status.st_mtime_ns, status.st_size, digest)
+        return digest
+
+    def get_manuscript(self, siglum):
+        """Return the hash of the manuscript file and its pages, splitting it if needed."""
+        filename = self.find_file(siglum)
+        if filename is None:
+            return None, None
+        digest = self.get_hash(filename)
+        manuscript = self.manuscripts.get((filename, digest))
+        if manuscript is None:
+            print('paginating %s' % filename)
+            pages = self.splitter.paginate(filename)
+            manuscript = {'pages': dict([(page['name'], page) for page in pages]),
+                          'page_list': [page['name'] for page in pages]}
+            self.manuscripts.put((filename, digest), manuscript)
+        return digest, manuscript
+
+    def get_page_list(self, siglum):
+        with self.lock:
+            digest, manuscript = self.get_manuscript(siglum)
+            if manuscript is None:
+                return None
+            return manuscript['page_list']
+
+    def get_page(self, siglum, page):
+        """Return the json data for a page with its html or None if it doesn't exist."""
+        with self.lock:
+            digest, manuscript = self.get_manuscript(siglum)
+            if manuscript is None or page not in manuscript['pages']:
+                return None
+            page_json = self.pages.get((digest, page))
+            if page_json is None:
+                page_json = dict(manuscript['pages'][page])
+                try:
+                    page_json['html'] = self.generators[True].render_page(page_json, siglum, page)
+                    page_json['html_abbrev'] = self.generators[False].render_page(page_json, siglum, page)
+                except (ParseError, etree.XMLSyntaxError) as error:
+                    page_json['html'] = page_json['html_abbrev'] = \
+                        '<pre class="preview-error">%s</pre>' % error
+                self.pages.put((digest, page), page_json)
+            return page_json
+
+    def get_abbreviations(self):
+        with self.lock:
+            return dict(self.abbreviations)
+
+
+class PreviewHandler(SimpleHTTPRequestHandler):
+    """Answer requests for transcription pages and page lists, serving other files from the site."""
+    renderer = None
+    site_path = None
+
+    def do_GET(self):
+        parts = self.path.split('?')[0].strip('/').split('/')
+        if parts[0] != DATA_PREFIX:
+            self.send_file()
+            return
+        parts = parts[1:]
+        data = None
+        try:
+            if len(parts) == 3 and parts[0] == 'transcription' and parts[2].endswith('.json'):
+                data = self.renderer.get_page(parts[1], parts[2].replace('.json', ''))
+            elif len(parts) == 2 and parts[0] == 'menu' and parts[1].endswith('.json'):
+                data = self.renderer.get_page_list(parts[1].replace('.json', ''))
+            elif parts == ['abbreviations.json']:
+                data = self.renderer.get_abbreviations()
+        except etree.XMLSyntaxError as error:
+            # the XML file itself cannot be parsed so it can't be paginated
+            self.send_error(500, 'XML error: %s' % error)
+            return
+        if data is None:
+            self.send_file()
+            return
+        content = build_output.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_HEAD(self):
+        self.send_file(head=True)
+
+    def send_file(self, head=False):
+        """Serve the file from the site directory or not found if there isn't one."""
+        if self.site_path is None:
+            self.send_error(404)
+        elif head:
+            super().do_HEAD()
+        else:
+            super().do_GET()
+
+
+def main(argv):
+    """Run when module called."""
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-x', '--xml_path',
+                        help='the directory containing the transcription XML '
+                             'files (defaults to the one used by '
+                             'make_paginated_json.py)')
+    parser.add_argument('-p', '--port', type=int, default=PORT,
+                        help='the port to listen on')
+    parser.add_argument('--cache_size', type=int, default=CACHE_SIZE,
+                        help='the number of rendered pages to keep')
+    parser.add_argument('-s', '--site_path',
+                        help='the directory to serve the other files of the '
+                             'site from (the one containing the data directory)')
+
+    args = parser.parse_args(argv)
+
+    if args.xml_path:
+        PreviewHandler.renderer = PreviewRenderer(directory=args.xml_path,
+                                                  cache_size=args.cache_size)
+    else:
+        PreviewHandler.renderer = PreviewRenderer(cache_size=args.cache_size)
+    handler = PreviewHandler
+    if args.site_path:
+        PreviewHandler.site_path = os.path.abspath(args.site_path)
+        handler = functools.partial(PreviewHandler, directory=PreviewHandler.site_path)
+    server = ThreadingHTTPServer(('localhost', args.port), handler)
+    print('serving previews on http://localhost:%d/' % args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
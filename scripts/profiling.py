@@ -0,0 +1,221 @@
+"""
+This module records how long the process_start_* and process_end_* handlers of
+the stream processors (DisplayTextGenerator and PageSplitter) take, so that we
+can see which TEI constructs and which pages are expensive. Generic profilers
+mostly show the time spent in getattr and the parser rather than in the
+individual handlers.
+
+A HandlerProfiler is given to a processor as its profiler attribute. When it is
+set each handler is called through HandlerProfiler.call which counts the calls
+and adds up the time for each handler. The processors also record the time
+taken for each page and the size of its output with add_page (PageSplitter
+records each XML file rather than each page). When no profiler
+is set the handlers are called directly.
+
+The scripts which use it take a --profile argument (see add_argument) and print
+the report at the end.
+
+The MemoryTracker records the peak memory of a stage and of the units of work
+within it (a manuscript, a chapter, the loading of a whole XML tree). It uses
+tracemalloc for the peak of the memory allocated by Python and a thread which
+samples the resident set size of the process for the peak of the process as a
+whole (which includes the memory used by libxml2). For each unit the
+allocation sites (file and line) holding the most additional memory at its end
+compared with its start are kept so the report can name where the memory went. Units are marked with
+
+    with profiling.track(tracker, label):
+
+which does nothing when the tracker is None. The scripts which use it take a
+--memory argument (see add_memory_argument). tracemalloc makes the scripts
+several times slower so it is only switched on when asked for.
+
+"""
+import os
+import time
+import threading
+import contextlib
+import tracemalloc
+
+TOP = 20
+SAMPLE_INTERVAL = 0.05
+SITES = 3
+MB = 1024 * 1024
+
+
+class HandlerProfiler(object):
+    """Call counts and times for handlers and times and sizes for pages."""
+    def __init__(self):
+        # handler name -> [calls, seconds]
+        self.handlers = {}
+        # (page, seconds, output size)
+        self.pages = []
+
+    def call(self, handler, element):
+        """Call a handler with the element and return its result, recording the time."""
+        start = time.perf_counter()
+        try:
+            return handler(element)
+        finally:
+            elapsed = time.perf_counter() - start
+            stats = self.handlers.get(handler.__qualname__)
+            if stats is None:
+                stats = self.handlers[handler.__qualname__] = [0, 0.0]
+            stats[0] += 1
+            stats[1] += elapsed
+
+    def add_page(self, page, seconds, size):
+        self.pages.append((page, seconds, size))
+
+    def report(self, top=TOP):
+        """Print the slowest handlers and pages."""
+        total = sum([stats[1] for stats in self.handlers.values()])
+        print('%-45s %10s %10s %10s %7s' % ('handler', 'calls', 'seconds', 'us/call', '%'))
+        for name, (calls, seconds) in sorted(self.handlers.items(),
+                                             key=lambda item: item[1][1],
+                                             reverse=True)[:top]:
+            print('%-45s %10d %10.3f %10.1f %7.1f' % (name, calls, seconds,
+                                                      seconds * 1e6 / calls,
+                                                      seconds * 100 / max(total, 1e-9)))
+        print()
+        print('%-45s %10s %10s' % ('page or file', 'seconds', 'bytes'))
+        for page, seconds, size in sorted(self.pages, key=lambda page: page[1],
+                                          reverse=True)[:top]:
+            print('%-45s %10.3f %10d' % (page, seconds, size))
+        if self.pages:
+            print('%d entries, %.3f seconds, %d bytes' % (len(self.pages),
+                                                        sum([page[1] for page in self.pages]),
+                                                        sum([page[2] for page in self.pages])))
+
+
+def get_rss():
+    """Return the current resident set size of the process in bytes."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # not Linux, fall back on the peak so far (in kilobytes on Linux, bytes on macOS)
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryTracker(object):
+    """Peak memory of nested units of work and their largest allocation sites."""
+    def __init__(self, interval=SAMPLE_INTERVAL, sites=SITES):
+        self.interval = interval
+        self.sites = sites
+        # [label, traced peak, rss peak] of the units being tracked
+        self.open_units = []
+        # (label, depth, traced peak, rss peak, [(site, size)])
+        self.units = []
+        self.rss_peak = 0
+        self.stopped = threading.Event()
+        self.sampler = None
+
+    def start(self):
+        tracemalloc.start()
+        self.rss_peak = get_rss()
+        self.stopped.clear()
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.sampler.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.sampler is not None:
+            self.sampler.join()
+            self.sampler = None
+        tracemalloc.stop()
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            self.rss_peak = max(self.rss_peak, get_rss())
+
+    def fold_peaks(self):
+        """Add the peaks since the last reset to all of the open units and reset them."""
+        self.rss_peak = max(self.rss_peak, get_rss())
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        for unit in self.open_units:
+            unit[1] = max(unit[1], traced_peak)
+            unit[2] = max(unit[2], self.rss_peak)
+        tracemalloc.reset_peak()
+        self.rss_peak = get_rss()
+
+    @contextlib.contextmanager
+    def track(self, label):
+        """Record the peak memory used while the block runs as a unit called label."""
+        self.fold_peaks()
+        unit = [label, 0, 0]
+        self.open_units.append(unit)
+        position = len(self.units)
+        self.units.append(None)
+        before = tracemalloc.take_snapshot()
+        try:
+            yield
+        finally:
+            after = tracemalloc.take_snapshot()
+            self.fold_peaks()
+            self.open_units.pop()
+            sites = []
+            filters = [tracemalloc.Filter(False, tracemalloc.__file__),
+                       tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                       tracemalloc.Filter(False, '<unknown>')]
+            after = after.filter_traces(filters)
+            before = before.filter_traces(filters)
+            for stat in after.compare_to(before, 'lineno')[:self.sites]:
+                if stat.size_diff > 0:
+                    sites.append((str(stat.traceback[0]), stat.size_diff))
+            self.units[position] = (label, len(self.open_units), unit[1], unit[2], sites)
+
+    def report(self, top=TOP):
+        """Print the peaks of the stages and the units with the largest peaks."""
+        print('%-45s %12s %12s' % ('unit', 'traced MB', 'rss MB'))
+        for label, depth, traced, rss, sites in self.units:
+            if depth == 0:
+                print('%-45s %12.1f %12.1f' % (label, traced / MB, rss / MB))
+        print()
+        nested = [unit for unit in self.units if unit[1] > 0]
+        for label, depth, traced, rss, sites in sorted(nested, key=lambda unit: unit[2],
+                                                       reverse=True)[:top]:
+            print('%-45s %12.1f %12.1f' % (label, traced / MB, rss / MB))
+            for site, size in sites:
+                print('    %10.1f KB %s' % (size / 1024, site))
+
+
+def start_memory_tracking(option):
+    """Return a started MemoryTracker if the --memory option was given, otherwise None."""
+    if option is None:
+        return None
+    tracker = MemoryTracker()
+    tracker.start()
+    return tracker
+
+
+def stop_memory_tracking(tracker, top):
+    """Stop a tracker from start_memory_tracking and print its report."""
+    if tracker is None:
+        return
+    tracker.stop()
+    tracker.report(top)
+
+
+def track(tracker, label):
+    """Return a context which tracks a unit with the tracker if there is one."""
+    if tracker is None:
+        return contextlib.nullcontext()
+    return tracker.track(label)
+
+
+def add_argument(parser):
+    """Add the --profile argument to a script's argument parser."""
+    parser.add_argument('--profile', type=int, nargs='?', const=TOP, default=None,
+                        metavar='N',
+                        help='time the handlers and pages and print the N '
+                             'slowest of each (default %d)' % TOP)
+
+
+def add_memory_argument(parser):
+    """Add the --memory argument to a script's argument parser."""
+    parser.add_argument('--memory', type=int, nargs='?', const=TOP, default=None,
+                        metavar='N',
+                        help='track the peak memory of the stage and of each '
+                             'manuscript or chapter and print the N largest '
+                             'with their allocation sites (default %d)' % TOP)
@@ -0,0 +1,240 @@
+#!/usr/bin/python3
+
+"""
+This script benchmarks the data processing scripts on synthetic corpora made
+with make_synthetic_corpus.py so that we know how the build scales and can
+spot regressions.
+
+For each corpus size (the number of pages in each manuscript) a corpus is made
+in a temporary directory and each stage is run on it in order:
+
+* pagination - PageSplitter.separate_pages
+* html - DisplayTextGenerator.generate_all_pages (abbreviated and expanded)
+* chapter_index - IndiceCreator.make_indice
+* verse_page_index - make_verse_page_index
+* critical_lists - make_critical_text_files
+* search_index - SearchIndexer
+* chapter_transcriptions - ChapterStitcher
+* verse_bundles - VerseBundler
+* reader - Reader.process
+* translation - Translation.process
+* cpsf_critical - Critical.process
+
+Each stage is run in a fresh process so that the peak memory (the maximum
+resident set size of that process) belongs to the stage alone. The time is
+measured around the stage's work only. With --repeat the stages are run
+several times and the median time and memory are reported.
+
+The results are printed as a table of seconds, pages per second and peak
+memory in MB, and can also be saved as json with --output.
+
+"""
+import sys
+import os
+import argparse
+import json
+import time
+import shutil
+import tempfile
+import resource
+import statistics
+import multiprocessing
+import make_synthetic_corpus
+
+SIZES = '10,100,1000'
+STAGES = ['pagination', 'html', 'chapter_index', 'verse_page_index',
+          'critical_lists', 'search_index', 'chapter_transcriptions', 'verse_bundles',
+          'reader', 'translation', 'cpsf_critical']
+
+
+def get_paths(corpus_path):
+    """Return the input and output paths for a corpus directory."""
+    transcriptions = os.path.join(corpus_path, 'transcriptions')
+    return {'data_path': os.path.join(corpus_path, 'data'),
+            'xml_dir': os.path.join(transcriptions, 'manuscripts'),
+            'index_file': os.path.join(corpus_path, 'chapter_index.csv'),
+            'collations_dir': os.path.join(corpus_path, 'collation', 'approved'),
+            'reader_dir': os.path.join(transcriptions, 'readerXML'),
+            'translation_dir': os.path.join(transcriptions, 'translationXML'),
+            'critical_dir': os.path.join(transcriptions, 'criticalXML')}
+
+
+def run_pagination(paths):
+    from make_paginated_json import PageSplitter
+    splitter = PageSplitter(directory=paths['xml_dir'], data_path=paths['data_path'])
+    splitter.clear_transcription_directory()
+    splitter.separate_pages()
+
+
+def run_html(paths):
+    from add_html_to_paginated_json import DisplayTextGenerator
+    for expanded in [False, True]:
+        DisplayTextGenerator(data_path=paths['data_path'], expanded=expanded).generate_all_pages()
+
+
+def run_chapter_index(paths):
+    from make_chapter_index_json import IndiceCreator
+    IndiceCreator(data_path=paths['data_path'], directory=paths['xml_dir'],
+                  index_file=paths['index_file']).make_indice()
+
+
+def run_verse_page_index(paths):
+    from make_verse_page_index_json import make_verse_page_index
+    make_verse_page_index(data_path=paths['data_path'])
+
+
+def run_critical_lists(paths):
+    from make_critical_chapter_verse_json import make_critical_text_files
+    make_critical_text_files(data_path=paths['data_path'], directory=paths['collations_dir'])
+
+
+def run_search_index(paths):
+    from make_search_index import SearchIndexer
+    indexer = SearchIndexer(data_path=paths['data_path'])
+    os.makedirs(indexer.search_path, exist_ok=True)
+    indexer.index_all_pages()
+    indexer.write_index()
+
+
+def run_chapter_transcriptions(paths):
+    from make_chapter_transcriptions import ChapterStitcher
+    stitcher = ChapterStitcher(data_path=paths['data_path'])
+    shutil.rmtree(stitcher.chapter_path, ignore_errors=True)
+    stitcher.process()
+
+
+def run_verse_bundles(paths):
+    from make_verse_bundles import VerseBundler
+    bundler = VerseBundler(data_path=paths['data_path'])
+    shutil.rmtree(bundler.verse_path, ignore_errors=True)
+    os.makedirs(bundler.verse_path)
+    bundler.process()
+
+
+def run_reader(paths):
+    from make_reader import Reader
+    reader = Reader(data_path=paths['data_path'], directory=paths['reader_dir'])
+    reader.clear_reader_directory()
+    reader.process()
+
+
+def run_translation(paths):
+    from make_translation import Translation
+    translation = Translation(data_path=paths['data_path'], directory=paths['translation_dir'])
+    translation.clear_translation_directory()
+    translation.process()
+
+
+def run_cpsf_critical(paths):
+    from make_cpsf_critical import Critical
+    critical = Critical(data_path=paths['data_path'], directory=paths['critical_dir'])
+    critical.clear_cpsfcritical_directory()
+    critical.process()
+
+
+def measure_stage(stage, paths, results):
+    """Run a stage (in a child process) and send back its time and peak memory."""
+    sys.stdout = open(os.devnull, 'w')
+    start = time.perf_counter()
+    globals()['run_%s' % stage](paths)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux
+    results.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def run_stage(stage, paths):
+    """Return the seconds and peak memory in MB of a single run of a stage."""
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=measure_stage, args=(stage, paths, results))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError('stage %s failed' % stage)
+    return results.get()
+
+
+def benchmark_corpus(corpus_path, stages, repeat):
+    """Run the stages on a corpus and return the median time and memory of each."""
+    paths = get_paths(corpus_path)
+    os.makedirs(paths['data_path'], exist_ok=True)
+    measurements = dict([(stage, []) for stage in stages])
+    for i in range(repeat):
+        for stage in stages:
+            measurements[stage].append(run_stage(stage, paths))
+    summary = {}
+    for stage in stages:
+        summary[stage] = {'seconds': statistics.median([m[0] for m in measurements[stage]]),
+                          'peak_mb': statistics.median([m[1] for m in measurements[stage]]),
+                          'runs': [m[0] for m in measurements[stage]]}
+    return summary
+
+
+def run_benchmarks(sizes, stages=STAGES, repeat=1, corpus_options=None):
+    """Benchmark each corpus size and return the results keyed by size."""
+    if corpus_options is None:
+        corpus_options = {}
+    results = {}
+    for size in sizes:
+        temp_path = tempfile.mkdtemp(prefix='estoria_benchmark_')
+        try:
+            corpus_path = os.path.join(temp_path, 'corpus')
+            generator = make_synthetic_corpus.CorpusGenerator(corpus_path, pages=size,
+                                                              **corpus_options)
+            generator.make_corpus()
+            summary = benchmark_corpus(corpus_path, stages, repeat)
+        finally:
+            shutil.rmtree(temp_path)
+        total_pages = size * generator.manuscripts
+        for stage in summary:
+            summary[stage]['pages'] = total_pages
+            summary[stage]['pages_per_second'] = total_pages / max(summary[stage]['seconds'], 1e-9)
+        results[str(size)] = summary
+    return results
+
+
+def print_results(results):
+    print('%-24s %8s %10s %10s %10s' % ('stage', 'pages', 'seconds', 'pages/s', 'peak MB'))
+    for size in results:
+        for stage in results[size]:
+            result = results[size][stage]
+            print('%-24s %8d %10.3f %10.1f %10.1f' % (stage, result['pages'],
+                                                     result['seconds'],
+                                                     result['pages_per_second'],
+                                                     result['peak_mb']))
+
+
+def add_arguments(parser):
+    """Add the benchmark arguments to a parser."""
+    parser.add_argument('--sizes', default=SIZES,
+                        help='comma separated list of the number of pages per '
+                             'manuscript in each corpus (default %s)' % SIZES)
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help='comma separated list of the stages to run (the '
+                             'stages they depend on must be included)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='the number of times to run each stage')
+    make_synthetic_corpus.add_arguments(parser)
+
+
+def main(argv):
+    """Run when module called."""
+
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    parser.add_argument('-o', '--output',
+                        help='save the results as json to this file')
+
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = run_benchmarks(sizes, stages=args.stages.split(','), repeat=args.repeat,
+                             corpus_options=make_synthetic_corpus.corpus_options(args))
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(results, output, indent=4)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+
+"""
+This script uses the change manifest written by the other scripts
+(data/build_changes.json) to copy only the files that have changed since the
+last deploy to a web server, instead of syncing the whole data directory.
+
+The created and modified files are copied and the deleted files are removed
+from the destination using rsync. When the copy succeeds the change manifest is
+cleared so that the next run only sends what the following builds change.
+
+Use --list to print the changed paths (relative to the data directory) without
+copying anything, for example to feed them to other deploy tools.
+
+The destination must be given unless --list or --clear is used. It can be
+anything rsync accepts such as user@host:/path/to/data
+
+"""
+import sys
+import os
+import argparse
+import subprocess
+import build_output
+
+DATA_DIR = '../data'
+
+
+def load_changes(data_path):
+    """Return the combined created, modified and deleted paths."""
+    changes = build_output.load_json(os.path.join(data_path,
+                                                   build_output.CHANGES_FILE),
+                                      {})
+    updated = sorted(list(changes.get('created', {})) +
+                     list(changes.get('modified', {})))
+    return updated, changes.get('deleted', [])
+
+
+def clear_changes(data_path):
+    """Remove the change manifest after a successful deploy."""
+    try:
+        os.remove(os.path.join(data_path, build_output.CHANGES_FILE))
+    except FileNotFoundError:
+        pass
+
+
+def sync(data_path, destination):
+    """Copy the changed files to the destination and delete the removed ones."""
+    updated, deleted = load_changes(data_path)
+    if not updated and not deleted:
+        print('nothing to sync')
+        return
+    # --delete-missing-args removes listed files which do not exist locally
+    file_list = '\n'.join(updated + deleted) + '\n'
+    subprocess.run(['rsync', '--archive', '--relative', '--files-from=-',
+                    '--delete-missing-args',
+                    os.path.join(data_path, ''), destination],
+                   input=file_list.encode('utf-8'), check=True)
+    print('%d files copied, %d deleted' % (len(updated), len(deleted)))
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('destination', nargs='?',
+                        help='the rsync destination for the data directory')
+    parser.add_argument('-d', '--data_path',
+                        help='the path to the data directory'
+                             '(only used by the django app, use default for '
+                             'webpack build)')
+    parser.add_argument('--list', action='store_true',
+                        help='print the changed paths and exit')
+    parser.add_argument('--clear', action='store_true',
+                        help='clear the change manifest without syncing')
+
+    args = parser.parse_args(argv)
+
+    if args.data_path:
+        data_path = args.data_path
+    else:
+        data_path = DATA_DIR
+
+    with build_output.build_lock(data_path):
+        if args.list:
+            updated, deleted = load_changes(data_path)
+            for path in updated:
+                print(path)
+            for path in deleted:
+                print(path)
+            return
+        if args.clear:
+            clear_changes(data_path)
+            return
+        if not args.destination:
+            parser.error('a destination is required')
+        sync(data_path, args.destination)
+        clear_changes(data_path)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,93 @@
+import os
+import io
+import json
+import shutil
+import tempfile
+import unittest
+import contextlib
+from html.parser import HTMLParser
+import make_synthetic_corpus
+from make_paginated_json import PageSplitter
+from make_chapter_transcriptions import ChapterStitcher
+
+
+class TagChecker(HTMLParser):
+    """Check that the span and div tags of some html are properly nested."""
+
+    def __init__(self):
+        super().__init__()
+        self.open_tags = []
+        self.errors = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('span', 'div'):
+            self.open_tags.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag not in ('span', 'div'):
+            return
+        if not self.open_tags or self.open_tags[-1] != tag:
+            self.errors.append('</%s> closes %s' % (tag, self.open_tags[-1:] or 'nothing'))
+        else:
+            self.open_tags.pop()
+
+
+def check_tags(html):
+    """Return the nesting errors in the html, including any tags left open."""
+    checker = TagChecker()
+    checker.feed(html)
+    checker.close()
+    return checker.errors + ['<%s> is not closed' % tag for tag in checker.open_tags]
+
+
+class TestChapterTranscriptions(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_path)
+
+    def make_chapters(self, **corpus_options):
+        """Make a synthetic corpus and return its stitched chapters."""
+        corpus_path = os.path.join(self.temp_path, 'corpus')
+        data_path = os.path.join(corpus_path, 'data')
+        generator = make_synthetic_corpus.CorpusGenerator(corpus_path, manuscripts=2, pages=6,
+                                                          **corpus_options)
+        generator.make_corpus()
+        with contextlib.redirect_stdout(io.StringIO()):
+            splitter = PageSplitter(directory=os.path.join(corpus_path, 'transcriptions',
+                                                           'manuscripts'),
+                                    data_path=data_path)
+            splitter.clear_transcription_directory()
+            splitter.separate_pages()
+            ChapterStitcher(data_path=data_path).process()
+        chapters = {}
+        chapter_path = os.path.join(data_path, 'chapters')
+        for ms in sorted(os.listdir(chapter_path)):
+            for filename in sorted(os.listdir(os.path.join(chapter_path, ms))):
+                with open(os.path.join(chapter_path, ms, filename), encoding='utf-8') as chapter:
+                    chapters['%s/%s' % (ms, filename)] = json.load(chapter)
+        return chapters
+
+    def check_chapters(self, chapters):
+        self.assertTrue(chapters)
+        for name, chapter in chapters.items():
+            number = chapter['chapter'].replace('VC_', '')
+            for key in ['html', 'html_abbrev']:
+                with self.subTest(chapter=name, html=key):
+                    self.assertIn('<span class="rubric">capitulo %s' % number, chapter[key])
+                    self.assertEqual(check_tags(chapter[key]), [])
+
+    def test_columns(self):
+        self.check_chapters(self.make_chapters())
+
+    def test_single_column(self):
+        self.check_chapters(self.make_chapters(columns=1))
+
+    def test_subcolumns(self):
+        self.check_chapters(self.make_chapters(subcolumns=2))
+
+
+if __name__ == '__main__':
+    unittest.main()
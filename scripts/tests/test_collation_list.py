@@ -0,0 +1,158 @@
+import os
+import io
+import shutil
+import tempfile
+import unittest
+import contextlib
+import make_critical_chapter_verse_json as collation_json
+from make_critical_chapter_verse_json import CollationList, OUTPUTS
+
+COLLATIONS = ['D1S5.json', 'D1S400.json', 'D1S400>.json', 'D1S659.1.json', 'D1SRubric.json',
+              'D1S10.json', 'D2SRUBRIC.json', 'D2S3.json', 'D2S1.json', 'D10S2.json']
+
+
+class CollationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.collations_path = os.path.join(self.temp_path, 'approved')
+        os.makedirs(self.collations_path)
+        for filename in COLLATIONS + ['.DS_Store', 'notes.txt']:
+            self.add_file(filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_path)
+
+    def add_file(self, filename):
+        with open(os.path.join(self.collations_path, filename), 'w') as collation:
+            collation.write('{}')
+
+    def run_script(self, data_path, *arguments):
+        os.makedirs(data_path, exist_ok=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            collation_json.main(['-d', data_path, '-c', self.collations_path] + list(arguments))
+
+    def read_outputs(self, data_path):
+        outputs = {}
+        for output in OUTPUTS:
+            with open(os.path.join(data_path, output), encoding='utf-8') as output_file:
+                outputs[output] = output_file.read()
+        return outputs
+
+
+class TestCollationList(CollationTestCase):
+
+    def get_chapters(self, collations):
+        return dict([(chapter, [name for key, name in verses])
+                     for chapter, verses in collations.chapters.items()])
+
+    def test_scan(self):
+        collations = CollationList(self.collations_path)
+        collations.scan()
+        self.assertEqual(self.get_chapters(collations),
+                         {1: ['D1SRubric.json', 'D1S5.json', 'D1S10.json', 'D1S400.json',
+                              'D1S400>.json', 'D1S659.1.json'],
+                          2: ['D2SRUBRIC.json', 'D2S1.json', 'D2S3.json'],
+                          10: ['D10S2.json']})
+        self.assertEqual(collations.filenames, set(COLLATIONS))
+
+    def test_add(self):
+        collations = CollationList(self.collations_path)
+        collations.add('D1S5.json')
+        collations.add('D1S3.json')
+        collations.add('D1SRubric.json')
+        collations.add('notes.txt')
+        self.assertTrue(collations.changed)
+        self.assertEqual(self.get_chapters(collations),
+                         {1: ['D1SRubric.json', 'D1S3.json', 'D1S5.json']})
+        collations.changed = False
+        collations.add('D1S5.json')
+        self.assertFalse(collations.changed)
+
+    def test_remove(self):
+        collations = CollationList(self.collations_path)
+        collations.scan()
+        collations.changed = False
+        collations.remove('D1S400>.json')
+        collations.remove('D10S2.json')
+        self.assertTrue(collations.changed)
+        self.assertEqual(self.get_chapters(collations)[1],
+                         ['D1SRubric.json', 'D1S5.json', 'D1S10.json', 'D1S400.json',
+                          'D1S659.1.json'])
+        self.assertNotIn(10, collations.chapters)
+        collations.changed = False
+        collations.remove('D9S9.json')
+        self.assertFalse(collations.changed)
+
+    def test_save_and_load(self):
+        state_file = os.path.join(self.temp_path, 'state.json')
+        collations = CollationList(self.collations_path)
+        collations.scan()
+        collations.save(state_file)
+        loaded = CollationList(self.collations_path)
+        self.assertTrue(loaded.load(state_file))
+        self.assertEqual(loaded.chapters, collations.chapters)
+        self.assertEqual(loaded.filenames, collations.filenames)
+        # the saved list is only used for the directory it was made from
+        other = CollationList(os.path.join(self.temp_path, 'other'))
+        self.assertFalse(other.load(state_file))
+        self.assertFalse(CollationList(self.collations_path).load(
+            os.path.join(self.temp_path, 'missing.json')))
+
+    def test_values(self):
+        data_path = os.path.join(self.temp_path, 'data')
+        self.run_script(data_path)
+        with open(os.path.join(data_path, 'collations.json'), encoding='utf-8') as collations:
+            self.assertEqual(collations.read(),
+                             '{"1":["Rubric",5,10,400,400,659],"2":["Rubric",1,3],"10":[2]}')
+
+
+class TestIncrementalUpdates(CollationTestCase):
+    """The incremental updates must write the same files as a full rebuild."""
+
+    def change_collations(self):
+        self.add_file('D1S7.json')
+        self.add_file('D3SRubric.json')
+        os.remove(os.path.join(self.collations_path, 'D1S400>.json'))
+        os.remove(os.path.join(self.collations_path, 'D10S2.json'))
+
+    def full_rebuild(self):
+        data_path = os.path.join(self.temp_path, 'full')
+        self.run_script(data_path)
+        return self.read_outputs(data_path)
+
+    def test_incremental(self):
+        data_path = os.path.join(self.temp_path, 'data')
+        self.run_script(data_path)
+        self.change_collations()
+        self.run_script(data_path, '--incremental')
+        self.assertEqual(self.read_outputs(data_path), self.full_rebuild())
+
+    def test_add_and_remove(self):
+        data_path = os.path.join(self.temp_path, 'data')
+        self.run_script(data_path)
+        self.change_collations()
+        self.run_script(data_path, '--add', 'D1S7.json',
+                        '--add', os.path.join(self.collations_path, 'D3SRubric.json'),
+                        '--remove', 'D1S400>.json', '--remove', 'D10S2.json')
+        self.assertEqual(self.read_outputs(data_path), self.full_rebuild())
+
+    def test_incremental_without_saved_list(self):
+        data_path = os.path.join(self.temp_path, 'data')
+        self.change_collations()
+        self.run_script(data_path, '--incremental')
+        self.assertEqual(self.read_outputs(data_path), self.full_rebuild())
+
+    def test_unchanged(self):
+        data_path = os.path.join(self.temp_path, 'data')
+        self.run_script(data_path)
+        before = dict([(output, os.stat(os.path.join(data_path, output)).st_mtime_ns)
+                       for output in OUTPUTS])
+        self.run_script(data_path, '--incremental')
+        after = dict([(output, os.stat(os.path.join(data_path, output)).st_mtime_ns)
+                      for output in OUTPUTS])
+        self.assertEqual(before, after)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+from verse_key import VerseKey, format_key
+
+
+class TestVerseKey(unittest.TestCase):
+
+    def test_plain_verse(self):
+        key = VerseKey.parse('D12S5')
+        self.assertEqual(key.chapter, 12)
+        self.assertEqual(key.verse, 5)
+        self.assertEqual(key.subverse, 0)
+        self.assertFalse(key.rubric)
+        self.assertEqual(key.value(), 5)
+        self.assertEqual(str(key), 'D12S5')
+
+    def test_angle_bracket_subverse(self):
+        key = VerseKey.parse('D12S400>')
+        self.assertEqual((key.verse, key.subverse), (400, 1))
+        # listed as the verse number as it always has been
+        self.assertEqual(key.value(), 400)
+        self.assertEqual(str(key), 'D12S400>')
+
+    def test_decimal_subverse(self):
+        key = VerseKey.parse('D12S659.1')
+        self.assertEqual((key.verse, key.subverse), (659, 1))
+        self.assertEqual(key.value(), 659)
+        self.assertEqual(str(key), 'D12S659.1')
+
+    def test_other_subverse_is_listed_as_its_string(self):
+        key = VerseKey.parse('D12S400.1')
+        self.assertEqual((key.verse, key.subverse), (400, 1))
+        self.assertEqual(key.value(), '400.1')
+
+    def test_subverses_written_differently_are_different_keys(self):
+        angle = VerseKey.parse('D12S400>')
+        decimal = VerseKey.parse('D12S400.1')
+        self.assertNotEqual(angle, decimal)
+        self.assertEqual(len({angle, decimal}), 2)
+        self.assertEqual(VerseKey.parse('D12S400>'), angle)
+
+    def test_verse_is_after_the_last_s(self):
+        key = VerseKey.parse('DVC_S1S3')
+        self.assertEqual((key.chapter, key.verse), ('VC_S1', 3))
+        self.assertEqual(str(key), 'DVC_S1S3')
+
+    def test_rubric(self):
+        for verse in ['Rubric', 'RUBRIC', 'rubric']:
+            key = VerseKey.parse('D12S%s' % verse)
+            self.assertTrue(key.rubric)
+            self.assertEqual(key.value(), 'Rubric')
+            self.assertEqual(str(key), 'D12S%s' % verse)
+
+    def test_other_verse(self):
+        key = VerseKey.parse('D12Sabc')
+        self.assertEqual(key.verse, 'abc')
+        self.assertEqual(key.value(), 'abc')
+
+    def test_not_a_key(self):
+        for key in ['12S5', 'D12', 'D12S', 'DS5']:
+            with self.assertRaises(ValueError):
+                VerseKey.parse(key)
+
+    def test_order(self):
+        keys = ['D12S5', 'D2S1', 'D12S400>', 'D12SRubric', 'D12S400', 'D12S10',
+                'D12S659.1', 'D12Sb', 'D12Sa', 'DVC_1S1']
+        ordered = [str(key) for key in sorted(VerseKey.parse(key) for key in keys)]
+        self.assertEqual(ordered, ['D2S1', 'D12SRubric', 'D12S5', 'D12S10', 'D12S400',
+                                   'D12S400>', 'D12S659.1', 'D12Sa', 'D12Sb', 'DVC_1S1'])
+
+    def test_from_parts_matches_parse(self):
+        for chapter, verse in [('12', '5'), ('12', '400>'), ('12', 'Rubric'), ('VC_1', '3')]:
+            self.assertEqual(VerseKey.from_parts(chapter, verse),
+                             VerseKey.parse(format_key(chapter, verse)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+"""
+This module has the VerseKey which identifies a verse of the critical text by
+its chapter and verse. Keys are of the form D[chapter]S[verse], for example
+D12S5 or D12SRubric. format_key makes the keys used by the stages which read
+the chapter and verse from the transcriptions (the verse page index, the search
+index and the verse bundles), VerseKey.parse reads the collation file names in
+make_critical_chapter_verse_json.py and VerseKey.from_parts makes a key from a
+chapter and verse so that verses can be put in order.
+
+The verse is one of
+
+* a number - D12S5
+* a number with a sub verse, used for verses added between two others -
+D12S659.1 (and D12S400> which is treated as 400.1)
+* the rubric - D12SRubric (any case)
+* anything else, which is kept as it is
+
+VerseKeys have a total order so a list of them can be sorted with one call to
+sort: by chapter (numbers before any other chapter names), then the rubric
+first, then the numbered verses in order with each sub verse after its verse
+and then any other verses in alphabetical order. The verse string is kept as it
+was given so str() gives back the key it was parsed from, and two keys are only
+equal if their verse strings are too, so D12S400> and D12S400.1 sort next to
+each other but are different verses. As in main.js the verse is everything after
+the last S of a key.
+
+"""
+import re
+import functools
+
+KEY_TEMPLATE = 'D%sS%s'
+KEY_PATTERN = re.compile('^[Dd](.+)S([^S]+)$')
+VERSE_PATTERN = re.compile('^([0-9]+)(?:\\.([0-9]+)|(>))?$')
+RUBRIC = 'Rubric'
+# the verses collations.json has always listed as their verse number
+TRUNCATED_VERSES = ['400>', '659.1']
+
+
+def format_key(chapter, verse):
+    """Return the D[chapter]S[verse] key for a chapter and verse as they are given."""
+    return KEY_TEMPLATE % (chapter, verse)
+
+
+@functools.total_ordering
+class VerseKey(object):
+    """The chapter, verse and sub verse of a verse, or the rubric of a chapter."""
+    __slots__ = ('chapter', 'verse', 'subverse', 'rubric', 'text', 'sort_key')
+
+    def __init__(self, chapter, verse=None, subverse=0, rubric=False, text=None):
+        self.chapter = chapter
+        self.verse = verse
+        self.subverse = subverse
+        self.rubric = rubric
+        if text is None:
+            if rubric:
+                text = RUBRIC
+            elif subverse:
+                text = '%s.%s' % (verse, subverse)
+            else:
+                text = str(verse)
+        self.text = text
+        if isinstance(chapter, int):
+            chapter_key = (0, chapter, '')
+        else:
+            chapter_key = (1, 0, chapter)
+        if rubric:
+            verse_key = (0, 0, 0, '')
+        elif isinstance(verse, int):
+            verse_key = (1, verse, subverse, '')
+        else:
+            verse_key = (2, 0, 0, verse)
+        # the text tells apart the different ways of writing the same verse
+        self.sort_key = chapter_key + verse_key + (text,)
+
+    @classmethod
+    def from_parts(cls, chapter, verse):
+        """Make a VerseKey from the chapter and verse strings of a key."""
+        try:
+            chapter = int(chapter)
+        except ValueError:
+            pass
+        if verse.lower() == RUBRIC.lower():
+            return cls(chapter, rubric=True, text=verse)
+        match = VERSE_PATTERN.match(verse)
+        if match is None:
+            return cls(chapter, verse)
+        if match.group(3):
+            subverse = 1
+        else:
+            subverse = int(match.group(2) or 0)
+        return cls(chapter, int(match.group(1)), subverse, text=verse)
+
+    @classmethod
+    def parse(cls, key):
+        """Make a VerseKey from a D[chapter]S[verse] key, raising ValueError if it isn't one."""
+        match = KEY_PATTERN.match(key)
+        if match is None:
+            raise ValueError('%s is not a verse key' % key)
+        return cls.from_parts(match.group(1), match.group(2))
+
+    def value(self):
+        """Return the verse as it is listed in collations.json.
+
+        This is 'Rubric', the verse number or the verse string, except that
+        400> and 659.1 are listed as 400 and 659 as they always have been."""
+        if self.rubric:
+            return RUBRIC
+        if self.text in TRUNCATED_VERSES or (isinstance(self.verse, int) and not self.subverse):
+            return self.verse
+        return self.text
+
+    def __str__(self):
+        return format_key(self.chapter, self.text)
+
+    def __repr__(self):
+        return 'VerseKey(%r)' % str(self)
+
+    def __eq__(self, other):
+        if not isinstance(other, VerseKey):
+            return NotImplemented
+        return self.sort_key == other.sort_key
+
+    def __lt__(self, other):
+        if not isinstance(other, VerseKey):
+            return NotImplemented
+        return self.sort_key < other.sort_key
+
+    def __hash__(self):
+        return hash(self.sort_key)
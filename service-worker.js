@@ -0,0 +1,152 @@
+"use strict";
+
+// The service worker registered by main.js. It must be served from the same
+// directory as the edition page so that its scope covers the page and the
+// data, whose path main.js passes in the data parameter of the url.
+//
+// The files listed in precache.json in the data directory (see
+// scripts/make_precache_manifest.py) are kept in the precache and always
+// served from it. The manifest is fetched again in the background on each
+// visit and when its version changes only the files whose hashes have changed
+// are fetched. The shell of the edition page (the files in SHELL) is served
+// from the runtime cache when it is there while a fresh copy is fetched for
+// the next visit. Everything else, including the rest of the data and any
+// other pages on the same site, is left to the network.
+
+const DATA_PATH = new URL(self.location.href).searchParams.get('data') || 'data/';
+const MANIFEST_FILE = 'precache.json';
+const PRECACHE = 'estoria-precache';
+const RUNTIME = 'estoria-runtime';
+// the files of the page itself relative to the scope, those ending in / are
+// directories whose files are all included
+const SHELL = ['', 'index.html', 'main.js', 'main.css', 'estoria.css',
+               'junicode-woff/', 'images/'];
+
+// the update of the precache which is running, shared by every request for one
+let UPDATING = null;
+
+function data_url(path) {
+    return new URL(DATA_PATH + path, self.registration.scope).href;
+}
+
+function is_shell(request) {
+    const url = new URL(request.url);
+    const scope = new URL(self.registration.scope);
+    if (request.headers.has('range') || url.origin !== scope.origin
+            || !url.pathname.startsWith(scope.pathname)) {
+        return false;
+    }
+    const path = url.pathname.substring(scope.pathname.length);
+    return SHELL.some(function (shell) {
+        return shell.endsWith('/') ? path.startsWith(shell) : path === shell;
+    });
+}
+
+function refresh_precache() {
+    if (UPDATING === null) {
+        UPDATING = update_precache().catch(function () {}).then(function () {
+            UPDATING = null;
+        });
+    }
+    return UPDATING;
+}
+
+async function update_precache() {
+    const response = await fetch(data_url(MANIFEST_FILE), {cache: 'no-cache'});
+    if (!response.ok) {
+        return;
+    }
+    const manifest = await response.clone().json();
+    const cache = await caches.open(PRECACHE);
+    const stored = await cache.match(data_url(MANIFEST_FILE));
+    const previous = stored ? await stored.json() : {version: null, files: {}};
+    if (previous.version === manifest.version) {
+        return;
+    }
+    const changed = [];
+    for (const path in manifest.files) {
+        if (previous.files[path] !== manifest.files[path]
+                || (await cache.match(data_url(path))) === undefined) {
+            changed.push(path);
+        }
+    }
+    const fetched = await Promise.all(changed.map(async function (path) {
+        try {
+            const file = await fetch(data_url(path), {cache: 'no-cache'});
+            if (file.ok) {
+                await cache.put(data_url(path), file);
+                return true;
+            }
+        } catch (error) {
+        }
+        return false;
+    }));
+    for (const path in previous.files) {
+        if (!manifest.files.hasOwnProperty(path)) {
+            await cache.delete(data_url(path));
+        }
+    }
+    // only store the new manifest once every changed file has arrived so that
+    // the missing ones are fetched next time
+    if (fetched.every(Boolean)) {
+        await cache.put(data_url(MANIFEST_FILE), response);
+    }
+}
+
+async function from_precache(request) {
+    const url = new URL(request.url);
+    url.search = '';
+    const cache = await caches.open(PRECACHE);
+    const stored = await cache.match(data_url(MANIFEST_FILE));
+    if (stored === undefined || url.href === data_url(MANIFEST_FILE)) {
+        return undefined;
+    }
+    return cache.match(url.href);
+}
+
+async function from_runtime(event) {
+    const cache = await caches.open(RUNTIME);
+    const cached = await cache.match(event.request);
+    const network = fetch(event.request).then(function (response) {
+        if (response.ok) {
+            cache.put(event.request, response.clone());
+        }
+        return response;
+    });
+    if (cached !== undefined) {
+        event.waitUntil(network.catch(function () {}));
+        return cached;
+    }
+    return network;
+}
+
+async function respond(event) {
+    const precached = await from_precache(event.request);
+    if (precached !== undefined) {
+        return precached;
+    }
+    if (is_shell(event.request)) {
+        return from_runtime(event);
+    }
+    return fetch(event.request);
+}
+
+self.addEventListener('install', function (event) {
+    event.waitUntil(refresh_precache().then(function () {
+        return self.skipWaiting();
+    }));
+});
+
+self.addEventListener('activate', function (event) {
+    event.waitUntil(self.clients.claim());
+});
+
+self.addEventListener('fetch', function (event) {
+    if (event.request.method !== 'GET' || new URL(event.request.url).origin !== self.location.origin) {
+        return;
+    }
+    if (event.request.mode === 'navigate') {
+        event.waitUntil(refresh_precache());
+    }
+    event.respondWith(respond(event));
+});